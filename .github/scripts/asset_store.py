@@ -0,0 +1,180 @@
+import html
+import io
+import os
+import tempfile
+
+from response_cache import sha256_file
+
+# Root directory of the per-paper figure assets, relative to the site root
+ASSETS_DIR = "assets/papers"
+# Hex digits of the SHA-256 used in asset file names
+ASSET_HASH_LENGTH = 16
+# Widths of the resized variants; the smallest doubles as thumbnail, none exceeds the original
+VARIANT_WIDTHS = (480, 1200)
+# Encoder quality of the variants, tuned for diagrams and charts with sharp edges
+WEBP_QUALITY = 80
+AVIF_QUALITY = 60
+# AVIF encoder speed (0-10); the default spends several times longer for a few percent smaller files
+AVIF_SPEED = 8
+# Resizing first reduces by an integer factor down to this multiple of the target size, which is much faster
+RESIZE_REDUCING_GAP = 2.0
+# Layout width of the post content, used in the sizes attribute of the srcset
+CONTENT_WIDTH = 800
+
+
+def _write_atomic(path, data):
+    """Write bytes to a hidden temporary file next to path and rename it into place."""
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _variant_formats():
+    """Return (format, MIME type, extension, encoder options) of the variant formats this Pillow build can encode."""
+    from PIL import features
+
+    formats = []
+    # AVIF is listed first so browsers supporting it prefer it over WebP
+    if features.check("avif"):
+        formats.append(("AVIF", "image/avif", "avif", {'quality': AVIF_QUALITY, 'speed': AVIF_SPEED}))
+    if features.check("webp"):
+        formats.append(("WEBP", "image/webp", "webp", {'quality': WEBP_QUALITY}))
+    return formats
+
+
+def store_figure(paper_name, figure_path):
+    """
+    Add a figure and its resized variants to the content-addressed asset store of a paper.
+
+    Files are named by the hash of the figure bytes, e.g. assets/papers/<id>/<sha>.png
+    and <sha>-480.webp, so a figure selected for several audiences, or by a
+    later run, is stored once. Files that already exist are not written again.
+
+    Args:
+        paper_name (str): Paper file name without extension
+        figure_path (str): Path of the figure file written by spill_figures
+
+    Returns:
+        dict: 'src' (site path of the original), 'width', 'height' and 'sources',
+            a list of {'type', 'srcset'} dicts with the variants per format
+    """
+    from PIL import Image
+
+    paper_assets_dir = os.path.join(ASSETS_DIR, paper_name)
+    os.makedirs(paper_assets_dir, exist_ok=True)
+    digest = sha256_file(figure_path)[:ASSET_HASH_LENGTH]
+    extension = os.path.splitext(figure_path)[1]
+    site_dir = f"/{ASSETS_DIR}/{paper_name}"
+
+    original_path = os.path.join(paper_assets_dir, f"{digest}{extension}")
+    written = 0
+    if not os.path.exists(original_path):
+        with open(figure_path, "rb") as f:
+            _write_atomic(original_path, f.read())
+        written += 1
+
+    with Image.open(figure_path) as image:
+        width, height = image.size
+        widths = sorted({min(variant_width, width) for variant_width in VARIANT_WIDTHS})
+        formats = _variant_formats()
+        missing = {
+            variant_width for variant_width in widths for _, _, variant_extension, _ in formats
+            if not os.path.exists(os.path.join(paper_assets_dir, f"{digest}-{variant_width}.{variant_extension}"))
+        }
+        resized = {}
+        if missing:
+            # Decode once, letting the JPEG decoder downscale by a power of two first, then resize
+            # from the largest width down, each variant from the previous one
+            largest = max(missing)
+            if image.format == "JPEG":
+                image.draft("RGB", (largest, round(height * largest / width)))
+            previous = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            for variant_width in sorted(missing, reverse=True):
+                variant_size = (variant_width, max(1, round(height * variant_width / width)))
+                if previous.size != variant_size:
+                    previous = previous.resize(variant_size, Image.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP)
+                resized[variant_width] = previous
+
+        sources = []
+        for image_format, mime_type, variant_extension, options in formats:
+            srcset = []
+            for variant_width in widths:
+                name = f"{digest}-{variant_width}.{variant_extension}"
+                variant_path = os.path.join(paper_assets_dir, name)
+                if not os.path.exists(variant_path):
+                    buffer = io.BytesIO()
+                    resized[variant_width].save(buffer, image_format, **options)
+                    _write_atomic(variant_path, buffer.getvalue())
+                    written += 1
+                srcset.append(f"{site_dir}/{name} {variant_width}w")
+            sources.append({'type': mime_type, 'srcset': ", ".join(srcset)})
+
+    print(f"Stored figure {digest} ({width}x{height}, {len(sources)} variant formats, {written} new files)")
+    return {
+        'src': f"{site_dir}/{digest}{extension}",
+        'width': width,
+        'height': height,
+        'sources': sources,
+    }
+
+
+def picture_html(asset, alt):
+    """
+    Format a stored figure as a responsive <picture> element for a Markdown post.
+
+    Args:
+        asset (dict): Result of store_figure
+        alt (str): Alternative text of the image
+
+    Returns:
+        str: The element on a single line, so Markdown passes it through unchanged
+    """
+    sizes = f"(max-width: {CONTENT_WIDTH}px) 100vw, {CONTENT_WIDTH}px"
+    sources = "".join(
+        f'<source type="{source["type"]}" srcset="{source["srcset"]}" sizes="{sizes}">'
+        for source in asset['sources']
+    )
+    # The intrinsic size lets the browser reserve the space of a lazy-loaded figure before it arrives
+    return (f'<picture>{sources}<img src="{asset["src"]}" alt="{html.escape(alt)}" '
+            f'width="{asset["width"]}" height="{asset["height"]}" loading="lazy" decoding="async"></picture>')
+
+
+def prune_paper_assets(paper_name, assets):
+    """
+    Remove the files in the asset store of a paper that none of the given figures use.
+
+    Re-summarizing a paper rewrites all of its posts, which leaves the files of
+    figures that are no longer selected unreferenced, as well as the
+    <level>_fig.png files written before the store was content-addressed.
+
+    Args:
+        paper_name (str): Paper file name without extension
+        assets (list): Results of store_figure referenced by the posts of the paper
+
+    Returns:
+        int: Number of removed files
+    """
+    paper_assets_dir = os.path.join(ASSETS_DIR, paper_name)
+    if not os.path.isdir(paper_assets_dir):
+        return 0
+    keep = {os.path.basename(asset['src']) for asset in assets}
+    keep.update(
+        os.path.basename(candidate.split()[0])
+        for asset in assets for source in asset['sources'] for candidate in source['srcset'].split(", ")
+    )
+    removed = 0
+    for name in os.listdir(paper_assets_dir):
+        # Hidden files are temporary files of writes in progress
+        if name not in keep and not name.startswith("."):
+            os.unlink(os.path.join(paper_assets_dir, name))
+            removed += 1
+    if removed:
+        print(f"Removed {removed} unreferenced asset files of {paper_name}")
+    return removed
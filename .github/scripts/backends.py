@@ -0,0 +1,171 @@
+import itertools
+import json
+import random
+import threading
+import time
+import types
+
+
+class GeminiBackend:
+    """
+    Model and file API backed by the google.generativeai SDK.
+
+    GeminiClient makes every request through a backend, so the pipeline can run
+    against FakeBackend without an API key or network. The SDK, which pulls in
+    grpc and protobuf, is only imported when the backend is created.
+    """
+
+    def __init__(self, api_key=None):
+        import google.generativeai as genai
+
+        self._genai = genai
+        if api_key:
+            genai.configure(api_key=api_key)
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, model_name):
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = self._genai.GenerativeModel(model_name)
+            return self._models[model_name]
+
+    def upload_file(self, path, mime_type=None, display_name=None):
+        return self._genai.upload_file(path=path, mime_type=mime_type, display_name=display_name)
+
+    def delete_file(self, name):
+        self._genai.delete_file(name)
+
+    def generate_content(self, model_name, contents, generation_config=None, stream=False, timeout=None):
+        return self._model(model_name).generate_content(
+            contents, generation_config=generation_config, stream=stream, request_options={"timeout": timeout}
+        )
+
+
+class FakeBackend:
+    """
+    Local stand-in for the Gemini API returning synthetic responses.
+
+    Text prompts get a summary-like text of output_words words and JSON calls
+    a JSON object that satisfies the metadata, figure selection and translation parsers,
+    limited to the properties of the response schema if one is given. Text is cut
+    off at max_output_tokens like a real response.
+    Every call sleeps for a jittered latency and fails with a 503 at the given
+    error rate, or with a timeout if the latency exceeds the request timeout, so
+    retries and concurrency behave as against the real API.
+    """
+
+    def __init__(self, latency=1.0, latency_jitter=0.25, output_words=300, error_rate=0.0,
+                 file_tokens=2000, seed=None):
+        """
+        Args:
+            latency (float): Mean seconds per generate_content call
+            latency_jitter (float): Relative jitter of the latency, e.g. 0.25 for +-25%
+            output_words (int): Words in each synthetic text response
+            error_rate (float): Probability of a call failing with ServiceUnavailable
+            file_tokens (int): Prompt tokens counted for each uploaded file in a prompt
+            seed (int): Seed of the random generator, for reproducible runs
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.output_words = output_words
+        self.error_rate = error_rate
+        self.file_tokens = file_tokens
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _sleep(self, seconds, timeout=None):
+        with self._lock:
+            jitter = self._random.uniform(-self.latency_jitter, self.latency_jitter)
+            failed = self._random.random() < self.error_rate
+        seconds = max(0.0, seconds * (1 + jitter))
+        if timeout is not None and seconds > timeout:
+            time.sleep(max(0.0, timeout))
+            raise TimeoutError("fake backend: request timed out")
+        time.sleep(seconds)
+        if failed:
+            from google.api_core import exceptions as google_exceptions
+
+            raise google_exceptions.ServiceUnavailable("fake backend: simulated overload")
+
+    def upload_file(self, path, mime_type=None, display_name=None):
+        self._sleep(self.latency / 10)
+        if hasattr(path, "getbuffer"):
+            size = path.getbuffer().nbytes
+        else:
+            with open(path, "rb") as f:
+                size = len(f.read())
+        return types.SimpleNamespace(
+            name=f"files/fake-{next(self._ids)}", display_name=display_name,
+            mime_type=mime_type or "application/pdf", size_bytes=size,
+        )
+
+    def delete_file(self, name):
+        self._sleep(self.latency / 20)
+
+    @staticmethod
+    def _json_response(schema, summary):
+        """Return a JSON value for a response schema, or the object with every known key without one."""
+        known = {
+            'title': "A Synthetic Study of Offline Benchmarks",
+            'authors': "Ada Lovelace, Alan Turing",
+            'date': "2025-01-15",
+            'university': 1,
+            'high_school': 1,
+            'child': None,
+            'university_summary': summary,
+            'high_school_summary': summary,
+            'child_summary': summary,
+        }
+        if not schema:
+            return known
+
+        defaults = {'STRING': summary, 'INTEGER': 1, 'NUMBER': 1.0, 'BOOLEAN': True, 'ARRAY': []}
+
+        def value(key, node):
+            if node['type'] == "OBJECT":
+                return {name: value(name, child) for name, child in node.get('properties', {}).items()}
+            default = defaults[node['type']]
+            # Known values only fit where the schema has their type, e.g. not 'child' as the revised text
+            if key in known and (isinstance(known[key], type(default)) or known[key] is None and node.get('nullable')):
+                return known[key]
+            return default
+
+        return value(None, schema)
+
+    def generate_content(self, model_name, contents, generation_config=None, stream=False, timeout=None):
+        self._sleep(self.latency, timeout)
+        if not isinstance(contents, (list, tuple)):
+            contents = [contents]
+        prompt_tokens = sum(len(part) // 4 if isinstance(part, str) else self.file_tokens for part in contents)
+
+        words = ("Forskerne", "viser", "at", "modellen", "lærer", "raskere", "med", "færre", "eksempler.")
+        summary = " ".join(words[i % len(words)] for i in range(self.output_words))
+        config = generation_config or {}
+        if config.get("response_mime_type") == "application/json":
+            text = json.dumps(self._json_response(config.get("response_schema"), summary), ensure_ascii=False)
+        else:
+            text = summary
+            if config.get("max_output_tokens"):
+                text = text[:config["max_output_tokens"] * 4]
+        usage = types.SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=len(text) // 4,
+            cached_content_token_count=0,
+        )
+        return FakeResponse(text, usage, chunks=8 if stream else 1)
+
+
+class FakeResponse:
+    """Synthetic response with the text, usage_metadata and chunk iteration of a Gemini response."""
+
+    def __init__(self, text, usage_metadata, chunks=1):
+        self.text = text
+        self.usage_metadata = usage_metadata
+        self._chunks = chunks
+
+    def __iter__(self):
+        size = -(-len(self.text) // self._chunks)
+        for start in range(0, len(self.text), size):
+            yield types.SimpleNamespace(text=self.text[start:start + size])
@@ -0,0 +1,331 @@
+"""
+Offline benchmark of the summarization pipeline against FakeBackend.
+
+Runs summarize_batch over the PDFs in _papers/ plus synthetic long and
+figure-heavy PDFs at several concurrency levels, each level in a fresh worker
+process, and reports per-stage wall time, peak RSS and throughput, plus the
+import time of summarize.py measured with -X importtime:
+
+    python .github/scripts/benchmark.py --max-papers 1 3 --max-concurrency 1 4
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fitz
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(SCRIPT_DIR))
+
+LOREM = ("The proposed method improves sample efficiency by reusing intermediate results across "
+         "training episodes while keeping the memory footprint constant. ")
+
+
+def make_long_pdf(path, pages):
+    """
+    Write a synthetic text-only paper with a title page and numbered sections.
+
+    Args:
+        path (str): Output path
+        pages (int): Number of pages
+    """
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        y = 72
+        if number == 0:
+            page.insert_text((72, y), "A Synthetic Long Paper for Benchmarking", fontsize=18)
+            page.insert_text((72, y + 28), "Ada Lovelace, Alan Turing", fontsize=11)
+            y += 60
+        page.insert_text((72, y), f"{number + 1} Section {number + 1}", fontsize=13)
+        page.insert_textbox(fitz.Rect(72, y + 16, 540, 760), LOREM * 30, fontsize=10)
+    doc.save(path, deflate=True)
+    doc.close()
+
+
+def make_figure_pdf(path, pages, figures_per_page, seed=0):
+    """
+    Write a synthetic paper with distinct raster figures and captions on every page.
+
+    Args:
+        path (str): Output path
+        pages (int): Number of pages
+        figures_per_page (int): Figures placed on each page
+        seed (int): Seed of the random image content
+    """
+    rng = np.random.default_rng(seed)
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        if number == 0:
+            page.insert_text((72, 72), "A Synthetic Figure-Heavy Paper for Benchmarking", fontsize=18)
+        height = 600 / figures_per_page
+        for index in range(figures_per_page):
+            # Smooth random gradients plus noise, so figures are neither blank nor near-duplicates
+            size = int(rng.integers(200, 500))
+            x = np.linspace(0, rng.uniform(1, 6), size)
+            base = np.outer(np.sin(x + rng.uniform(0, 3)), np.cos(x * rng.uniform(0.5, 2)))
+            channels = [(base * rng.uniform(60, 120) + rng.uniform(60, 190) + rng.normal(0, 12, base.shape))
+                        for _ in range(3)]
+            samples = np.clip(np.stack(channels, axis=-1), 0, 255).astype(np.uint8)
+            pix = fitz.Pixmap(fitz.csRGB, size, size, samples.tobytes(), False)
+            top = 100 + index * height
+            rect = fitz.Rect(72, top, 72 + height - 30, top + height - 30)
+            page.insert_image(rect, pixmap=pix)
+            page.insert_text((72, rect.y1 + 14), f"Figure {number * figures_per_page + index + 1}: Synthetic result.",
+                             fontsize=9)
+    doc.save(path, deflate=True)
+    doc.close()
+
+
+def build_corpus(corpus_dir, synthetic=True, long_pages=120, figure_pages=20, figures_per_page=3):
+    """
+    Collect the benchmark corpus: the papers in _papers/ and optional synthetic PDFs.
+
+    Args:
+        corpus_dir (str): Directory the synthetic PDFs are written to
+        synthetic (bool): Also generate the synthetic PDFs
+        long_pages (int): Pages of the synthetic long paper
+        figure_pages (int): Pages of the synthetic figure-heavy paper
+        figures_per_page (int): Figures per page of the figure-heavy paper
+
+    Returns:
+        list: Absolute paths of the corpus PDFs
+    """
+    papers = sorted(glob.glob(os.path.join(REPO_ROOT, "_papers", "*.pdf")))
+    if synthetic:
+        long_path = os.path.join(corpus_dir, "synthetic-long.pdf")
+        make_long_pdf(long_path, long_pages)
+        figure_path = os.path.join(corpus_dir, "synthetic-figures.pdf")
+        make_figure_pdf(figure_path, figure_pages, figures_per_page)
+        papers += [long_path, figure_path]
+    return papers
+
+
+def measure_startup():
+    """
+    Measure the import time of summarize.py with -X importtime and the wall time of --help.
+
+    Returns:
+        dict: Total import time in ms, the slowest direct imports and the --help wall time in seconds
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import summarize"],
+                               cwd=SCRIPT_DIR, capture_output=True, text=True, check=True)
+    total_ms = 0.0
+    direct = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        # Imports are listed children first, so the direct imports of summarize precede it
+        if depth == 0:
+            if name.strip() == "summarize":
+                total_ms = int(cumulative) / 1000
+                break
+            direct = []
+        elif depth == 1:
+            direct.append((name.strip(), int(cumulative) / 1000))
+    direct.sort(key=lambda item: item[1], reverse=True)
+
+    started_at = time.monotonic()
+    subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, "summarize.py"), "--help"],
+                   capture_output=True, check=True)
+    help_time = time.monotonic() - started_at
+    return {
+        'import_ms': round(total_ms, 1),
+        'slowest_imports_ms': {name: round(ms, 1) for name, ms in direct[:5]},
+        'help_wall_time': round(help_time, 3),
+    }
+
+
+def stage_timings(spans):
+    """
+    Aggregate the wall time of traced stages.
+
+    Args:
+        spans (list): Finished span records from the tracer
+
+    Returns:
+        dict: Mapping of stage name to count, total and mean wall time in seconds
+    """
+    stages = {}
+    for span in spans:
+        if span['name'] == 'stage':
+            stages.setdefault(span['attributes']['stage'], []).append(span['duration'])
+    return {
+        name: {'count': len(durations), 'total': round(sum(durations), 3),
+               'mean': round(sum(durations) / len(durations), 3)}
+        for name, durations in sorted(stages.items())
+    }
+
+
+def run_worker(args):
+    """Run one concurrency level in this process and write its measurements as JSON."""
+    from backends import FakeBackend
+    from rate_limiter import RateLimiter
+    from summarize import configure_gemini, summarize_batch
+    from tracing import TRACER
+
+    backend = FakeBackend(latency=args.latency, output_words=args.output_words, error_rate=args.error_rate,
+                          seed=args.seed)
+    client = configure_gemini(
+        rate_limiter=RateLimiter(args.requests_per_minute, args.tokens_per_minute), streaming=False, backend=backend
+    )
+    started_at = time.monotonic()
+    papers, failed = summarize_batch(
+        args.papers, max_papers=args.max_papers[0], max_concurrency=args.max_concurrency[0], client=client,
+        checkpoint_dir="checkpoints"
+    )
+    wall_time = time.monotonic() - started_at
+
+    result = {
+        'max_papers': args.max_papers[0],
+        'max_concurrency': args.max_concurrency[0],
+        'papers': len(papers),
+        'failed': len(failed),
+        'wall_time': round(wall_time, 3),
+        'papers_per_minute': round(len(papers) * 60 / wall_time, 2) if wall_time else 0.0,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'api_calls': client.usage.summary()['totals']['calls'],
+        'stages': stage_timings(TRACER.finished_spans()),
+    }
+    with open(args.result, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+
+def run_level(args, papers, work_dir, max_papers, max_concurrency):
+    """
+    Run one concurrency level in a fresh worker process.
+
+    Args:
+        args: Parsed command line arguments
+        papers (list): Corpus PDF paths
+        work_dir (str): Directory for the run's outputs and log
+        max_papers (int): Papers processed at the same time
+        max_concurrency (int): Stages running at the same time per paper
+
+    Returns:
+        dict: Measurements of the run
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    result_path = os.path.join(work_dir, "result.json")
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", "--result", result_path,
+        "--max-papers", str(max_papers), "--max-concurrency", str(max_concurrency),
+        "--latency", str(args.latency), "--output-words", str(args.output_words),
+        "--error-rate", str(args.error_rate), "--seed", str(args.seed),
+        "--requests-per-minute", str(args.requests_per_minute), "--tokens-per-minute", str(args.tokens_per_minute),
+        "--papers", *papers,
+    ]
+    log_path = os.path.join(work_dir, "run.log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        completed = subprocess.run(command, cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Benchmark worker failed with exit code {completed.returncode}, see {log_path}")
+    with open(result_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def format_results(results):
+    """
+    Format the benchmark results as plain text tables.
+
+    Args:
+        results (list): Measurements returned by run_level
+
+    Returns:
+        str: Throughput table followed by the mean stage wall times per level
+    """
+    header = f"{'papers x stages':<16} {'wall s':>8} {'papers/min':>11} {'peak RSS MB':>12} {'calls':>6} {'failed':>7}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(f"{str(r['max_papers']) + ' x ' + str(r['max_concurrency']):<16} {r['wall_time']:>8.1f} "
+                     f"{r['papers_per_minute']:>11.2f} {r['peak_rss_mb']:>12.1f} {r['api_calls']:>6} {r['failed']:>7}")
+
+    stage_names = sorted({name for r in results for name in r['stages']})
+    levels = [f"{r['max_papers']}x{r['max_concurrency']}" for r in results]
+    lines += ["", f"{'mean stage s':<24} " + " ".join(f"{level:>8}" for level in levels)]
+    for name in stage_names:
+        cells = [r['stages'].get(name, {}).get('mean') for r in results]
+        lines.append(f"{name[:24]:<24} " + " ".join(f"{c:>8.2f}" if c is not None else f"{'-':>8}" for c in cells))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark summarize.py offline with a fake Gemini backend.")
+    parser.add_argument("--max-papers", type=int, nargs="+", default=[1, 3],
+                        help="Papers processed at the same time; one run per value (default: 1 3)")
+    parser.add_argument("--max-concurrency", type=int, nargs="+", default=[4],
+                        help="Stages running at the same time per paper; one run per value (default: 4)")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean seconds per fake model call (default: 0.5)")
+    parser.add_argument("--output-words", type=int, default=300, help="Words per fake text response (default: 300)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Probability of a fake call failing with a retryable 503 (default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the fake backend (default: 0)")
+    parser.add_argument("--requests-per-minute", type=int, default=100_000,
+                        help="Rate limit of the run; high by default so the pipeline, not the quota, is measured")
+    parser.add_argument("--tokens-per-minute", type=int, default=1_000_000_000,
+                        help="Token rate limit of the run (default: effectively unlimited)")
+    parser.add_argument("--no-synthetic", action="store_true", help="Only benchmark the PDFs in _papers/")
+    parser.add_argument("--long-pages", type=int, default=120, help="Pages of the synthetic long paper (default: 120)")
+    parser.add_argument("--figure-pages", type=int, default=20,
+                        help="Pages of the synthetic figure-heavy paper, with 3 figures per page (default: 20)")
+    parser.add_argument("--output", help="Write all measurements as JSON to this path")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory with logs and posts")
+    # Internal: run a single level in this process
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    parser.add_argument("--papers", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="summarize_benchmark_")
+    print(f"=== Building benchmark corpus in {work_dir} ===")
+    papers = build_corpus(work_dir, synthetic=not args.no_synthetic, long_pages=args.long_pages,
+                          figure_pages=args.figure_pages)
+    for path in papers:
+        print(f"  {os.path.basename(path)} ({os.path.getsize(path) // 1024} KB)")
+
+    startup = measure_startup()
+    print(f"=== Startup ===")
+    print(f"import summarize: {startup['import_ms']:.0f} ms, summarize.py --help: {startup['help_wall_time']:.2f}s")
+    for name, ms in startup['slowest_imports_ms'].items():
+        print(f"  {name}: {ms:.1f} ms")
+
+    results = []
+    for max_papers, max_concurrency in itertools.product(args.max_papers, args.max_concurrency):
+        print(f"=== Running {len(papers)} papers with {max_papers} papers x {max_concurrency} stages in parallel ===")
+        result = run_level(args, papers, os.path.join(work_dir, f"run_{max_papers}x{max_concurrency}"),
+                           max_papers, max_concurrency)
+        print(f"Finished in {result['wall_time']:.1f}s ({result['papers_per_minute']:.2f} papers/min)")
+        results.append(result)
+
+    print(f"=== Benchmark results ===")
+    print(format_results(results))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({'corpus': [os.path.basename(p) for p in papers], 'startup': startup, 'results': results}, f,
+                      indent=2)
+        print(f"Results written to: {args.output}")
+    if args.keep:
+        print(f"Working directory kept: {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
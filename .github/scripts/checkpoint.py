@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from response_cache import sha256_file
+
+DEFAULT_CHECKPOINT_DIR = ".cache/summarize/checkpoints"
+
+
+class PaperCheckpoint:
+    """
+    Per-paper JSON file with the outputs of finished pipeline stages.
+
+    Every stage output is written as soon as the stage finishes, so a run that
+    fails late keeps everything computed before the failure. The checkpoint is
+    keyed by the SHA-256 of the PDF, the pipeline version and the run options;
+    a checkpoint written for different inputs is discarded instead of resumed.
+    """
+
+    def __init__(self, paper_path, pipeline_version, options=None, checkpoint_dir=DEFAULT_CHECKPOINT_DIR,
+                 resume=False):
+        """
+        Args:
+            paper_path (str): Path to the paper PDF
+            pipeline_version (int): Version of the prompts and stage outputs
+            options (dict): Run options that change stage outputs, e.g. the model name
+            checkpoint_dir (str): Directory of the checkpoint files
+            resume (bool): Load the outputs of a previous run; otherwise start empty
+        """
+        paper_name = os.path.splitext(os.path.basename(paper_path))[0]
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.path = os.path.join(checkpoint_dir, f"{paper_name}.json")
+        self.key = {
+            'pdf_sha256': sha256_file(paper_path),
+            'pipeline_version': pipeline_version,
+            'options': options or {},
+        }
+        self.stages = {}
+        self._lock = threading.Lock()
+        if resume:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            print(f"No checkpoint found at {self.path}, running all stages")
+            return
+        except Exception as e:
+            print(f"WARNING: Ignoring unreadable checkpoint {self.path}: {e}")
+            return
+
+        if data.get('key') != self.key:
+            print(f"Checkpoint {self.path} was written for a different PDF, pipeline version or options, ignoring it")
+            return
+        self.stages = data.get('stages', {})
+        print(f"Loaded checkpoint {self.path} with {len(self.stages)} finished stages")
+
+    def save(self, name, value):
+        """
+        Store the output of a finished stage and write the checkpoint file atomically.
+
+        Args:
+            name (str): Stage name
+            value: JSON serializable stage output
+
+        Returns:
+            The stage output, unchanged
+        """
+        with self._lock:
+            self.stages[name] = value
+            data = {'key': self.key, 'updated_at': time.time(), 'stages': self.stages}
+            fd, tmp_path = tempfile.mkstemp(prefix=".checkpoint_", dir=os.path.dirname(self.path))
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        return value
+
+    def wrap(self, name, func):
+        """
+        Wrap a stage function so its result is checkpointed when it finishes.
+
+        Args:
+            name (str): Stage name
+            func: Stage function taking the results dict
+
+        Returns:
+            Stage function with the same signature
+        """
+        return lambda results: self.save(name, func(results))
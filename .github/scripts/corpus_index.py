@@ -0,0 +1,256 @@
+"""
+Incremental index of locally extracted paper content.
+
+Run it directly to index or refresh every PDF in a directory:
+
+    python .github/scripts/corpus_index.py _papers
+"""
+import argparse
+import glob
+import json
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from figures import iter_figures
+from paper_metadata import extract_local_metadata
+from response_cache import sha256_file
+
+DEFAULT_INDEX_DIR = ".cache/summarize/corpus"
+# Bump when the extracted content changes so existing entries are indexed again
+INDEX_VERSION = 2
+
+
+class CorpusIndex:
+    """
+    Persistent index of page text, outline, figure manifests and local metadata per paper.
+
+    Entries are stored in SQLite and keyed by the SHA-256 of the PDF, so identical
+    content under several paths is extracted once. Page texts are zlib-compressed
+    and appended to a single blob file that is read through mmap, so looking up
+    one page does not load the others. A path whose size and mtime are unchanged
+    is served without reading the PDF at all; otherwise it is hashed and only
+    re-extracted if its content changed. Blob space of replaced content is not
+    reclaimed until the index is cleared.
+    """
+
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR):
+        os.makedirs(index_dir, exist_ok=True)
+        self.path = os.path.join(index_dir, "index.sqlite")
+        self.blob_path = os.path.join(index_dir, "pages.bin")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS papers ("
+            " path TEXT PRIMARY KEY,"
+            " sha256 TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime REAL NOT NULL,"
+            " metadata TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " sha256 TEXT PRIMARY KEY,"
+            " version INTEGER NOT NULL,"
+            " page_count INTEGER NOT NULL,"
+            " toc TEXT NOT NULL,"
+            " figures TEXT NOT NULL,"
+            " indexed_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " sha256 TEXT NOT NULL,"
+            " page INTEGER NOT NULL,"
+            " offset INTEGER NOT NULL,"
+            " length INTEGER NOT NULL,"
+            " PRIMARY KEY (sha256, page));"
+        )
+        self._conn.commit()
+        open(self.blob_path, "ab").close()
+        self._blob = open(self.blob_path, "r+b")
+        self._map = None
+
+    @staticmethod
+    def _key(paper_path):
+        return os.path.abspath(paper_path)
+
+    def _current_row(self, paper_path, stat):
+        row = self._conn.execute(
+            "SELECT p.sha256, p.size, p.mtime, p.metadata, d.version FROM papers p"
+            " LEFT JOIN documents d ON d.sha256 = p.sha256 WHERE p.path = ?",
+            (self._key(paper_path),)
+        ).fetchone()
+        if row and row[1] == stat.st_size and row[2] == stat.st_mtime and row[4] == INDEX_VERSION:
+            return row
+        return None
+
+    def get_entry(self, paper_path):
+        """
+        Look up the indexed content of a paper if the file has not changed since it was indexed.
+
+        Args:
+            paper_path (str): Path to the PDF file
+
+        Returns:
+            dict: 'sha256', 'page_count', 'toc', 'figures' and 'metadata', or None if missing or stale
+        """
+        stat = os.stat(paper_path)
+        with self._lock:
+            row = self._current_row(paper_path, stat)
+            if row is None:
+                return None
+            document = self._conn.execute(
+                "SELECT page_count, toc, figures FROM documents WHERE sha256 = ?", (row[0],)
+            ).fetchone()
+        return {
+            'sha256': row[0],
+            'page_count': document[0],
+            'toc': json.loads(document[1]),
+            'figures': json.loads(document[2]),
+            'metadata': json.loads(row[3]),
+        }
+
+    def page_texts(self, sha256):
+        """
+        Read the text of every page of an indexed document.
+
+        Args:
+            sha256 (str): Content digest from the entry
+
+        Returns:
+            list: Page texts in page order
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT offset, length FROM pages WHERE sha256 = ? ORDER BY page", (sha256,)
+            ).fetchall()
+            if rows and (self._map is None or rows[-1][0] + rows[-1][1] > len(self._map)):
+                # The blob file grew since it was mapped
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._blob.fileno(), 0, access=mmap.ACCESS_READ)
+            return [zlib.decompress(self._map[offset:offset + length]).decode("utf-8") for offset, length in rows]
+
+    def _extract(self, paper_path):
+        import fitz
+
+        with fitz.open(paper_path) as doc:
+            page_texts = [page.get_text() for page in doc]
+            toc = doc.get_toc()
+        return page_texts, toc, list(iter_figures(paper_path))
+
+    def update_paper(self, paper_path):
+        """
+        Index a paper unless its indexed entry is still current.
+
+        Args:
+            paper_path (str): Path to the PDF file
+
+        Returns:
+            tuple: (entry dict as returned by get_entry, True if the paper was (re)indexed)
+        """
+        entry = self.get_entry(paper_path)
+        if entry is not None:
+            return entry, False
+
+        stat = os.stat(paper_path)
+        sha256 = sha256_file(paper_path)
+        with self._lock:
+            known = self._conn.execute(
+                "SELECT 1 FROM documents WHERE sha256 = ? AND version = ?", (sha256, INDEX_VERSION)
+            ).fetchone()
+
+        started_at = time.monotonic()
+        if not known:
+            print(f"=== Indexing {paper_path} ===")
+            page_texts, toc, figures = self._extract(paper_path)
+            blobs = [zlib.compress(text.encode("utf-8")) for text in page_texts]
+            with self._lock:
+                self._blob.seek(0, os.SEEK_END)
+                offset = self._blob.tell()
+                rows = []
+                for page, blob in enumerate(blobs, 1):
+                    rows.append((sha256, page, offset, len(blob)))
+                    offset += len(blob)
+                self._blob.write(b"".join(blobs))
+                self._blob.flush()
+                os.fsync(self._blob.fileno())
+                self._conn.execute("DELETE FROM pages WHERE sha256 = ?", (sha256,))
+                self._conn.executemany("INSERT INTO pages (sha256, page, offset, length) VALUES (?, ?, ?, ?)", rows)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documents (sha256, version, page_count, toc, figures, indexed_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (sha256, INDEX_VERSION, len(page_texts), json.dumps(toc, ensure_ascii=False),
+                     json.dumps(figures, ensure_ascii=False), time.time())
+                )
+                self._conn.commit()
+
+        # Local metadata depends on the file name (arXiv ID), so it is kept per path
+        metadata = extract_local_metadata(paper_path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO papers (path, sha256, size, mtime, metadata) VALUES (?, ?, ?, ?, ?)",
+                (self._key(paper_path), sha256, stat.st_size, stat.st_mtime, json.dumps(metadata, ensure_ascii=False))
+            )
+            self._conn.commit()
+        print(f"Indexed {paper_path} in {time.monotonic() - started_at:.1f}s"
+              f"{'' if not known else ' (content already indexed under another path or mtime)'}")
+        return self.get_entry(paper_path), True
+
+    def update(self, paper_paths):
+        """
+        Index every given paper that is new or changed.
+
+        Args:
+            paper_paths (list): Paths to the PDF files
+
+        Returns:
+            tuple: (number of papers indexed, number of papers already current)
+        """
+        indexed = 0
+        for paper_path in paper_paths:
+            _, changed = self.update_paper(paper_path)
+            indexed += changed
+        return indexed, len(paper_paths) - indexed
+
+    def remove_missing(self):
+        """
+        Forget paths that no longer exist on disk.
+
+        Returns:
+            int: Number of removed paths
+        """
+        with self._lock:
+            paths = [row[0] for row in self._conn.execute("SELECT path FROM papers")]
+            missing = [path for path in paths if not os.path.exists(path)]
+            self._conn.executemany("DELETE FROM papers WHERE path = ?", [(path,) for path in missing])
+            self._conn.commit()
+        return len(missing)
+
+    def close(self):
+        """Close the database and the blob file."""
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+            self._blob.close()
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the PDFs in a directory for summarize.py and other tools.")
+    parser.add_argument("papers_dir", nargs="?", default="_papers", help="Directory of the PDFs (default: _papers)")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR,
+                        help=f"Directory of the index (default: {DEFAULT_INDEX_DIR})")
+    args = parser.parse_args()
+
+    index = CorpusIndex(args.index_dir)
+    paper_paths = sorted(glob.glob(os.path.join(args.papers_dir, "*.pdf")))
+    started_at = time.monotonic()
+    indexed, current = index.update(paper_paths)
+    removed = index.remove_missing()
+    print(f"=== Index updated in {time.monotonic() - started_at:.2f}s: {indexed} indexed, "
+          f"{current} unchanged, {removed} removed ===")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+import heapq
+import math
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Images smaller than this in either dimension are unlikely to be figures
+MIN_FIGURE_SIZE = 100
+# Side length of the difference hash grid (HASH_SIZE * HASH_SIZE bits)
+HASH_SIZE = 16
+# Images whose hashes differ in at most this many bits are treated as duplicates
+DUPLICATE_HASH_DISTANCE = 10
+# ...provided their aspect ratios differ by at most this fraction
+DUPLICATE_ASPECT_TOLERANCE = 0.1
+# ...and their mean colours differ by at most this much per channel
+DUPLICATE_COLOR_TOLERANCE = 16
+# Default number of figures kept after local ranking and uploaded to Gemini
+DEFAULT_MAX_FIGURES = 8
+# Maximum side length of the array the ranking features are computed on
+SCORE_SAMPLE_SIZE = 256
+# Maximum distance in points between an image and a caption below or above it
+CAPTION_DISTANCE = 80
+CAPTION_PATTERN = re.compile(r'^\s*(fig\.|figure)\s*\d+', re.IGNORECASE)
+# Native image streams written to disk as they are instead of being decoded and encoded again
+PASSTHROUGH_FORMATS = {'jpeg': "image/jpeg", 'png': "image/png"}
+# Worker processes encoding figures that have no passthrough stream
+ENCODE_WORKERS = min(4, os.cpu_count() or 1)
+
+_encode_pool = None
+_encode_pool_lock = threading.Lock()
+
+
+def perceptual_signature(pix):
+    """
+    Compute a perceptual signature of a pixmap for near-duplicate detection.
+
+    The signature combines a difference hash (dHash) of the grayscale image
+    downscaled to a (HASH_SIZE + 1) x HASH_SIZE array, where each bit records
+    whether a pixel is brighter than its right neighbour, with the aspect ratio
+    and the mean colour, since the hash alone ignores colour and shape.
+
+    Args:
+        pix: PyMuPDF Pixmap
+
+    Returns:
+        tuple: (hash as int, aspect ratio, mean (R, G, B))
+    """
+    import fitz
+    from PIL import Image, ImageStat
+
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    mode = "L" if pix.n == 1 else "RGB"
+    small = Image.frombytes(mode, (pix.width, pix.height), pix.samples).resize(
+        (HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR
+    )
+    mean_color = tuple(int(v) for v in ImageStat.Stat(small.convert("RGB")).mean)
+    pixels = small.convert("L").tobytes()
+
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value, pix.width / pix.height, mean_color
+
+
+def is_near_duplicate(signature, other):
+    """
+    Check whether two perceptual signatures describe visually identical images.
+
+    Args:
+        signature (tuple): Signature from perceptual_signature
+        other (tuple): Signature from perceptual_signature
+
+    Returns:
+        bool: True if the images are near-duplicates
+    """
+    image_hash, aspect, color = signature
+    other_hash, other_aspect, other_color = other
+    return (
+        abs(aspect - other_aspect) <= DUPLICATE_ASPECT_TOLERANCE * max(aspect, other_aspect)
+        and all(abs(c - o) <= DUPLICATE_COLOR_TOLERANCE for c, o in zip(color, other_color))
+        and bin(image_hash ^ other_hash).count("1") <= DUPLICATE_HASH_DISTANCE
+    )
+
+
+def find_caption(rect, text_blocks):
+    """
+    Find the figure caption closest to an image on its page.
+
+    Args:
+        rect: Bounding box of the image on the page
+        text_blocks (list): Result of page.get_text("blocks")
+
+    Returns:
+        str: The caption text, or an empty string if no caption is near the image
+    """
+    best_caption, best_distance = "", CAPTION_DISTANCE
+    for x0, y0, x1, y1, text, *_ in text_blocks:
+        if not CAPTION_PATTERN.match(text) or x1 < rect.x0 or x0 > rect.x1:
+            continue
+        # Captions sit below figures, and sometimes above them
+        distance = y0 - rect.y1 if y0 >= rect.y1 else rect.y0 - y1
+        if -5 <= distance <= best_distance:
+            best_caption, best_distance = " ".join(text.split()), max(distance, 0)
+    return best_caption[:300]
+
+
+def score_figure(pix, has_caption):
+    """
+    Score how likely an image is to be an informative figure, without calling Gemini.
+
+    Combines size, aspect ratio, grayscale entropy, edge density and whether a
+    "Figure N" caption is next to the image. The pixel features are computed
+    with NumPy on a strided sample of at most SCORE_SAMPLE_SIZE pixels per side.
+
+    Args:
+        pix: PyMuPDF Pixmap
+        has_caption (bool): Whether a caption was found near the image
+
+    Returns:
+        float: Score between 0 and 1, higher is better
+    """
+    import numpy as np
+
+    pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    step = max(1, max(pix.width, pix.height) // SCORE_SAMPLE_SIZE)
+    gray = pixels[::step, ::step, :pix.n - pix.alpha].mean(axis=2)
+
+    # Larger images are more likely to be real figures; saturates at one megapixel
+    size_score = min(1.0, math.log10(pix.width * pix.height) / 6)
+
+    # Banners and thin strips are rarely useful figures
+    aspect = max(pix.width, pix.height) / min(pix.width, pix.height)
+    aspect_score = 1.0 if aspect <= 3 else 3 / aspect
+
+    # Flat images (blank boxes, solid backgrounds) have low entropy
+    histogram = np.bincount(gray.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    probabilities = histogram[histogram > 0] / histogram.sum()
+    entropy_score = float(-(probabilities * np.log2(probabilities)).sum()) / 8
+
+    # Charts and diagrams have many sharp edges; photos and gradients fewer
+    gradient = np.abs(np.diff(gray, axis=0))[:, :-1] + np.abs(np.diff(gray, axis=1))[:-1, :]
+    edge_score = min(1.0, float((gradient > 32).mean()) * 10) if gradient.size else 0.0
+
+    caption_score = 1.0 if has_caption else 0.0
+
+    return round(
+        0.2 * size_score + 0.1 * aspect_score + 0.2 * entropy_score + 0.2 * edge_score + 0.3 * caption_score, 4
+    )
+
+
+def iter_figures(pdf_path, perceptual_dedup=True):
+    """
+    Lazily extract and score figures from a PDF file, one at a time.
+
+    Each image is decoded once for scoring and deduplication and then dropped,
+    so only lightweight metadata stays in memory no matter how many images the
+    paper has. Nothing is encoded here; spill_figures writes the files of the
+    figures that are actually kept.
+
+    Images repeated across pages (logos, headers) share an xref and are only
+    extracted the first time. With perceptual_dedup, visually identical images
+    stored under different xrefs are collapsed as well, before being encoded.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        perceptual_dedup (bool): Also drop images with a near-identical perceptual hash
+
+    Yields:
+        dict: Figure metadata ('id', 'page', 'index', 'xref', 'width', 'height', 'bbox', 'caption', 'score')
+    """
+    import fitz
+
+    print(f"=== Extracting figures from PDF ===")
+    count = 0
+    seen_xrefs = set()
+    seen_signatures = []
+    xref_duplicates = 0
+    hash_duplicates = 0
+
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception as e:
+        print(f"ERROR: Failed to extract figures: {e}")
+        return
+
+    try:
+        print(f"Opened PDF with {len(doc)} pages")
+
+        for page_num in range(len(doc)):
+            page = doc.load_page(page_num)
+            image_list = page.get_images()
+
+            print(f"Page {page_num + 1}: Found {len(image_list)} images")
+            text_blocks = None
+
+            for img_index, img in enumerate(image_list):
+                xref = img[0]
+                if xref in seen_xrefs:
+                    xref_duplicates += 1
+                    continue
+                seen_xrefs.add(xref)
+
+                try:
+                    pix = fitz.Pixmap(doc, xref)
+                except Exception as e:
+                    print(f"ERROR: Failed to read image {xref} on page {page_num + 1}: {e}")
+                    continue
+
+                # Skip if image is too small (likely not a figure), or not GRAY/RGB
+                if pix.width < MIN_FIGURE_SIZE or pix.height < MIN_FIGURE_SIZE or pix.n - pix.alpha >= 4:
+                    pix = None
+                    continue
+
+                if perceptual_dedup:
+                    signature = perceptual_signature(pix)
+                    if any(is_near_duplicate(signature, seen) for seen in seen_signatures):
+                        hash_duplicates += 1
+                        pix = None
+                        continue
+                    seen_signatures.append(signature)
+
+                # Locate the image on the page to find its caption
+                rects = page.get_image_rects(xref)
+                caption = ""
+                if rects:
+                    if text_blocks is None:
+                        text_blocks = page.get_text("blocks")
+                    caption = find_caption(rects[0], text_blocks)
+
+                figure_id = f"fig_{page_num + 1}_{img_index}"
+                figure_info = {
+                    'id': figure_id,
+                    'page': page_num + 1,
+                    'index': img_index,
+                    'xref': xref,
+                    'width': pix.width,
+                    'height': pix.height,
+                    'bbox': tuple(rects[0]) if rects else None,
+                    'caption': caption,
+                    'score': score_figure(pix, bool(caption)),
+                }
+                pix = None
+
+                count += 1
+                print(f"  Extracted figure {figure_id}: {figure_info['width']}x{figure_info['height']}")
+                yield figure_info
+    except Exception as e:
+        print(f"ERROR: Failed to extract figures: {e}")
+    finally:
+        doc.close()
+        print(f"Total figures extracted: {count}")
+        print(f"Duplicates removed: {xref_duplicates + hash_duplicates} "
+              f"({xref_duplicates} repeated xrefs, {hash_duplicates} perceptual matches)")
+
+
+def select_top_figures(figures, max_figures=DEFAULT_MAX_FIGURES):
+    """
+    Keep only the best scoring figures.
+
+    Figures are consumed one at a time and only the current top max_figures are
+    kept, so memory usage stays bounded while extraction streams.
+
+    Args:
+        figures: Iterable of figures from iter_figures, or a manifest from the corpus index
+        max_figures (int): Number of figures to keep
+
+    Returns:
+        list: The kept figures in document order
+    """
+    heap = []
+    dropped = 0
+    for order, figure in enumerate(figures):
+        entry = (figure['score'], -order, figure)
+        if len(heap) < max_figures:
+            heapq.heappush(heap, entry)
+            continue
+        if heap and entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+        dropped += 1
+
+    kept = [figure for _, _, figure in sorted(heap, key=lambda e: -e[1])]
+    print(f"Kept top {len(kept)} figures by local score, dropped {dropped}")
+    for figure in kept:
+        print(f"  {figure['id']}: score {figure['score']:.3f}, caption: {figure['caption'][:60] or 'none'}")
+    return kept
+
+
+def _write_image(doc, xref, path_base):
+    """Write one image, passing its native stream through when possible; returns (path, mime type)."""
+    import fitz
+
+    # JPEG streams are copied as they are; other streams are decoded and PNG-encoded once
+    if doc.xref_get_key(xref, "Filter")[1] == "/DCTDecode":
+        image = doc.extract_image(xref)
+        if image and image['ext'] in PASSTHROUGH_FORMATS:
+            path = f"{path_base}.{'jpg' if image['ext'] == 'jpeg' else image['ext']}"
+            with open(path, "wb") as f:
+                f.write(image['image'])
+            return path, PASSTHROUGH_FORMATS[image['ext']]
+    path = f"{path_base}.png"
+    fitz.Pixmap(doc, xref).save(path)
+    return path, "image/png"
+
+
+def _encode_figures(pdf_path, figures, spill_dir):
+    """Write the files of the given figures from one open document; runs in the encoding pool."""
+    import fitz
+
+    with fitz.open(pdf_path) as doc:
+        return [_write_image(doc, figure['xref'], os.path.join(spill_dir, figure['id'])) for figure in figures]
+
+
+def _get_encode_pool():
+    """Return the process pool shared by all papers, starting it on first use."""
+    global _encode_pool
+    with _encode_pool_lock:
+        if _encode_pool is None:
+            # Spawned rather than forked, since the pipeline forks from a process running many threads
+            _encode_pool = ProcessPoolExecutor(
+                max_workers=ENCODE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _encode_pool
+
+
+def spill_figures(pdf_path, figures, spill_dir):
+    """
+    Write the files of the given figures, e.g. the top-ranked ones from select_top_figures.
+
+    JPEG images are written from their native stream without being decoded.
+    The rest are PNG-encoded once, spread over a process pool when there is
+    more than one, so encoding large figures does not hold the GIL of the
+    threads running the other stages. The written bytes are used as they are
+    for the upload and the site assets.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        figures (list): Figure metadata with at least 'id' and 'xref'
+        spill_dir (str): Directory the figure files are written to
+
+    Returns:
+        list: Copies of the figures with 'path', 'mime_type' and 'size_bytes' set, in the order given
+    """
+    import fitz
+
+    figures = list(figures)
+    results = {}
+    encode = []
+    with fitz.open(pdf_path) as doc:
+        for figure in figures:
+            if doc.xref_get_key(figure['xref'], "Filter")[1] == "/DCTDecode":
+                results[figure['id']] = _write_image(doc, figure['xref'], os.path.join(spill_dir, figure['id']))
+            else:
+                encode.append(figure)
+    passthrough = len(results)
+
+    if len(encode) > 1 and ENCODE_WORKERS > 1:
+        futures = [(figure, _get_encode_pool().submit(_encode_figures, pdf_path, [figure], spill_dir))
+                   for figure in encode]
+        for figure, future in futures:
+            results[figure['id']] = future.result()[0]
+    elif encode:
+        for figure, result in zip(encode, _encode_figures(pdf_path, encode, spill_dir)):
+            results[figure['id']] = result
+
+    spilled = []
+    for figure in figures:
+        path, mime_type = results[figure['id']]
+        spilled.append({**figure, 'path': path, 'mime_type': mime_type, 'size_bytes': os.path.getsize(path)})
+    print(f"Wrote {len(spilled)} figures ({passthrough} passed through, {len(encode)} encoded)")
+    return spilled
+
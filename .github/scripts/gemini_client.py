@@ -0,0 +1,335 @@
+import contextvars
+import hashlib
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import GeminiBackend
+from model_routing import DEFAULT_MODEL, resolve_route, route_generation_config
+from rate_limiter import DEFAULT_MAX_RETRIES, RateLimiter, backoff_delay, is_transient_error
+from response_cache import sha256_file
+from tracing import trace_span
+from usage_report import UsageRecorder
+
+# Seconds before a single generate_content request is abandoned and retried
+DEFAULT_REQUEST_TIMEOUT = 300
+# Rough prompt size of an uploaded file before the response reports the real usage
+FILE_TOKEN_ESTIMATE = 1000
+# Deferred uploads of one prompt running at the same time once its response is not cached
+DEFERRED_UPLOAD_CONCURRENCY = 4
+
+
+def parse_json_object(text):
+    """
+    Parse a JSON mode response that must be a JSON object.
+
+    Args:
+        text (str): Response text
+
+    Returns:
+        dict: The parsed object
+
+    Raises:
+        ValueError: If the text is not a JSON object
+    """
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    return data
+
+
+class CachedResponse:
+    """Minimal stand-in for a Gemini response served from the response cache."""
+
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class PendingUpload:
+    """
+    File whose upload to Gemini is deferred until a model call using it misses the response cache.
+
+    It is passed in prompts in place of an uploaded file. Responses are cached
+    under its content digest, so a run served entirely from the cache makes no
+    file API calls. The file is uploaded at most once, by the first call needing it.
+    """
+
+    def __init__(self, content_digest, upload):
+        self.content_digest = content_digest
+        # The uploaded Gemini file, None until uploaded
+        self.file = None
+        self._upload = upload
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        """Upload the file unless it was already uploaded, and return the uploaded Gemini file."""
+        with self._lock:
+            if self.file is None:
+                self.file = self._upload()
+            return self.file
+
+
+class GeminiClient:
+    """
+    Wrapper around the Gemini model and file API used by the pipeline.
+
+    All generate_content and upload_file calls go through this class so
+    responses can be served from the optional ResponseCache and every call
+    is recorded with its stage, wall time and token usage in self.usage.
+    Model calls are throttled by one RateLimiter shared by every stage and
+    paper using the client; the file API has a quota of its own and is not
+    throttled. Calls failing with transient errors (429, 503, timeouts) are
+    retried with jittered exponential backoff. Requests are made through a
+    backend, the Gemini SDK by default or FakeBackend for offline runs.
+    With a routing table from model_routing.build_routes, each stage is sent to
+    its own model with its own output cap, temperature and response schema;
+    without one every call goes to model_name with the caller's config.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL, cache=None, usage=None, rate_limiter=None,
+                 max_retries=DEFAULT_MAX_RETRIES, request_timeout=DEFAULT_REQUEST_TIMEOUT, streaming=True,
+                 backend=None, routes=None):
+        self.model_name = model_name
+        self.routes = routes
+        self.backend = backend if backend is not None else GeminiBackend()
+        self.cache = cache
+        self.usage = usage if usage is not None else UsageRecorder()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+        self.streaming = streaming
+
+    def _call_with_retries(self, call, stage, deadline=None):
+        """
+        Run a call, retrying transient errors with jittered exponential backoff.
+
+        Args:
+            call: Function without arguments making the request
+            stage (str): Pipeline stage, used in log messages
+            deadline (float): time.monotonic() after which no retry is started
+
+        Returns:
+            tuple: (result of the call, number of retries)
+
+        Raises:
+            Exception: The last error, with the number of retries in its 'retries' attribute
+        """
+        attempt = 0
+        while True:
+            try:
+                return call(), attempt
+            except Exception as e:
+                delay = backoff_delay(attempt)
+                if (not is_transient_error(e) or attempt >= self.max_retries
+                        or (deadline is not None and time.monotonic() + delay >= deadline)):
+                    e.retries = attempt
+                    raise
+                attempt += 1
+                print(f"WARNING: Transient error in stage '{stage}', retry {attempt}/{self.max_retries} "
+                      f"in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    @staticmethod
+    def _estimate_tokens(contents):
+        if not isinstance(contents, (list, tuple)):
+            contents = [contents]
+        return sum(len(part) // 4 if isinstance(part, str) else FILE_TOKEN_ESTIMATE for part in contents)
+
+    def upload_file(self, path=None, data=None, mime_type=None, display_name=None, stage="upload"):
+        """
+        Upload a file to Gemini and register its content digest with the cache.
+
+        Args:
+            path (str): Path to the file
+            data (bytes): File contents to upload from memory instead of a path
+            mime_type (str): MIME type, required when uploading from memory
+            display_name (str): Optional display name of the uploaded file
+            stage (str): Pipeline stage the upload is recorded under
+
+        Returns:
+            The uploaded Gemini file
+        """
+        started_at = time.monotonic()
+        with trace_span("upload_file", stage=stage, mime_type=mime_type) as span:
+            try:
+                if data is not None:
+                    uploaded_file, retries = self._call_with_retries(lambda: self.backend.upload_file(
+                        path=io.BytesIO(data), mime_type=mime_type, display_name=display_name
+                    ), stage)
+                    digest = hashlib.sha256(data).hexdigest()
+                else:
+                    uploaded_file, retries = self._call_with_retries(lambda: self.backend.upload_file(
+                        path=path, mime_type=mime_type, display_name=display_name
+                    ), stage)
+                    digest = sha256_file(path) if self.cache is not None else None
+            except Exception as e:
+                self.usage.record('upload', stage, None, time.monotonic() - started_at,
+                                  retries=getattr(e, 'retries', 0), error=str(e))
+                raise
+            span['attributes']['file'] = uploaded_file.name
+            span['attributes']['retries'] = retries
+        self.usage.record('upload', stage, None, time.monotonic() - started_at, retries=retries)
+
+        if self.cache is not None:
+            self.cache.register_file(uploaded_file, digest)
+        return uploaded_file
+
+    def defer_upload(self, path=None, data=None, mime_type=None, display_name=None, stage="upload"):
+        """
+        Prepare a file for prompts, uploading it only once a call using it misses the response cache.
+
+        Without a response cache the file is uploaded at once, as nothing could
+        make the upload unnecessary.
+
+        Args:
+            path (str): Path to the file
+            data (bytes): File contents to upload from memory instead of a path
+            mime_type (str): MIME type, required when uploading from memory
+            display_name (str): Optional display name of the uploaded file
+            stage (str): Pipeline stage the upload is recorded under
+
+        Returns:
+            PendingUpload: The file, usable in prompts like an uploaded file
+        """
+        digest = None
+        if self.cache is not None:
+            digest = hashlib.sha256(data).hexdigest() if data is not None else sha256_file(path)
+        pending = PendingUpload(digest, lambda: self.upload_file(
+            path=path, data=data, mime_type=mime_type, display_name=display_name, stage=stage
+        ))
+        if self.cache is None:
+            pending.resolve()
+        return pending
+
+    @staticmethod
+    def _resolve_uploads(contents):
+        """Upload the deferred files of a prompt, concurrently, and put the uploaded files in their place."""
+        if not isinstance(contents, (list, tuple)):
+            return contents.resolve() if isinstance(contents, PendingUpload) else contents
+        pending = [part for part in contents if isinstance(part, PendingUpload) and part.file is None]
+        if len(pending) > 1:
+            with ThreadPoolExecutor(max_workers=min(DEFERRED_UPLOAD_CONCURRENCY, len(pending))) as executor:
+                # Run each upload in a copy of the current context so it is attributed to this paper
+                futures = [executor.submit(contextvars.copy_context().run, part.resolve) for part in pending]
+                for future in futures:
+                    future.result()
+        return [part.resolve() if isinstance(part, PendingUpload) else part for part in contents]
+
+    def delete_file(self, name):
+        """
+        Delete an uploaded file from Gemini.
+
+        Args:
+            name (str): Name of the uploaded file
+        """
+        self._call_with_retries(lambda: self.backend.delete_file(name), "delete")
+
+    def _stream_text(self, response, stage, started_at, span):
+        parts = []
+        received = 0
+        for chunk in response:
+            if not parts:
+                span['attributes']['first_chunk_latency'] = round(time.monotonic() - started_at, 3)
+            parts.append(chunk.text)
+            received += len(chunk.text)
+            print(f"[{stage}] received {received} characters")
+        return "".join(parts)
+
+    def generate_content(self, contents, generation_config=None, stage="generate", stream=False, parse=None,
+                         deadline=None):
+        """
+        Generate content, serving repeated requests from the response cache.
+
+        Responses are only cached once they parse, so a malformed answer is asked
+        for again on the next run instead of being served from the cache forever.
+
+        Args:
+            contents: Prompt parts passed to the model
+            generation_config (dict): Optional generation config
+            stage (str): Pipeline stage the call is recorded under
+            stream (bool): Stream the response and report progress while it arrives;
+                ignored when the client was created with streaming=False
+            parse (callable): Parser the caller applies to the response text, raising on
+                malformed responses; defaults to parse_json_object for JSON mode calls
+            deadline (float): time.monotonic() by which the call must have finished; requests
+                are sent with the time left as their timeout and not retried past it
+
+        Returns:
+            The model response, or a CachedResponse on a cache hit
+        """
+        model_name = self.model_name
+        if self.routes is not None:
+            route = resolve_route(self.routes, stage)
+            model_name = route['model']
+            generation_config = route_generation_config(route, generation_config)
+        if parse is None and (generation_config or {}).get('response_mime_type') == "application/json":
+            parse = parse_json_object
+
+        with trace_span("generate_content", stage=stage, model=model_name) as span:
+            started_at = time.monotonic()
+            key = None
+            if self.cache is not None:
+                key = self.cache.make_key(model_name, contents, generation_config)
+                cached_text = self.cache.get(key, parse=parse)
+                if cached_text is not None:
+                    print(f"Using cached response ({len(cached_text)} characters)")
+                    span['attributes']['response_cached'] = True
+                    self.usage.record('generate', stage, model_name, time.monotonic() - started_at, cached=True)
+                    return CachedResponse(cached_text)
+
+            # Files of the prompt deferred by defer_upload are only uploaded on a cache miss
+            contents = self._resolve_uploads(contents)
+
+            estimated_tokens = self._estimate_tokens(contents)
+            waits = []
+
+            streamed = stream and self.streaming
+
+            def call():
+                # Every attempt counts against the quota, including retries
+                waits.append(self.rate_limiter.acquire(estimated_tokens))
+                attempt_started_at = time.monotonic()
+                timeout = self.request_timeout
+                if deadline is not None:
+                    remaining = deadline - attempt_started_at
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                    if remaining <= 0:
+                        raise TimeoutError(f"deadline of stage '{stage}' passed")
+                response = self.backend.generate_content(
+                    model_name, contents, generation_config=generation_config, stream=streamed,
+                    timeout=timeout
+                )
+                if streamed:
+                    return response, self._stream_text(response, stage, attempt_started_at, span)
+                return response, response.text
+
+            try:
+                (response, text), retries = self._call_with_retries(call, stage, deadline)
+            except Exception as e:
+                self.usage.record('generate', stage, model_name, time.monotonic() - started_at,
+                                  retries=getattr(e, 'retries', 0), error=str(e))
+                raise
+            usage = getattr(response, 'usage_metadata', None)
+            # Gemini's tokens-per-minute quota counts prompt tokens
+            prompt_tokens = getattr(usage, 'prompt_token_count', None)
+            if prompt_tokens is not None:
+                self.rate_limiter.adjust_tokens(prompt_tokens - estimated_tokens)
+            span['attributes']['prompt_tokens'] = prompt_tokens
+            span['attributes']['output_tokens'] = getattr(usage, 'candidates_token_count', None)
+            span['attributes']['retries'] = retries
+            span['attributes']['streamed'] = streamed
+            self.usage.record('generate', stage, model_name, time.monotonic() - started_at, usage=usage,
+                              retries=retries)
+
+            if key is not None:
+                try:
+                    if parse is not None:
+                        parse(text)
+                except Exception:
+                    print(f"WARNING: Not caching malformed response for stage '{stage}'")
+                else:
+                    self.cache.put(key, text)
+            return response
@@ -0,0 +1,190 @@
+import math
+
+# Papers reaching either threshold are summarized map-reduce style instead of in one call on the whole PDF.
+# Ordinary papers with a long appendix, e.g. a 20 page body in 64 pages, stay below both.
+LONG_DOCUMENT_PAGES = 80
+LONG_DOCUMENT_TOKENS = 100_000
+# Maximum pages per chunk; consecutive short sections are merged up to this size
+CHUNK_PAGES = 12
+# Rough number of characters per token, used to estimate the size of the extracted text
+CHARS_PER_TOKEN = 4
+
+
+def is_long_document(paper_path, page_texts=None):
+    """
+    Check whether a paper is long enough for map-reduce summarization.
+
+    Args:
+        paper_path (str): Path to the PDF file
+        page_texts (list): Already extracted text of every page, e.g. from the corpus index
+
+    Returns:
+        bool: True if the paper has at least LONG_DOCUMENT_PAGES pages or LONG_DOCUMENT_TOKENS estimated tokens
+    """
+    if page_texts is None:
+        import fitz
+
+        with fitz.open(paper_path) as doc:
+            if doc.page_count >= LONG_DOCUMENT_PAGES:
+                return True
+            page_texts = [page.get_text() for page in doc]
+    if len(page_texts) >= LONG_DOCUMENT_PAGES:
+        return True
+    return sum(len(text) for text in page_texts) / CHARS_PER_TOKEN >= LONG_DOCUMENT_TOKENS
+
+
+def _sections_from_toc(toc, page_count):
+    """Return (title, first page, last page) of the top-level sections, 1-based and inclusive."""
+    starts = []
+    for level, title, page in toc:
+        if level == 1 and 1 <= page <= page_count:
+            starts.append((title.strip(), page))
+    starts.sort(key=lambda item: item[1])
+    if not starts:
+        return []
+    if starts[0][1] > 1:
+        starts.insert(0, ("Front matter", 1))
+
+    sections = []
+    for i, (title, first) in enumerate(starts):
+        last = starts[i + 1][1] - 1 if i + 1 < len(starts) else page_count
+        # A section starting on the same page as the next one is merged into it
+        if last < first:
+            next_title, next_first = starts[i + 1]
+            starts[i + 1] = (f"{title} / {next_title}", next_first)
+            continue
+        sections.append((title, first, last))
+    return sections
+
+
+def _plan_chunks(sections, chunk_pages):
+    """Split long sections into page windows and merge consecutive short ones up to chunk_pages."""
+    pieces = []
+    for title, first, last in sections:
+        parts = math.ceil((last - first + 1) / chunk_pages)
+        for part in range(parts):
+            start = first + part * chunk_pages
+            end = min(last, start + chunk_pages - 1)
+            pieces.append((f"{title} (part {part + 1} of {parts})" if parts > 1 else title, start, end))
+
+    chunks = []
+    for title, first, last in pieces:
+        if chunks and last - chunks[-1]['first_page'] + 1 <= chunk_pages:
+            chunks[-1]['titles'].append(title)
+            chunks[-1]['last_page'] = last
+        else:
+            chunks.append({'titles': [title], 'first_page': first, 'last_page': last})
+    return chunks
+
+
+def split_document(paper_path, chunk_pages=CHUNK_PAGES, page_texts=None, toc=None):
+    """
+    Split a paper into chunks of text along its top-level sections.
+
+    Sections are taken from the PDF outline; papers without one are split into
+    windows of chunk_pages pages. Every page ends up in exactly one chunk.
+
+    Args:
+        paper_path (str): Path to the PDF file
+        chunk_pages (int): Maximum pages per chunk
+        page_texts (list): Already extracted text of every page, e.g. from the corpus index
+        toc (list): Outline as [level, title, page] entries, required with page_texts
+
+    Returns:
+        list: Chunks as dicts with 'title', 'first_page', 'last_page' (1-based, inclusive) and 'text'
+    """
+    print(f"=== Splitting long document {paper_path} ===")
+    if page_texts is None:
+        import fitz
+
+        with fitz.open(paper_path) as doc:
+            page_texts = [page.get_text() for page in doc]
+            toc = doc.get_toc()
+
+    sections = _sections_from_toc(toc or [], len(page_texts))
+    if not sections:
+        print(f"No outline found, splitting into windows of {chunk_pages} pages")
+        sections = [("Pages", 1, len(page_texts))]
+    chunks = _plan_chunks(sections, chunk_pages)
+    for chunk in chunks:
+        chunk['title'] = " / ".join(chunk.pop('titles'))
+        chunk['text'] = "\n".join(page_texts[chunk['first_page'] - 1:chunk['last_page']])
+        print(f"Chunk pages {chunk['first_page']}-{chunk['last_page']}: {chunk['title']} "
+              f"({len(chunk['text'])} characters)")
+    print(f"Split {len(page_texts)} pages into {len(chunks)} chunks")
+    return chunks
+
+
+def summarize_chunk(client, chunk, number, count):
+    """
+    Write notes on one chunk of a long paper for the reduce step.
+
+    Args:
+        client: GeminiClient instance
+        chunk (dict): Chunk from split_document
+        number (int): 1-based number of the chunk
+        count (int): Total number of chunks
+
+    Returns:
+        str: The notes, labelled with the chunk's sections and pages
+    """
+    print(f"=== Summarizing chunk {number} of {count} ===")
+    chunk_prompt = f"""
+    You are a research paper summarizer. Below is the text of one part of a long research paper
+    (part {number} of {count}: {chunk['title']}, pages {chunk['first_page']}-{chunk['last_page']}).
+
+    Write concise notes on this part (aim for 100-200 words) for a later summary of the whole paper:
+    - Include the research questions, methods, results and key numbers introduced in this part
+    - Skip references, acknowledgements and boilerplate; if the part has no relevant content, answer "No relevant content"
+    - Write in English
+
+    Text of this part:
+    {chunk['text']}
+    """
+    try:
+        response = client.generate_content([chunk_prompt], stage="chunk_summary")
+        notes = response.text.strip()
+        print(f"Chunk {number} of {count} summarized ({len(notes)} characters)")
+    except Exception as e:
+        print(f"ERROR: Failed to summarize chunk {number} of {count}: {e}")
+        raise
+    return f"Part {number} ({chunk['title']}, pages {chunk['first_page']}-{chunk['last_page']}):\n{notes}"
+
+
+def generate_advanced_summary_from_notes(client, paper_notes):
+    """
+    Reduce the notes on all chunks of a long paper into the university level summary.
+
+    Args:
+        client: GeminiClient instance
+        paper_notes (str): Notes on every chunk, in document order
+
+    Returns:
+        str: The English advanced summary
+    """
+    print(f"=== Generating Advanced Summary from chunk notes ===")
+    reduce_prompt = f"""
+    You are a research paper summarizer. Below are notes on each part of a long research paper, in order.
+    Create a comprehensive summary of the whole paper for university/college level students.
+
+    Requirements:
+    - Focus on key concepts, methodologies, and findings
+    - Include the research question, methodology, main results, and implications
+    - Give the main paper more weight than appendices and supplementary material
+    - Use academic language appropriate for university students
+    - Be thorough but concise (aim for 300-500 words)
+    - Write in English initially
+
+    Notes on the paper:
+    {paper_notes}
+    """
+    print(f"Reduce prompt prepared ({len(reduce_prompt)} characters)")
+    try:
+        response = client.generate_content([reduce_prompt], stage="advanced_summary", stream=True)
+        advanced_summary = response.text
+        print(f"Advanced summary generated successfully!")
+        print(f"Advanced summary length: {len(advanced_summary)} characters")
+    except Exception as e:
+        print(f"ERROR: Failed to generate advanced summary from chunk notes: {e}")
+        raise
+    return advanced_summary
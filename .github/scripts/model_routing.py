@@ -0,0 +1,174 @@
+import copy
+
+# Model of stages without a route of their own
+DEFAULT_MODEL = "gemini-1.5-flash"
+# Cheapest and fastest model, for short classification-style answers
+FAST_MODEL = "gemini-1.5-flash-8b"
+# Stronger model the long-form stages are upgraded to in the 'quality' profile
+QUALITY_MODEL = "gemini-1.5-pro"
+
+_NULLABLE_STRING = {'type': "STRING", 'nullable': True}
+_NULLABLE_INTEGER = {'type': "INTEGER", 'nullable': True}
+_LEVEL_VERDICT = {
+    'type': "OBJECT",
+    'properties': {'pass': {'type': "BOOLEAN"}, 'issues': {'type': "ARRAY", 'items': {'type': "STRING"}}},
+    'required': ["pass", "issues"],
+}
+
+# Generation settings per stage: 'model', 'max_output_tokens', 'temperature' and, for
+# stages answering in JSON, the 'response_schema' enforced by the API. Stages with a
+# per-paper suffix, such as translate_<language>, use the route of their prefix.
+# Output caps leave room above the longest answers seen, so they only cut off runaway output.
+STAGE_ROUTES = {
+    'metadata': {
+        'model': FAST_MODEL,
+        'max_output_tokens': 512,
+        'temperature': 0.0,
+        'response_schema': {
+            'type': "OBJECT",
+            'properties': {'title': _NULLABLE_STRING, 'authors': _NULLABLE_STRING, 'date': _NULLABLE_STRING},
+        },
+    },
+    'figure_selection': {
+        'model': FAST_MODEL,
+        'max_output_tokens': 128,
+        'temperature': 0.0,
+        'response_schema': {
+            'type': "OBJECT",
+            'properties': {
+                'university': _NULLABLE_INTEGER, 'high_school': _NULLABLE_INTEGER, 'child': _NULLABLE_INTEGER,
+            },
+            'required': ["university", "high_school", "child"],
+        },
+    },
+    'chunk_summary': {'model': DEFAULT_MODEL, 'max_output_tokens': 2048, 'temperature': 0.2},
+    'advanced_summary': {'model': DEFAULT_MODEL, 'max_output_tokens': 4096, 'temperature': 0.4},
+    'high_school_summary': {'model': DEFAULT_MODEL, 'max_output_tokens': 3072, 'temperature': 0.5},
+    'child_summary': {'model': DEFAULT_MODEL, 'max_output_tokens': 2048, 'temperature': 0.7},
+    'reflection': {
+        'model': DEFAULT_MODEL,
+        'max_output_tokens': 1024,
+        'temperature': 0.0,
+        'response_schema': {
+            'type': "OBJECT",
+            'properties': {'university': _LEVEL_VERDICT, 'high_school': _LEVEL_VERDICT, 'child': _LEVEL_VERDICT},
+            'required': ["university", "high_school", "child"],
+        },
+    },
+    # The schema depends on the levels being revised and is passed with the call
+    'revision': {'model': DEFAULT_MODEL, 'max_output_tokens': 8192, 'temperature': 0.3},
+    'translate': {
+        'model': DEFAULT_MODEL,
+        'max_output_tokens': 8192,
+        'temperature': 0.3,
+        'response_schema': {
+            'type': "OBJECT",
+            'properties': {
+                'university_summary': {'type': "STRING"},
+                'high_school_summary': {'type': "STRING"},
+                'child_summary': {'type': "STRING"},
+            },
+            'required': ["university_summary", "high_school_summary", "child_summary"],
+        },
+    },
+}
+
+# Stages writing the summaries and translations, which the 'quality' profile upgrades
+LONG_FORM_STAGES = ('chunk_summary', 'advanced_summary', 'high_school_summary', 'child_summary', 'translate',
+                    'revision')
+
+# Named variants of STAGE_ROUTES selectable with --routing: model overrides per stage
+ROUTING_PROFILES = {
+    'balanced': {},
+    'fast': {stage: FAST_MODEL for stage in STAGE_ROUTES},
+    'quality': {stage: QUALITY_MODEL for stage in LONG_FORM_STAGES},
+    'single': {stage: DEFAULT_MODEL for stage in STAGE_ROUTES},
+}
+DEFAULT_ROUTING_PROFILE = 'balanced'
+
+
+def build_routes(profile=DEFAULT_ROUTING_PROFILE, stage_models=()):
+    """
+    Build the routing table for a profile with per-stage model overrides.
+
+    Args:
+        profile (str): Name in ROUTING_PROFILES
+        stage_models (list): 'stage=model' strings, e.g. ['advanced_summary=gemini-2.5-pro'];
+            the stage 'default' sets the model of stages without a route
+
+    Returns:
+        dict: Route per stage, plus 'default' with the model of unrouted stages
+
+    Raises:
+        ValueError: If the profile or a stage is unknown, or an override is malformed
+    """
+    if profile not in ROUTING_PROFILES:
+        raise ValueError(f"unknown routing profile '{profile}', expected one of {', '.join(ROUTING_PROFILES)}")
+    routes = copy.deepcopy(STAGE_ROUTES)
+    routes['default'] = {'model': DEFAULT_MODEL}
+    for stage, model_name in ROUTING_PROFILES[profile].items():
+        routes[stage]['model'] = model_name
+
+    for override in stage_models:
+        stage, separator, model_name = override.partition("=")
+        stage, model_name = stage.strip(), model_name.strip()
+        if not separator or not model_name:
+            raise ValueError(f"expected STAGE=MODEL, got '{override}'")
+        if stage not in routes:
+            raise ValueError(f"unknown stage '{stage}', expected one of {', '.join(routes)}")
+        routes[stage]['model'] = model_name
+    return routes
+
+
+def resolve_route(routes, stage):
+    """
+    Look up the route of a stage, falling back to its prefix and then to 'default'.
+
+    Args:
+        routes (dict): Result of build_routes
+        stage (str): Stage name, e.g. 'figure_selection' or 'translate_sv'
+
+    Returns:
+        dict: The route
+    """
+    if stage in routes:
+        return routes[stage]
+    prefix = stage.rpartition("_")[0]
+    return routes.get(prefix, routes['default'])
+
+
+def route_generation_config(route, generation_config=None):
+    """
+    Merge the generation settings of a route into the config passed by the caller.
+
+    Settings given by the caller win. The response schema is only added to calls
+    asking for JSON.
+
+    Args:
+        route (dict): Route of the stage
+        generation_config (dict): Config passed to generate_content, or None
+
+    Returns:
+        dict: Generation config for the request, or None if there is nothing to set
+    """
+    config = {key: route[key] for key in ('max_output_tokens', 'temperature') if key in route}
+    config.update(generation_config or {})
+    if 'response_schema' in route and config.get('response_mime_type') == "application/json":
+        config.setdefault('response_schema', route['response_schema'])
+    return config or None
+
+
+def format_routes(routes):
+    """
+    Format the model and output cap of every stage on one line.
+
+    Args:
+        routes (dict): Result of build_routes
+
+    Returns:
+        str: e.g. "metadata gemini-1.5-flash-8b/512, ..."
+    """
+    return ", ".join(
+        f"{stage} {route['model']}" + (f"/{route['max_output_tokens']}" if 'max_output_tokens' in route else "")
+        for stage, route in routes.items()
+    )
@@ -0,0 +1,327 @@
+import datetime
+import json
+import pathlib
+import re
+import unicodedata
+
+from rate_limiter import is_transient_error
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
+
+# New-style arXiv identifier, e.g. 2505.22954v1 (YYMM.NNNNN with optional version)
+ARXIV_ID_PATTERN = re.compile(r'(?<!\d)(\d{2})(\d{2})\.\d{4,5}(?:v\d+)?(?!\d)')
+
+# The arXiv stamp printed in the margin of the first page, e.g. "arXiv:2505.22954v1  [cs.AI]  29 May 2025"
+ARXIV_STAMP_PATTERN = re.compile(r'arXiv:\S+\s+\[[^\]]+\]\s+(\d{1,2}\s+\w{3,9}\s+\d{4})')
+
+METADATA_FIELDS = ('title', 'authors', 'date')
+
+
+def parse_date_text(text):
+    """
+    Parse a date written in one of the formats found in papers and model responses.
+
+    Supports YYYY-MM-DD, "DD MMM YYYY" and "MMM DD, YYYY" (full or abbreviated month names).
+
+    Args:
+        text (str): Text containing a date
+
+    Returns:
+        str: The date in YYYY-MM-DD format, or None if no valid date was found
+    """
+    if not text:
+        return None
+
+    candidates = []
+    match = re.search(r'(\d{4})-(\d{1,2})-(\d{1,2})', text)
+    if match:
+        candidates.append((match.group(1), match.group(2), match.group(3)))
+    match = re.search(r'(\d{1,2})\s+([A-Za-z]{3,9})\.?,?\s+(\d{4})', text)
+    if match:
+        candidates.append((match.group(3), MONTHS.get(match.group(2)[:3].lower()), match.group(1)))
+    match = re.search(r'([A-Za-z]{3,9})\.?\s+(\d{1,2}),?\s+(\d{4})', text)
+    if match:
+        candidates.append((match.group(3), MONTHS.get(match.group(1)[:3].lower()), match.group(2)))
+
+    for year, month, day in candidates:
+        if month is None:
+            continue
+        try:
+            return datetime.date(int(year), int(month), int(day)).isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def _date_from_pdf_timestamp(value):
+    """Convert a PDF timestamp such as 'D:20250123014531Z' to YYYY-MM-DD."""
+    match = re.match(r'D:(\d{4})(\d{2})(\d{2})', value or '')
+    if not match:
+        return None
+    try:
+        return datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3))).isoformat()
+    except ValueError:
+        return None
+
+
+def _date_from_arxiv_id(paper_path):
+    """Derive the first day of the submission month from an arXiv ID in the file name."""
+    match = ARXIV_ID_PATTERN.search(pathlib.Path(paper_path).stem)
+    if not match:
+        return None
+    year, month = 2000 + int(match.group(1)), int(match.group(2))
+    if not 1 <= month <= 12:
+        return None
+    return datetime.date(year, month, 1).isoformat()
+
+
+def _is_plausible_title(title, paper_name):
+    if not title or len(title) < 5:
+        return False
+    lowered = title.lower()
+    if lowered in ('untitled', 'title', paper_name.lower()) or lowered.endswith(('.pdf', '.dvi', '.tex')):
+        return False
+    return not ARXIV_ID_PATTERN.fullmatch(title)
+
+
+def _fold_title(title):
+    """Reduce a title to lowercase letters and digits without accents, e.g. 'Gödel' to 'godel'."""
+    decomposed = unicodedata.normalize("NFKD", title)
+    return re.sub(r'[\W_]+', '', "".join(c for c in decomposed if not unicodedata.combining(c)).casefold())
+
+
+def _title_from_first_page(page):
+    """
+    Find the title on the first page as the horizontal text set in the largest font.
+
+    Args:
+        page: PyMuPDF page
+
+    Returns:
+        str: The title, or an empty string if none was found
+    """
+    spans = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            # Skip rotated text such as the arXiv margin stamp
+            if abs(line["dir"][1]) > 0.01:
+                continue
+            for span in line["spans"]:
+                text = span["text"].strip()
+                # Only the upper half of the page can hold the title
+                if text and span["bbox"][1] < page.rect.height / 2 and not text.lower().startswith("arxiv:"):
+                    spans.append((span["size"], span["bbox"][1], span["bbox"][0], text))
+
+    if not spans:
+        return ""
+
+    largest = max(size for size, _, _, _ in spans)
+    # Titles are sometimes set with slightly different sizes per line
+    title_spans = [s for s in spans if s[0] >= largest - 0.5]
+    title_spans.sort(key=lambda s: (round(s[1]), s[2]))
+
+    # Keep only the first run of lines; headings further down use the same font
+    title_parts = [title_spans[0][3]]
+    for previous, span in zip(title_spans, title_spans[1:]):
+        if span[1] - previous[1] > 2.5 * largest:
+            break
+        title_parts.append(span[3])
+    title = " ".join(title_parts)
+    return re.sub(r'\s+', ' ', title).strip()
+
+
+def extract_local_metadata(paper_path):
+    """
+    Extract title, authors and date from the PDF without calling Gemini.
+
+    Sources are tried from most to least reliable: the document metadata, the
+    largest-font text on the first page, the arXiv stamp in the page margin and
+    the arXiv ID in the file name (e.g. 2505.22954v1 gives 2025-05-01). The title
+    is taken from the first page when it matches the metadata title apart from
+    case and accents, as the metadata is often folded to ASCII.
+
+    Args:
+        paper_path (str): Path to the PDF file
+
+    Returns:
+        dict: 'title', 'authors' and 'date' values, None for fields that were not found
+    """
+    import fitz
+
+    print(f"=== Extracting metadata locally ===")
+    paper_name = pathlib.Path(paper_path).stem
+    metadata = {field: None for field in METADATA_FIELDS}
+
+    try:
+        doc = fitz.open(paper_path)
+    except Exception as e:
+        print(f"ERROR: Failed to open PDF for metadata extraction: {e}")
+        return metadata
+
+    try:
+        doc_metadata = doc.metadata or {}
+
+        # The document metadata confirms the title on the first page, but arXiv folds it to ASCII
+        # (e.g. 'Godel' for 'Gödel'), so the first page is used when they match
+        metadata_title = (doc_metadata.get('title') or '').strip()
+        page_title = _title_from_first_page(doc.load_page(0)) if len(doc) > 0 else ""
+        if not _is_plausible_title(metadata_title, paper_name):
+            metadata_title = ""
+        if not _is_plausible_title(page_title, paper_name):
+            page_title = ""
+        if page_title and (not metadata_title or _fold_title(page_title) == _fold_title(metadata_title)):
+            metadata['title'] = page_title
+            print(f"Title from first page font sizes: {page_title}")
+        elif metadata_title:
+            metadata['title'] = metadata_title
+            print(f"Title from PDF metadata: {metadata_title}")
+
+        authors = (doc_metadata.get('author') or '').strip()
+        if authors and len(authors) > 2:
+            metadata['authors'] = ", ".join(a.strip() for a in re.split(r'\s*;\s*', authors) if a.strip())
+            print(f"Authors from PDF metadata: {metadata['authors']}")
+
+        first_page_text = doc.load_page(0).get_text() if len(doc) > 0 else ""
+        stamp = ARXIV_STAMP_PATTERN.search(first_page_text)
+        arxiv_month = _date_from_arxiv_id(paper_path)
+        creation_date = _date_from_pdf_timestamp(doc_metadata.get('creationDate'))
+        if stamp and parse_date_text(stamp.group(1)):
+            metadata['date'] = parse_date_text(stamp.group(1))
+            print(f"Date from arXiv stamp: {metadata['date']}")
+        elif arxiv_month:
+            # Prefer the exact creation date when it falls in the month given by the arXiv ID
+            if creation_date and creation_date[:7] == arxiv_month[:7]:
+                metadata['date'] = creation_date
+            else:
+                metadata['date'] = arxiv_month
+            print(f"Date from arXiv ID: {metadata['date']}")
+        elif creation_date:
+            metadata['date'] = creation_date
+            print(f"Date from PDF creation date: {metadata['date']}")
+    except Exception as e:
+        print(f"ERROR: Failed to extract local metadata: {e}")
+    finally:
+        doc.close()
+
+    missing = missing_metadata_fields(metadata)
+    print(f"Local metadata: {metadata} (missing: {missing or 'none'})")
+    return metadata
+
+
+def missing_metadata_fields(metadata):
+    """
+    List the metadata fields that are still empty.
+
+    Args:
+        metadata (dict): Result of extract_local_metadata
+
+    Returns:
+        list: Names of the missing fields, in METADATA_FIELDS order
+    """
+    return [field for field in METADATA_FIELDS if not metadata.get(field)]
+
+
+def _clean_authors(authors):
+    authors = (authors or '').replace("Authors:", "").replace("By:", "").strip()
+    if len(authors) <= 2:
+        return ""
+    # Ensure it doesn't look like an error message
+    lowered = authors.lower()
+    if "unable" in lowered or "cannot" in lowered or "error" in lowered:
+        return ""
+    return authors
+
+
+def extract_metadata_with_model(client, pdf_file, fields):
+    """
+    Ask Gemini for the missing metadata fields in one structured JSON call.
+
+    Args:
+        client: GeminiClient instance
+        pdf_file: Uploaded PDF file
+        fields (list): Metadata fields to extract ('title', 'authors', 'date')
+
+    Returns:
+        dict: Extracted values for the requested fields, None when not found
+
+    Raises:
+        Exception: Transient API errors that persisted through all retries
+    """
+    descriptions = {
+        'title': '"title": the title of the paper',
+        'authors': '"authors": the authors\' names separated by commas',
+        'date': '"date": the publication or submission date in YYYY-MM-DD format '
+                '(look for e.g. "Submitted on 15 Mar 2024" or "v1 [cs.AI] 15 Mar 2024")',
+    }
+    metadata_prompt = f"""Extract metadata from this research paper.
+    Return a JSON object with these keys:
+    {chr(10).join('    - ' + descriptions[field] for field in fields)}
+    Use null for any value that cannot be found. Return only the JSON object."""
+    print(f"Metadata extraction prompt: {metadata_prompt}")
+
+    try:
+        response = client.generate_content(
+            [metadata_prompt, pdf_file],
+            generation_config={"response_mime_type": "application/json"},
+            stage="metadata"
+        )
+        print(f"Raw metadata response: '{response.text}'")
+        data = json.loads(response.text)
+        if not isinstance(data, dict):
+            raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    except Exception as e:
+        # Fail the paper rather than publish fallback metadata because of throttling that outlasted the retries
+        if is_transient_error(e):
+            raise
+        print(f"ERROR: Failed to extract metadata with Gemini: {e}")
+        return {field: None for field in fields}
+
+    result = {}
+    for field in fields:
+        value = data.get(field)
+        result[field] = str(value).strip() if value else None
+    if 'authors' in result:
+        result['authors'] = _clean_authors(result['authors']) or None
+    if 'date' in result:
+        result['date'] = parse_date_text(result['date'])
+    return result
+
+
+def resolve_paper_metadata(client, pdf_file, paper_name, local_metadata):
+    """
+    Fill in metadata missing from the local extraction and apply final fallbacks.
+
+    Gemini is only called when at least one field is missing locally. The title
+    falls back to the file name and the date to today's date.
+
+    Args:
+        client: GeminiClient instance
+        pdf_file: Uploaded PDF file; only used, and may be None, when fields are missing locally
+        paper_name (str): Paper file name without extension
+        local_metadata (dict): Result of extract_local_metadata
+
+    Returns:
+        dict: Final 'title', 'authors' and 'date' values
+    """
+    print(f"=== Resolving paper metadata ===")
+    metadata = dict(local_metadata)
+    missing = missing_metadata_fields(metadata)
+    if missing:
+        print(f"Requesting missing metadata from Gemini: {missing}")
+        metadata.update(extract_metadata_with_model(client, pdf_file, missing))
+
+    if not metadata.get('title') or len(metadata['title']) < 5:
+        metadata['title'] = paper_name
+        print(f"Title too short or empty, using filename as title: {paper_name}")
+    if not metadata.get('authors'):
+        metadata['authors'] = ""
+        print("No authors extracted, leaving blank")
+    if not metadata.get('date'):
+        metadata['date'] = datetime.datetime.now().strftime("%Y-%m-%d")
+        print(f"Could not extract paper date, using current date as fallback: {metadata['date']}")
+
+    print(f"Final metadata: {metadata}")
+    return metadata
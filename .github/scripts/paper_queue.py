@@ -0,0 +1,246 @@
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+
+from response_cache import sha256_file
+
+DEFAULT_QUEUE_DIR = ".cache/summarize/queue"
+# Priority of papers added or changed while serving; they are taken before the backlog found at startup
+PRIORITY_NEW = 10
+PRIORITY_BACKLOG = 0
+# Attempts per paper before it is marked failed and left until the file changes again
+DEFAULT_MAX_ATTEMPTS = 3
+# Seconds before a failed paper is claimed again, doubled after every further failed attempt,
+# so papers failing on quota or overload errors do not use up their attempts at once
+RETRY_DELAY = 60.0
+RETRY_DELAY_MAX = 30 * 60.0
+
+
+class PaperQueue:
+    """
+    Persistent priority queue of papers to summarize, stored in SQLite.
+
+    Each path has one job row in the state 'pending', 'running', 'done' or
+    'failed'. A job is claimed by switching it to 'running' in a transaction, so
+    a paper is never handed to two workers. Jobs left 'running' by a process that
+    crashed or was killed are put back to 'pending' when the queue is opened
+    again; the queue directory is locked, so only one process uses it at a time
+    and the jobs it is running are never taken over by another. A failed attempt
+    is retried after a growing delay. Papers are re-queued only if their content
+    changed: the size and mtime are compared first and the file is only hashed
+    if they differ.
+    """
+
+    def __init__(self, queue_dir=DEFAULT_QUEUE_DIR):
+        """
+        Args:
+            queue_dir (str): Directory of the queue database and lock file
+
+        Raises:
+            RuntimeError: If another process has the queue open
+        """
+        os.makedirs(queue_dir, exist_ok=True)
+        self._lock_file = open(os.path.join(queue_dir, "queue.lock"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(f"queue {queue_dir} is in use by another process")
+        self.path = os.path.join(queue_dir, "queue.sqlite")
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " path TEXT PRIMARY KEY,"
+            " sha256 TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime REAL NOT NULL,"
+            " priority INTEGER NOT NULL,"
+            " state TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " changed INTEGER NOT NULL DEFAULT 0,"
+            " enqueued_at REAL NOT NULL,"
+            " finished_at REAL,"
+            " error TEXT,"
+            " not_before REAL NOT NULL DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (state, priority, enqueued_at);"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if 'not_before' not in columns:
+            # Queue created before retries were delayed
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL NOT NULL DEFAULT 0")
+        requeued = self._conn.execute(
+            "UPDATE jobs SET state = 'pending' WHERE state = 'running'"
+        ).rowcount
+        self._conn.commit()
+        if requeued:
+            print(f"Requeued {requeued} papers left running by a previous process")
+
+    @staticmethod
+    def _key(paper_path):
+        return os.path.abspath(paper_path)
+
+    def enqueue(self, paper_path, priority=PRIORITY_NEW):
+        """
+        Queue a paper unless the same content is already queued, running or done.
+
+        A paper that failed every attempt is queued again only when its content changes.
+        A paper that changes while it is being summarized is queued again once the
+        running attempt finishes.
+
+        Args:
+            paper_path (str): Path to the PDF file
+            priority (int): Higher priorities are claimed first
+
+        Returns:
+            bool: True if the paper was queued
+        """
+        key = self._key(paper_path)
+        try:
+            stat = os.stat(paper_path)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256, size, mtime, state FROM jobs WHERE path = ?", (key,)
+            ).fetchone()
+        if row and row[1] == stat.st_size and row[2] == stat.st_mtime:
+            return False
+
+        # Hash outside the lock; the file may be large
+        sha256 = sha256_file(paper_path)
+        with self._available:
+            row = self._conn.execute("SELECT sha256, state FROM jobs WHERE path = ?", (key,)).fetchone()
+            if row and row[0] == sha256:
+                # Touched but not changed
+                self._conn.execute(
+                    "UPDATE jobs SET size = ?, mtime = ? WHERE path = ?", (stat.st_size, stat.st_mtime, key)
+                )
+                self._conn.commit()
+                return False
+            if row and row[1] == 'running':
+                self._conn.execute(
+                    "UPDATE jobs SET sha256 = ?, size = ?, mtime = ?, priority = ?, changed = 1 WHERE path = ?",
+                    (sha256, stat.st_size, stat.st_mtime, priority, key)
+                )
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO jobs (path, sha256, size, mtime, priority, state, enqueued_at)"
+                    " VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                    (key, sha256, stat.st_size, stat.st_mtime, priority, time.time())
+                )
+            self._conn.commit()
+            self._available.notify()
+        print(f"Queued {paper_path} (priority {priority})")
+        return True
+
+    def claim(self, timeout=None):
+        """
+        Take the pending paper with the highest priority, oldest first, waiting for one if none is pending.
+
+        Papers waiting out the delay after a failed attempt are skipped until it has passed.
+
+        Args:
+            timeout (float): Seconds to wait for a paper; None waits until one is queued
+
+        Returns:
+            dict: 'path' and 'attempts' (including this one) of the claimed job, or None on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._available:
+            while True:
+                row = self._conn.execute(
+                    "SELECT path, attempts FROM jobs WHERE state = 'pending' AND not_before <= ?"
+                    " ORDER BY priority DESC, enqueued_at LIMIT 1",
+                    (time.time(),)
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE jobs SET state = 'running', attempts = attempts + 1, changed = 0 WHERE path = ?",
+                        (row[0],)
+                    )
+                    self._conn.commit()
+                    return {'path': row[0], 'attempts': row[1] + 1}
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                # Wake up when the next delayed retry is due, unless a paper is queued first
+                next_retry = self._conn.execute(
+                    "SELECT MIN(not_before) FROM jobs WHERE state = 'pending'"
+                ).fetchone()[0]
+                if next_retry is not None:
+                    until_retry = max(0.0, next_retry - time.time())
+                    remaining = until_retry if remaining is None else min(remaining, until_retry)
+                self._available.wait(remaining)
+
+    def _finish(self, job, state, error=None, delay=0.0):
+        with self._available:
+            changed = self._conn.execute("SELECT changed FROM jobs WHERE path = ?", (job['path'],)).fetchone()
+            if changed and changed[0]:
+                # The file changed while it was summarized; the new version starts over
+                state, error, delay = 'pending', None, 0.0
+                self._conn.execute("UPDATE jobs SET attempts = 0, changed = 0 WHERE path = ?", (job['path'],))
+            now = time.time()
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, error = ?, not_before = ? WHERE path = ?",
+                (state, now, error, now + delay, job['path'])
+            )
+            self._conn.commit()
+            if state == 'pending':
+                self._available.notify()
+        if delay:
+            print(f"Retrying {job['path']} in {delay:g}s at the earliest")
+        return state
+
+    def complete(self, job):
+        """Mark a claimed job as done."""
+        return self._finish(job, 'done')
+
+    def fail(self, job, error, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Record a failed attempt, queueing the paper again until it has been attempted max_attempts times.
+
+        The paper is not claimed again before RETRY_DELAY seconds, doubled for
+        every earlier failed attempt up to RETRY_DELAY_MAX.
+
+        Args:
+            job (dict): Job returned by claim
+            error (str): Error of the attempt
+            max_attempts (int): Attempts before the job is marked failed
+
+        Returns:
+            str: New state of the job, 'pending' or 'failed'
+        """
+        if job['attempts'] >= max_attempts:
+            return self._finish(job, 'failed', error)
+        delay = min(RETRY_DELAY_MAX, RETRY_DELAY * 2 ** (job['attempts'] - 1))
+        return self._finish(job, 'pending', error, delay)
+
+    def release(self, job):
+        """Put a claimed job back without counting the attempt, e.g. when shutting down before starting it."""
+        with self._available:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'pending', attempts = attempts - 1 WHERE path = ? AND state = 'running'",
+                (job['path'],)
+            )
+            self._conn.commit()
+            self._available.notify()
+
+    def wake_all(self):
+        """Wake every worker waiting in claim, e.g. to let them see a shutdown request."""
+        with self._available:
+            self._available.notify_all()
+
+    def counts(self):
+        """Return the number of jobs in each state."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+        # Closing the file releases the lock
+        self._lock_file.close()
@@ -0,0 +1,133 @@
+import ctypes
+import ctypes.util
+import glob
+import os
+import select
+import struct
+import sys
+import threading
+
+# Seconds between directory scans when inotify is unavailable, and between checks for shutdown otherwise
+DEFAULT_POLL_INTERVAL = 5.0
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _open_inotify(directory):
+    """Return an inotify file descriptor watching directory for finished writes and moves, or None."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+    except (OSError, AttributeError):
+        return None
+    return fd
+
+
+class PaperWatcher:
+    """
+    Watch a directory for new or rewritten PDFs and report each one to a callback.
+
+    On Linux the directory is watched with inotify, so a paper is reported as soon
+    as it is closed after writing or moved into place. Elsewhere, or if inotify
+    cannot be set up, the directory is scanned every poll interval and a paper is
+    reported once its size and mtime are the same in two scans in a row, so files
+    still being copied are not picked up half-written.
+    """
+
+    def __init__(self, directory, on_paper, poll_interval=DEFAULT_POLL_INTERVAL):
+        """
+        Args:
+            directory (str): Directory of the PDFs, e.g. _papers
+            on_paper (callable): Called with the path of each new or changed PDF
+            poll_interval (float): Seconds between scans or shutdown checks
+        """
+        self.directory = directory
+        self.on_paper = on_paper
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def scan(self):
+        """Return the (size, mtime) of every PDF in the directory by path."""
+        snapshot = {}
+        for path in glob.glob(os.path.join(self.directory, "*.pdf")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime)
+        return snapshot
+
+    def _report(self, path):
+        try:
+            self.on_paper(path)
+        except Exception as e:
+            print(f"ERROR: Failed to queue {path}: {e}")
+
+    def _watch_inotify(self, fd):
+        try:
+            while not self._stop.is_set():
+                ready, _, _ = select.select([fd], [], [], self.poll_interval)
+                if not ready:
+                    continue
+                try:
+                    data = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                offset = 0
+                while offset < len(data):
+                    _, mask, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+                    name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + name_length]
+                    offset += _EVENT_HEADER.size + name_length
+                    if mask & IN_Q_OVERFLOW:
+                        print("WARNING: Missed file events, rescanning the papers directory")
+                        for path in self.scan():
+                            self._report(path)
+                        continue
+                    name = os.fsdecode(name.rstrip(b"\0"))
+                    if name.endswith(".pdf"):
+                        self._report(os.path.join(self.directory, name))
+        finally:
+            os.close(fd)
+
+    def _watch_polling(self, previous):
+        reported = dict(previous)
+        while not self._stop.wait(self.poll_interval):
+            current = self.scan()
+            for path, signature in current.items():
+                # Unchanged since the last scan, so the file is complete
+                if previous.get(path) == signature and reported.get(path) != signature:
+                    reported[path] = signature
+                    self._report(path)
+            previous = current
+
+    def start(self):
+        """Start watching in a background thread. Papers already in the directory are not reported."""
+        fd = _open_inotify(self.directory)
+        if fd is None:
+            print(f"Watching {self.directory} by scanning every {self.poll_interval:g}s")
+            target, args = self._watch_polling, (self.scan(),)
+        else:
+            print(f"Watching {self.directory} with inotify")
+            target, args = self._watch_inotify, (fd,)
+        self._thread = threading.Thread(target=target, args=args, name="paper-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching and wait for the watcher thread to exit."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
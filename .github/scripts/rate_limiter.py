@@ -0,0 +1,114 @@
+import random
+import threading
+import time
+
+# Free tier quota of gemini-1.5-flash; raise them with --requests-per-minute/--tokens-per-minute on paid plans
+DEFAULT_REQUESTS_PER_MINUTE = 15
+DEFAULT_TOKENS_PER_MINUTE = 1_000_000
+# Retries of a call failing with a transient error before giving up
+DEFAULT_MAX_RETRIES = 5
+# Backoff before retry n is drawn uniformly from [0, min(BACKOFF_MAX, BACKOFF_BASE * 2**n)] seconds
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 60.0
+
+
+def is_transient_error(error):
+    """
+    Check whether a failed call may succeed when retried.
+
+    Args:
+        error (Exception): Error raised by the call
+
+    Returns:
+        bool: True for rate limiting, server overload, timeouts and connection errors
+    """
+    # Imported here since google.api_core pulls in grpc; it is already loaded whenever an API call failed
+    from google.api_core import exceptions as google_exceptions
+
+    return isinstance(error, (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.GatewayTimeout,
+        google_exceptions.DeadlineExceeded,
+        TimeoutError,
+        ConnectionError,
+    ))
+
+
+def backoff_delay(attempt):
+    """
+    Jittered exponential backoff delay before a retry.
+
+    Args:
+        attempt (int): 0-based number of the failed attempt
+
+    Returns:
+        float: Delay in seconds
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket limiting requests and tokens per minute.
+
+    Both buckets start full and refill continuously, so short bursts up to one
+    minute of quota go through at once and sustained throughput settles at the
+    quota. Token usage is not known before a call, so callers acquire an
+    estimate and settle the difference with adjust_tokens once the response
+    reports its usage; the token bucket may go negative until it refills.
+    """
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens=0):
+        """
+        Block until one request and the given number of tokens fit in the quota.
+
+        Args:
+            tokens (int): Estimated tokens of the request
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        # A single request larger than the whole quota only waits for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        started_at = time.monotonic()
+        while True:
+            with self._lock:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return time.monotonic() - started_at
+                wait = max(
+                    (1 - self._requests) * 60 / self.requests_per_minute,
+                    (tokens - self._tokens) * 60 / self.tokens_per_minute,
+                )
+            time.sleep(wait)
+
+    def adjust_tokens(self, delta):
+        """
+        Correct the token bucket once the actual token usage of a request is known.
+
+        Args:
+            delta (int): Actual minus estimated tokens; negative values return tokens
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.tokens_per_minute, self._tokens - delta)
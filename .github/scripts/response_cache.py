@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_DIR = ".cache/summarize"
+# Evict least recently used entries beyond this total size
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+# Evict entries that have not been used for this long
+DEFAULT_MAX_AGE_DAYS = 30
+# Writes between evictions, so a long-running process keeps the cache within its limits
+EVICT_EVERY_WRITES = 100
+
+
+def sha256_file(path):
+    """
+    Compute the SHA-256 digest of a file.
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of model responses keyed by content.
+
+    Keys are derived from the model name, the generation config and the prompt
+    parts, with uploaded files identified by the SHA-256 of their bytes rather
+    than by their per-upload Gemini name. Entries are evicted least recently
+    used first once the cache grows beyond max_bytes or an entry has not been
+    used for max_age_days, checked when the cache is opened and every
+    EVICT_EVERY_WRITES writes.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "responses.sqlite")
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._file_digests = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " text TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    def register_file(self, uploaded_file, digest):
+        """
+        Remember the content digest of an uploaded file so prompts using it can be keyed.
+
+        Args:
+            uploaded_file: Gemini file returned by upload_file
+            digest (str): SHA-256 hex digest of the uploaded bytes
+        """
+        with self._lock:
+            self._file_digests[uploaded_file.name] = digest
+
+    def make_key(self, model_name, contents, generation_config=None):
+        """
+        Build the cache key for a generate_content call.
+
+        Args:
+            model_name (str): Name of the model
+            contents: Prompt parts (strings and uploaded files) or a single prompt string
+            generation_config (dict): Generation config passed to the model
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        if not isinstance(contents, (list, tuple)):
+            contents = [contents]
+        parts = []
+        for part in contents:
+            if isinstance(part, str):
+                parts.append(["text", part])
+            else:
+                # Deferred uploads carry their digest; files uploaded without a registered digest
+                # never produce cache hits
+                digest = getattr(part, "content_digest", None)
+                if digest is None:
+                    name = getattr(part, "name", repr(part))
+                    digest = self._file_digests.get(name, f"uncached:{name}")
+                parts.append(["file", digest])
+        payload = json.dumps(
+            {"model": model_name, "config": generation_config or {}, "contents": parts},
+            sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key, parse=None):
+        """
+        Look up a cached response text.
+
+        Args:
+            key (str): Key from make_key
+            parse (callable): Parser the text must pass; entries it raises on, e.g. malformed
+                JSON cached by an older version, are deleted and count as a miss
+
+        Returns:
+            str: The cached text, or None on a miss
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and parse is not None:
+                try:
+                    parse(row[0])
+                except Exception:
+                    print(f"WARNING: Dropping malformed cached response")
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                    row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, text):
+        """
+        Store a response text.
+
+        Args:
+            key (str): Key from make_key
+            text (str): Response text
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, text, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, text, len(text.encode("utf-8")), now, now)
+            )
+            self._conn.commit()
+            self._writes += 1
+            due = self._writes % EVICT_EVERY_WRITES == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove expired entries and trim the cache to max_bytes, least recently used first.
+
+        Returns:
+            int: Number of entries removed
+        """
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM responses WHERE last_access < ?", (time.time() - self.max_age_seconds,)
+            ).rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall()
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    total -= size
+                    removed += 1
+            self._conn.commit()
+        if removed:
+            print(f"Evicted {removed} cached responses")
+        return removed
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+        print(f"Cleared response cache: {self.path}")
+
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._conn.close()
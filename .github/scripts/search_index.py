@@ -0,0 +1,275 @@
+"""
+Precomputed inverted index of the Norwegian posts for client-side search.
+
+The index is updated one post at a time as posts are written. Run the module
+directly to add existing posts, e.g. after cloning or for the first time:
+
+    python .github/scripts/search_index.py _posts/*.markdown
+"""
+import argparse
+import json
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+
+# Search index served with the site and loaded by the search page
+DEFAULT_SEARCH_INDEX = "assets/search-index.json"
+# Format of the index file; bump it when the layout of 'docs' or 'terms' changes
+SEARCH_INDEX_VERSION = 1
+
+# Weight of one occurrence of a term in each field of a post
+FIELD_WEIGHTS = {'title': 5, 'authors': 3, 'body': 1}
+# Upper bound of the weight of a term in one post, so long summaries do not drown titles
+MAX_TERM_WEIGHT = 30
+# Terms shorter than this are not indexed
+MIN_TERM_LENGTH = 2
+
+# Frequent Norwegian words, and the English ones common in paper titles, that are not indexed
+STOPWORDS = frozenset("""
+    og i jeg det at en et den til er som på de med han av ikke ikkje der så var meg seg men ett har om vi
+    min mitt ha hadde hun nå over da ved fra du ut sin dem oss opp man kan hans hvor eller hva skal selv
+    sjøl her alle vil bli ble blei blitt kunne inn når være kom noen noe ville dere deres kun ja etter ned
+    skulle denne for deg si sine sitt mot å meget hvorfor dette disse uten hvordan ingen din ditt blir samme
+    hvilken hvilke sånn inni mellom vår hver hvem vors hvis både bare enn fordi før mange også slik vært
+    båe begge siden dykk dykkar dei deira deim di då eg ein eit eitt elles honom hjå ho hoe henne hennar
+    hennes hoss hossen ingi inkje korleis korso kva kvar kvarhelst kven kvi kvifor me medan mi mine mykje
+    no nokon noka nokor noko nokre sia sidan so somt somme um upp vere vore verte vort varte vart
+    the of and a an in on for to with by from as is are be at or via its this that we our using
+""".split())
+
+# Post front matter and Markdown syntax stripped before tokenizing
+FRONT_MATTER_PATTERN = re.compile(r'\A---\n(.*?)\n---\n', re.DOTALL)
+HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+HEADING_PATTERN = re.compile(r'^#+ .*$', re.MULTILINE)
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+_VOWELS = "aeiouyæåø"
+# Suffixes of the Snowball Norwegian stemmer, longest first within each step
+_STEP1_SUFFIXES = sorted((
+    "a e ede ande ende ane ene hetene en heten ar er heter as es edes endes enes hetenes ens hetens ers "
+    "ets et het ast erte ert s"
+).split(), key=len, reverse=True)
+_STEP3_SUFFIXES = sorted("leg eleg ig eig lig elig els lov elov slov hetslov".split(), key=len, reverse=True)
+_S_ENDINGS = "bcdfghjlmnoprtvyz"
+
+_lock = threading.Lock()
+
+
+def _r1_start(word):
+    """Return the start of region R1: after the first non-vowel following a vowel, but at least 3."""
+    for i in range(1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            return max(3, i + 1)
+    return len(word)
+
+
+def stem(word):
+    """
+    Reduce a lowercase Norwegian word to its stem with the Snowball Norwegian algorithm.
+
+    Args:
+        word (str): Lowercase word
+
+    Returns:
+        str: The stem, a prefix of the word except for -erte/-ert becoming -er
+    """
+    r1 = _r1_start(word)
+
+    # Step 1: inflectional suffixes
+    for suffix in _STEP1_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= r1:
+            if suffix in ("erte", "ert"):
+                word = word[:-len(suffix)] + "er"
+            elif suffix == "s":
+                before = word[-2:-1]
+                if before and (before in _S_ENDINGS or (before == "k" and word[-3:-2] not in _VOWELS)):
+                    word = word[:-1]
+            else:
+                word = word[:-len(suffix)]
+            break
+
+    # Step 2: -dt and -vt lose the t
+    if word.endswith(("dt", "vt")) and len(word) - 1 >= r1:
+        word = word[:-1]
+
+    # Step 3: derivational suffixes
+    for suffix in _STEP3_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= r1:
+            word = word[:-len(suffix)]
+            break
+    return word
+
+
+def tokenize(text):
+    """
+    Split text into stemmed index terms.
+
+    Args:
+        text (str): Text in Norwegian or English
+
+    Returns:
+        list: Terms in the order they appear, stopwords and very short words removed
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    terms = []
+    for word in TOKEN_PATTERN.findall(text):
+        if word in STOPWORDS:
+            continue
+        term = word if word.isdigit() else stem(word)
+        if len(term) >= MIN_TERM_LENGTH:
+            terms.append(term)
+    return terms
+
+
+def read_post(post_path):
+    """
+    Read the searchable fields of a post written by write_blog_post.
+
+    Args:
+        post_path (str): Path of the Markdown post
+
+    Returns:
+        dict: 'id', 'url', 'title', 'authors', 'date', 'lang' and 'body' (summaries without
+            headings and figure markup)
+
+    Raises:
+        ValueError: If the post has no front matter or the file name does not start with a date
+    """
+    with open(post_path, encoding="utf-8") as f:
+        text = f.read()
+    match = FRONT_MATTER_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"{post_path} has no front matter")
+    front_matter = {}
+    for line in match.group(1).splitlines():
+        key, _, value = line.partition(":")
+        front_matter[key.strip()] = value.strip().strip('"')
+
+    name = os.path.splitext(os.path.basename(post_path))[0]
+    date_match = re.match(r'(\d{4})-(\d{2})-(\d{2})-(.+)', name)
+    if not date_match:
+        raise ValueError(f"{post_path} does not start with a date")
+    year, month, day, slug = date_match.groups()
+    # Jekyll's default 'date' permalink: /:categories/:year/:month/:day/:title.html
+    categories = "".join(f"/{category}" for category in front_matter.get('categories', "").split())
+
+    body = HEADING_PATTERN.sub(" ", HTML_TAG_PATTERN.sub(" ", text[match.end():]))
+    return {
+        'id': front_matter.get('paper_id') or slug,
+        'url': f"{categories}/{year}/{month}/{day}/{slug}.html",
+        'title': front_matter.get('title', ""),
+        'authors': front_matter.get('authors', ""),
+        'date': f"{year}-{month}-{day}",
+        'lang': front_matter.get('lang'),
+        'body': body,
+    }
+
+
+def _term_weights(post):
+    weights = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in tokenize(post[field]):
+            weights[term] = weights.get(term, 0) + weight
+    return {term: min(weight, MAX_TERM_WEIGHT) for term, weight in weights.items()}
+
+
+def _load(index_path):
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get('version') == SEARCH_INDEX_VERSION:
+            return index
+        print(f"WARNING: Search index {index_path} has an old format, starting a new one")
+    except FileNotFoundError:
+        pass
+    return {'version': SEARCH_INDEX_VERSION, 'docs': [], 'terms': {}}
+
+
+def _save(index, index_path):
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(index_path)}.", dir=os.path.dirname(index_path) or ".")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def add_posts_to_search_index(post_paths, index_path=DEFAULT_SEARCH_INDEX):
+    """
+    Add or replace posts in the search index without touching the other posts.
+
+    Only the given posts are read and tokenized. The index is a JSON file with
+    'docs', a list of [id, url, title, authors, date], and 'terms', mapping each
+    stemmed term to a flat list of document number and weight pairs. A paper
+    already in the index keeps its document number and gets its postings
+    replaced. Posts with a 'lang' (other languages than Norwegian) are skipped.
+
+    Args:
+        post_paths (list): Paths of the Markdown posts
+        index_path (str): Path of the index file
+
+    Returns:
+        int: Number of posts added or replaced
+    """
+    posts = []
+    for post_path in post_paths:
+        try:
+            post = read_post(post_path)
+        except (OSError, ValueError) as e:
+            print(f"ERROR: Failed to read post {post_path} for the search index: {e}")
+            continue
+        if post['lang']:
+            print(f"Skipping {post_path} in the search index (language '{post['lang']}')")
+            continue
+        posts.append(post)
+    if not posts:
+        return 0
+
+    with _lock:
+        index = _load(index_path)
+        numbers = {doc[0]: number for number, doc in enumerate(index['docs'])}
+        for post in posts:
+            doc = [post['id'], post['url'], post['title'], post['authors'], post['date']]
+            number = numbers.get(post['id'])
+            if number is None:
+                number = numbers[post['id']] = len(index['docs'])
+                index['docs'].append(doc)
+            else:
+                # Drop the postings of the previous version of the post
+                index['docs'][number] = doc
+                for term in list(index['terms']):
+                    postings = index['terms'][term]
+                    kept = [value for i in range(0, len(postings), 2) if postings[i] != number
+                            for value in postings[i:i + 2]]
+                    if len(kept) != len(postings):
+                        if kept:
+                            index['terms'][term] = kept
+                        else:
+                            del index['terms'][term]
+            for term, weight in _term_weights(post).items():
+                index['terms'].setdefault(term, []).extend((number, weight))
+        _save(index, index_path)
+
+    print(f"Search index {index_path}: {len(posts)} posts added, {len(index['docs'])} posts "
+          f"and {len(index['terms'])} terms in total ({os.path.getsize(index_path)} bytes)")
+    return len(posts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add posts to the client-side search index.")
+    parser.add_argument("posts", nargs="+", help="Markdown posts, e.g. _posts/*.markdown")
+    parser.add_argument("--index", default=DEFAULT_SEARCH_INDEX,
+                        help=f"Path of the search index (default: {DEFAULT_SEARCH_INDEX})")
+    args = parser.parse_args()
+    add_posts_to_search_index(args.posts, args.index)
+
+
+if __name__ == "__main__":
+    main()
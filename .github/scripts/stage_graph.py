@@ -0,0 +1,98 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from tracing import trace_span
+
+
+def _run_stage(name, func, results):
+    with trace_span("stage", stage=name):
+        return func(results)
+
+
+def required_stages(stages, targets):
+    """
+    Restrict a stage graph to the stages needed to produce the given targets.
+
+    Args:
+        stages (dict): Mapping of stage name to a (dependencies, function) tuple
+        targets (iterable): Names of the stages whose results are needed
+
+    Returns:
+        dict: The targets and everything they transitively depend on
+    """
+    needed = set()
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(stages[name][0])
+    return {name: stage for name, stage in stages.items() if name in needed}
+
+
+def run_stage_graph(stages, max_concurrency=4):
+    """
+    Run a dependency graph of pipeline stages on a bounded thread pool.
+
+    Each stage starts as soon as all of its dependencies have finished, so the
+    total wall time approaches the length of the critical path instead of the
+    sum of all stages.
+
+    Args:
+        stages (dict): Mapping of stage name to a (dependencies, function) tuple.
+            The function is called with a dict of the results of all stages
+            finished so far and its return value becomes the stage result.
+        max_concurrency (int): Maximum number of stages running at the same time
+
+    Returns:
+        dict: Mapping of stage name to the stage result
+
+    Raises:
+        ValueError: If a stage depends on an unknown stage or the graph has a cycle
+        Exception: The first exception raised by a stage, after running stages finish
+    """
+    for name, (deps, _) in stages.items():
+        for dep in deps:
+            if dep not in stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+
+    results = {}
+    pending = dict(stages)
+    running = {}
+    started_at = {}
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        while pending or running:
+            # Submit every stage whose dependencies are satisfied
+            if error is None:
+                for name in list(pending):
+                    deps, func = pending[name]
+                    if all(dep in results for dep in deps):
+                        del pending[name]
+                        started_at[name] = time.monotonic()
+                        # Each stage runs in a copy of the caller's context so context variables propagate
+                        context = contextvars.copy_context()
+                        running[executor.submit(context.run, _run_stage, name, func, dict(results))] = name
+
+            if not running:
+                if pending and error is None:
+                    raise ValueError(f"Stage graph has a cycle or unsatisfiable stages: {sorted(pending)}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                elapsed = time.monotonic() - started_at[name]
+                try:
+                    results[name] = future.result()
+                    print(f"Stage '{name}' finished in {elapsed:.1f}s")
+                except Exception as e:
+                    print(f"ERROR: Stage '{name}' failed after {elapsed:.1f}s: {e}")
+                    if error is None:
+                        error = e
+
+    if error is not None:
+        raise error
+    return results
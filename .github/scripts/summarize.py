@@ -1,360 +1,239 @@
+"""
+Summarize research papers as Norwegian blog posts for three reading levels with Gemini.
+
+PyMuPDF (fitz), Pillow, NumPy and the Gemini SDK are imported in the functions
+using them, here and in the modules next to this script, so usage errors and
+the local subcommands start without loading them.
+"""
 
 import os
+import argparse
 import sys
 import datetime
 import pathlib
-import base64
-import re
-import fitz  # PyMuPDF
-from PIL import Image
-import io
-import google.generativeai as genai
+import contextvars
+import glob
+import json
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from asset_store import ASSETS_DIR, picture_html, prune_paper_assets, store_figure
+from backends import FakeBackend, GeminiBackend
+from checkpoint import DEFAULT_CHECKPOINT_DIR, PaperCheckpoint
+from corpus_index import DEFAULT_INDEX_DIR, CorpusIndex
+from figures import DEFAULT_MAX_FIGURES, iter_figures, select_top_figures, spill_figures
+from gemini_client import DEFAULT_REQUEST_TIMEOUT, GeminiClient
+from model_routing import DEFAULT_ROUTING_PROFILE, ROUTING_PROFILES, build_routes, format_routes
+from long_document import generate_advanced_summary_from_notes, is_long_document, split_document, summarize_chunk
+from paper_metadata import extract_local_metadata, missing_metadata_fields, resolve_paper_metadata
+from paper_queue import DEFAULT_MAX_ATTEMPTS, DEFAULT_QUEUE_DIR, PRIORITY_BACKLOG, PRIORITY_NEW, PaperQueue
+from paper_watcher import DEFAULT_POLL_INTERVAL, PaperWatcher
+from rate_limiter import DEFAULT_MAX_RETRIES, DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE, RateLimiter
+from response_cache import ResponseCache, DEFAULT_CACHE_DIR
+from search_index import DEFAULT_SEARCH_INDEX, add_posts_to_search_index
+from stage_graph import required_stages, run_stage_graph
+from tracing import TRACER, trace_span
+from translations import DEFAULT_LANGUAGE, LANGUAGES, parse_languages, translate_summaries
+from usage_report import set_current_paper
+
+# Maximum number of Gemini calls running at the same time for one paper
+DEFAULT_MAX_CONCURRENCY = 4
+# Maximum number of papers processed at the same time in batch mode
+DEFAULT_MAX_PAPERS = 3
+# Maximum number of figure uploads or deletions running at the same time for one paper
+DEFAULT_UPLOAD_CONCURRENCY = 4
+
+# Version of the prompts and stage outputs; bump it when they change so --resume discards old checkpoints
+PIPELINE_VERSION = 4
 
-def extract_figures_from_pdf(pdf_path):
+# Stages whose outputs are saved to the per-paper checkpoint and skipped by --resume,
+# besides the translation_<language> and chunk_summary_<n> stages of the paper and
+# the 'reflection' running in the background
+CHECKPOINT_STAGES = (
+    'metadata', 'advanced_summary', 'high_school_summary', 'child_summary', 'figure_selection',
+)
+
+# Audience levels in the order they appear in prompts and posts
+AUDIENCE_LEVELS = ('university', 'high_school', 'child')
+
+def parse_figure_selection(selection_result, figure_count):
     """
-    Extract all figures/images from a PDF file.
-    
+    Strictly parse the JSON figure selection returned by the model.
+
     Args:
-        pdf_path (str): Path to the PDF file
-        
+        selection_result (str): Model response, a JSON object mapping audience level
+            to a 1-based image number or null
+        figure_count (int): Number of candidate images shown to the model
+
     Returns:
-        list: List of dictionaries containing figure data and metadata
+        dict: Mapping of audience level to a 0-based image index, or None for no figure
+
+    Raises:
+        ValueError: If the response is not a JSON object
     """
-    print(f"=== Extracting figures from PDF ===")
-    figures = []
-    
-    try:
-        # Open PDF document
-        doc = fitz.open(pdf_path)
-        print(f"Opened PDF with {len(doc)} pages")
-        
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            image_list = page.get_images()
-            
-            print(f"Page {page_num + 1}: Found {len(image_list)} images")
-            
-            for img_index, img in enumerate(image_list):
-                # Get image data
-                xref = img[0]
-                pix = fitz.Pixmap(doc, xref)
-                
-                # Skip if image is too small (likely not a figure)
-                if pix.width < 100 or pix.height < 100:
-                    pix = None
-                    continue
-                
-                # Convert to PIL Image
-                if pix.n - pix.alpha < 4:  # GRAY or RGB
-                    img_data = pix.tobytes("png")
-                    pil_image = Image.open(io.BytesIO(img_data))
-                    
-                    # Create figure metadata
-                    figure_info = {
-                        'page': page_num + 1,
-                        'index': img_index,
-                        'width': pix.width,
-                        'height': pix.height,
-                        'image_data': img_data,
-                        'pil_image': pil_image,
-                        'id': f"fig_{page_num + 1}_{img_index}"
-                    }
-                    
-                    figures.append(figure_info)
-                    print(f"  Extracted figure {figure_info['id']}: {pix.width}x{pix.height}")
-                
-                pix = None
-                
-        doc.close()
-        print(f"Total figures extracted: {len(figures)}")
-        return figures
-        
-    except Exception as e:
-        print(f"ERROR: Failed to extract figures: {e}")
-        return []
+    data = json.loads(selection_result)
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
 
-def select_figure_for_summary(model, uploaded_figures, summary_text, audience_level):
+    selection = {}
+    for audience_level in AUDIENCE_LEVELS:
+        value = data.get(audience_level)
+        if isinstance(value, str) and value.strip().isdigit():
+            value = int(value)
+        if value is None or (isinstance(value, str) and value.strip().upper() == "NONE"):
+            selection[audience_level] = None
+        elif isinstance(value, int) and not isinstance(value, bool) and 1 <= value <= figure_count:
+            selection[audience_level] = value - 1
+        else:
+            print(f"WARNING: Ignoring invalid figure selection for {audience_level} level: {value!r}")
+            selection[audience_level] = None
+    return selection
+
+def select_figures_for_summaries(client, uploaded_figures, summaries):
     """
-    Select the most appropriate figure for a given summary and audience level.
-    
+    Select the most appropriate figure for every audience level in one model call.
+
+    The figures are sent once together with all summaries and the model answers
+    with a JSON mapping of audience level to image number.
+
     Args:
-        model: Gemini model instance
+        client: GeminiClient instance
         uploaded_figures: List of uploaded figures with metadata
-        summary_text: The summary text to match against
-        audience_level: Target audience ('child', 'high_school', 'university')
-        
+        summaries (dict): Mapping of audience level ('university', 'high_school', 'child') to summary text
+
     Returns:
-        dict: Selected figure info or None if no appropriate figure found
+        dict: Mapping of audience level to the selected uploaded figure, or None
     """
+    no_selection = {audience_level: None for audience_level in AUDIENCE_LEVELS}
     if not uploaded_figures:
-        print(f"No figures available for {audience_level} level selection")
-        return None
-    
-    print(f"=== Selecting figure for {audience_level} level ===")
-    
-    # Create selection prompt
+        print(f"No figures available for figure selection")
+        return no_selection
+
+    print(f"=== Selecting figures for all summary levels ===")
+
+    summary_sections = "\n\n".join(
+        f"    {audience_level} summary: {summaries[audience_level]}" for audience_level in AUDIENCE_LEVELS
+    )
     selection_prompt = f"""
-    You are analyzing figures from a research paper to select the most appropriate one for a specific audience level.
+    You are analyzing figures from a research paper to select the most appropriate one for each of three audience levels.
     
-    Target Audience: {audience_level}
-    Summary Text: {summary_text}
+{summary_sections}
     
-    I will show you several figures from the paper. Please:
-    1. Analyze each figure for its relevance to the summary content
-    2. Consider the complexity level appropriate for the target audience:
-       - Child: Simple, visual, easy to understand diagrams or photos
-       - High School: Moderately complex charts, clear illustrations
-       - University: Complex graphs, technical diagrams, detailed visualizations
-    3. Select the MOST appropriate figure, or respond with "NONE" if no figure is suitable
+    I will show you several images from the paper, numbered Image 1 to Image {len(uploaded_figures)}. Please:
+    1. Analyze each image for its relevance to each summary
+    2. Consider the complexity level appropriate for each target audience:
+       - child: Simple, visual, easy to understand diagrams or photos
+       - high_school: Moderately complex charts, clear illustrations
+       - university: Complex graphs, technical diagrams, detailed visualizations
+    3. Select the MOST appropriate image for each audience, or null if no image is suitable
     
-    Respond with only the figure number (e.g., "Figure 1") or "NONE".
+    Respond with only a JSON object with the keys "university", "high_school" and "child",
+    each set to an image number or null, for example {{"university": 2, "high_school": 1, "child": null}}.
     """
-    
+
     try:
         # Prepare content for the model
         content = [selection_prompt]
         
-        # Add each figure with a label
+        # Add each figure with a label and its caption, if any
         for i, fig_info in enumerate(uploaded_figures):
-            content.append(f"Figure {i+1}:")
+            caption = fig_info['metadata'].get('caption')
+            content.append(f"Image {i+1}" + (f" (caption: {caption}):" if caption else ":"))
             content.append(fig_info['gemini_file'])
         
-        # Get model response
-        response = model.generate_content(content)
+        response = client.generate_content(
+            content, generation_config={"response_mime_type": "application/json"}, stage="figure_selection"
+        )
         selection_result = response.text.strip()
-        
         print(f"Model selection result: {selection_result}")
-        
-        # Parse the response
-        if selection_result.upper() == "NONE":
-            print(f"No appropriate figure selected for {audience_level} level")
-            return None
-        
-        # Extract figure number
-        if "Figure" in selection_result or "figure" in selection_result:
-            try:
-                # Extract number from response like "Figure 1" or "figure 2"
-                import re
-                match = re.search(r'[Ff]igure (\d+)', selection_result)
-                if match:
-                    fig_num = int(match.group(1)) - 1  # Convert to 0-based index
-                    if 0 <= fig_num < len(uploaded_figures):
-                        selected_fig = uploaded_figures[fig_num]
-                        print(f"Selected figure {fig_num + 1} for {audience_level} level")
-                        return selected_fig
-            except (ValueError, IndexError):
-                pass
-        
-        print(f"Could not parse figure selection result: {selection_result}")
-        return None
-        
+
+        selection = parse_figure_selection(selection_result, len(uploaded_figures))
     except Exception as e:
-        print(f"ERROR: Failed to select figure for {audience_level} level: {e}")
-        return None
+        print(f"ERROR: Failed to select figures: {e}")
+        return no_selection
 
-def create_summary(paper_path):
-    """
-    Generates a blog post with summaries of a research paper for different audiences.
+    selected_figures = {}
+    for audience_level, index in selection.items():
+        if index is None:
+            print(f"No appropriate figure selected for {audience_level} level")
+            selected_figures[audience_level] = None
+        else:
+            print(f"Selected figure {index + 1} for {audience_level} level")
+            selected_figures[audience_level] = uploaded_figures[index]
+    return selected_figures
 
-    Args:
-        paper_path (str): The path to the PDF file of the research paper.
+def upload_figures(client, figures, max_workers=DEFAULT_UPLOAD_CONCURRENCY):
     """
-    print(f"=== Starting summarization process ===")
-    print(f"Paper path: {paper_path}")
-    
-    paper_name = pathlib.Path(paper_path).stem
-    print(f"Paper name: {paper_name}")
+    Upload extracted figures to Gemini concurrently so they can be used in prompts.
 
-    # --- API Configuration ---
-    print(f"=== Configuring Gemini API ===")
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("ERROR: GEMINI_API_KEY environment variable not set.")
-        raise ValueError("GEMINI_API_KEY environment variable not set.")
-    
-    print(f"API key found: {api_key[:10]}...")
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    print("Gemini model configured successfully.")
+    Each figure is uploaded from the file written by spill_figures with its
+    MIME type, so nothing is decoded or encoded again. With a response cache the
+    uploads are deferred until the figure selection misses the cache.
 
-    # --- File Reading ---
-    print(f"=== Uploading PDF file ===")
-    print(f"Reading paper: {paper_path}")
-    try:
-        pdf_file = genai.upload_file(path=paper_path)
-        print(f"Successfully uploaded file: {pdf_file.name}")
-        print(f"File size: {pdf_file.size_bytes} bytes")
-        print(f"File MIME type: {pdf_file.mime_type}")
-    except Exception as e:
-        print(f"ERROR: Failed to upload file: {e}")
-        raise
+    Args:
+        client: GeminiClient instance
+        figures (list): Figures from select_top_figures
+        max_workers (int): Maximum number of uploads running at the same time
 
-    # --- Extract Figures from PDF ---
-    print(f"=== Extracting figures from PDF ===")
-    figures = extract_figures_from_pdf(paper_path)
-    
-    # Upload figures to Gemini for analysis
-    uploaded_figures = []
-    for figure in figures:
+    Returns:
+        list: Figures with their PendingUpload and metadata, in the order given
+    """
+    def upload(figure):
         try:
-            # Save figure temporarily
-            temp_fig_path = f"temp_{figure['id']}.png"
-            figure['pil_image'].save(temp_fig_path)
-            
-            # Upload to Gemini
-            uploaded_fig = genai.upload_file(path=temp_fig_path)
-            uploaded_figures.append({
+            uploaded_fig = client.defer_upload(
+                path=figure['path'], mime_type=figure['mime_type'], display_name=figure['id'], stage="upload_figures"
+            )
+            if uploaded_fig.file is not None:
+                print(f"Uploaded figure {figure['id']} to Gemini")
+            return {
                 'gemini_file': uploaded_fig,
                 'metadata': figure,
-                'temp_path': temp_fig_path
-            })
-            print(f"Uploaded figure {figure['id']} to Gemini")
-            
+            }
         except Exception as e:
             print(f"ERROR: Failed to upload figure {figure['id']}: {e}")
-            continue
+            return None
 
-    # --- Extract Paper Title ---
-    print(f"=== Extracting paper title ===")
-    title_prompt = "Extract the title of this research paper. Return only the title, nothing else:"
-    print(f"Title extraction prompt: {title_prompt}")
-    
-    try:
-        title_response = model.generate_content([title_prompt, pdf_file])
-        paper_title = title_response.text.strip()
-        print(f"Raw title response: '{title_response.text}'")
-        print(f"Cleaned title: '{paper_title}'")
-        print(f"Title length: {len(paper_title)} characters")
-    except Exception as e:
-        print(f"ERROR: Failed to extract title: {e}")
-        paper_title = ""
-    
-    # Fallback to filename if title extraction fails or is too short
-    if not paper_title or len(paper_title) < 5:
-        paper_title = paper_name
-        print(f"Title too short or empty, using filename as title: {paper_title}")
-    else:
-        print(f"Successfully extracted title: {paper_title}")
+    figures = list(figures)
+    if not figures:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(figures)))) as executor:
+        # Run each upload in a copy of the current context so it is attributed to this paper
+        futures = [executor.submit(contextvars.copy_context().run, upload, figure) for figure in figures]
+        uploaded_figures = [fig for fig in (future.result() for future in futures) if fig is not None]
+    print(f"Prepared {len(uploaded_figures)} of {len(figures)} figures")
+    return uploaded_figures
 
-    # --- Extract Authors ---
-    print(f"=== Extracting authors ===")
-    authors_prompt = "Extract the authors of this research paper. Return only the authors' names separated by commas, nothing else:"
-    print(f"Authors extraction prompt: {authors_prompt}")
-    
-    try:
-        authors_response = model.generate_content([authors_prompt, pdf_file])
-        paper_authors = authors_response.text.strip()
-        print(f"Raw authors response: '{authors_response.text}'")
-        print(f"Cleaned authors: '{paper_authors}'")
-        print(f"Authors length: {len(paper_authors)} characters")
-    except Exception as e:
-        print(f"ERROR: Failed to extract authors: {e}")
-        paper_authors = ""
-    
-    # Clean up authors string and validate
-    if paper_authors and len(paper_authors) > 2:
-        print(f"Processing authors string...")
-        # Remove any extra text that might be included
-        paper_authors = paper_authors.replace("Authors:", "").replace("By:", "").strip()
-        print(f"After cleanup: '{paper_authors}'")
-        
-        # Ensure it doesn't look like an error message
-        if "unable" in paper_authors.lower() or "cannot" in paper_authors.lower() or "error" in paper_authors.lower():
-            print("Authors string contains error indicators, clearing...")
-            paper_authors = ""
-    else:
-        print("Authors string too short, clearing...")
-        paper_authors = ""
-    
-    if not paper_authors:
-        print("Final result: No authors extracted, leaving blank")
-    else:
-        print(f"Final authors: {paper_authors}")
-
-    # --- Extract Paper Date ---
-    print(f"=== Extracting paper date ===")
-    date_prompt = """Extract the publication date or submission date from this arXiv paper. 
-    Look for dates in formats like:
-    - "Submitted on 15 Mar 2024"
-    - "v1 [cs.AI] 15 Mar 2024"
-    - Any date mentioned in the paper header or metadata
-    
-    Return only the date in YYYY-MM-DD format, nothing else. If no date is found, return "NOT_FOUND"."""
-    print(f"Date extraction prompt: {date_prompt}")
-    
-    try:
-        date_response = model.generate_content([date_prompt, pdf_file])
-        extracted_date = date_response.text.strip()
-        print(f"Raw date response: '{date_response.text}'")
-        print(f"Cleaned date: '{extracted_date}'")
-        
-        # Validate and parse the extracted date
-        paper_date = None
-        if extracted_date and extracted_date.upper() != "NOT_FOUND":
-            try:
-                # Try to parse the date to validate it
-                parsed_date = datetime.datetime.strptime(extracted_date, "%Y-%m-%d")
-                paper_date = extracted_date
-                print(f"Successfully parsed paper date: {paper_date}")
-            except ValueError:
-                print(f"Could not parse extracted date '{extracted_date}', trying alternative parsing...")
-                # Try to extract date from various formats
-                date_patterns = [
-                    r'(\d{4})-(\d{2})-(\d{2})',  # YYYY-MM-DD
-                    r'(\d{1,2})\s+(\w{3})\s+(\d{4})',  # DD MMM YYYY
-                    r'(\w{3})\s+(\d{1,2}),?\s+(\d{4})',  # MMM DD, YYYY
-                ]
-                
-                for pattern in date_patterns:
-                    match = re.search(pattern, extracted_date)
-                    if match:
-                        try:
-                            if pattern == date_patterns[0]:  # YYYY-MM-DD
-                                paper_date = f"{match.group(1)}-{match.group(2)}-{match.group(3)}"
-                            elif pattern == date_patterns[1]:  # DD MMM YYYY
-                                month_map = {
-                                    'Jan': '01', 'Feb': '02', 'Mar': '03', 'Apr': '04',
-                                    'May': '05', 'Jun': '06', 'Jul': '07', 'Aug': '08',
-                                    'Sep': '09', 'Oct': '10', 'Nov': '11', 'Dec': '12'
-                                }
-                                day = match.group(1).zfill(2)
-                                month = month_map.get(match.group(2), '01')
-                                year = match.group(3)
-                                paper_date = f"{year}-{month}-{day}"
-                            elif pattern == date_patterns[2]:  # MMM DD, YYYY
-                                month_map = {
-                                    'Jan': '01', 'Feb': '02', 'Mar': '03', 'Apr': '04',
-                                    'May': '05', 'Jun': '06', 'Jul': '07', 'Aug': '08',
-                                    'Sep': '09', 'Oct': '10', 'Nov': '11', 'Dec': '12'
-                                }
-                                month = month_map.get(match.group(1), '01')
-                                day = match.group(2).zfill(2)
-                                year = match.group(3)
-                                paper_date = f"{year}-{month}-{day}"
-                            
-                            # Validate the constructed date
-                            datetime.datetime.strptime(paper_date, "%Y-%m-%d")
-                            print(f"Successfully parsed alternative date format: {paper_date}")
-                            break
-                        except (ValueError, KeyError):
-                            continue
-        
-        if not paper_date:
-            print("Could not extract or parse paper date, using current date as fallback")
-            paper_date = datetime.datetime.now().strftime("%Y-%m-%d")
-        
-        print(f"Final paper date: {paper_date}")
-        
-    except Exception as e:
-        print(f"ERROR: Failed to extract paper date: {e}")
-        paper_date = datetime.datetime.now().strftime("%Y-%m-%d")
-        print(f"Using current date as fallback: {paper_date}")
+def paper_context(source):
+    """
+    Describe the paper material sent with a prompt.
+
+    Long papers are summarized from notes on their parts, and prompts must
+    not claim the full paper is attached then.
+
+    Args:
+        source: Uploaded PDF file, or notes on the parts of a long paper
+
+    Returns:
+        str: Description for the prompt
+    """
+    if isinstance(source, str):
+        return "[You have notes on each part of the paper, not the full paper]"
+    return "[You have access to the full paper]"
 
-    # --- Set up post path using extracted date ---
-    post_path = f"_posts/{paper_date}-{paper_name}.markdown"
-    print(f"Output post path: {post_path}")
+def generate_advanced_summary(client, pdf_file):
+    """
+    Generate the university level summary from the full paper.
 
-    # --- Advanced Summary Generation ---
+    Args:
+        client: GeminiClient instance
+        pdf_file: Uploaded PDF file
+
+    Returns:
+        str: The English advanced summary
+    """
     print(f"=== Generating Advanced Summary ===")
     advanced_prompt = """
     You are a research paper summarizer. Create a comprehensive summary of this research paper for university/college level students.
@@ -372,7 +251,9 @@ def create_summary(paper_path):
     
     try:
         print("Sending request to Gemini for advanced summary...")
-        advanced_summary_response = model.generate_content([advanced_prompt, pdf_file])
+        advanced_summary_response = client.generate_content(
+            [advanced_prompt, pdf_file], stage="advanced_summary", stream=True
+        )
         advanced_summary = advanced_summary_response.text
         print(f"Advanced summary generated successfully!")
         print(f"Advanced summary length: {len(advanced_summary)} characters")
@@ -380,8 +261,20 @@ def create_summary(paper_path):
     except Exception as e:
         print(f"ERROR: Failed to generate advanced summary: {e}")
         raise
+    return advanced_summary
+
+def generate_high_school_summary(client, pdf_file, advanced_summary):
+    """
+    Generate the high school level summary from the advanced summary.
 
-    # --- High School Summary Generation ---
+    Args:
+        client: GeminiClient instance
+        pdf_file: Uploaded PDF file, or notes on the parts of a long paper
+        advanced_summary (str): The English advanced summary
+
+    Returns:
+        str: The English high school summary
+    """
     print(f"=== Generating High School Summary ===")
     high_school_prompt = f"""
     You are a research paper summarizer. Based on the following advanced summary, create a summary suitable for high school students.
@@ -394,6 +287,8 @@ def create_summary(paper_path):
     - Be concise (aim for 200-300 words)
     - Write in English initially
     
+    Original Paper Context: {paper_context(pdf_file)}
+    
     Advanced Summary: {advanced_summary}
     
     Create a high school level summary:
@@ -402,7 +297,9 @@ def create_summary(paper_path):
     
     try:
         print("Sending request to Gemini for high school summary...")
-        high_school_summary_response = model.generate_content([high_school_prompt, pdf_file])
+        high_school_summary_response = client.generate_content(
+            [high_school_prompt, pdf_file], stage="high_school_summary", stream=True
+        )
         high_school_summary = high_school_summary_response.text
         print(f"High school summary generated successfully!")
         print(f"High school summary length: {len(high_school_summary)} characters")
@@ -410,8 +307,20 @@ def create_summary(paper_path):
     except Exception as e:
         print(f"ERROR: Failed to generate high school summary: {e}")
         raise
+    return high_school_summary
 
-    # --- Child Summary Generation ---
+def generate_child_summary(client, pdf_file, high_school_summary):
+    """
+    Generate the child level summary from the high school summary.
+
+    Args:
+        client: GeminiClient instance
+        pdf_file: Uploaded PDF file, or notes on the parts of a long paper
+        high_school_summary (str): The English high school summary
+
+    Returns:
+        str: The English child summary
+    """
     print(f"=== Generating Child Summary ===")
     child_prompt = f"""
     You are a research paper summarizer. Based on the following high school summary, create a very simple summary for children (ages 8-12).
@@ -424,6 +333,8 @@ def create_summary(paper_path):
     - Be brief (aim for 100-150 words)
     - Write in English initially
     
+    Original Paper Context: {paper_context(pdf_file)}
+    
     High School Summary: {high_school_summary}
     
     Create a child-friendly summary:
@@ -432,7 +343,7 @@ def create_summary(paper_path):
     
     try:
         print("Sending request to Gemini for child summary...")
-        child_summary_response = model.generate_content([child_prompt, pdf_file])
+        child_summary_response = client.generate_content([child_prompt, pdf_file], stage="child_summary", stream=True)
         child_summary = child_summary_response.text
         print(f"Child summary generated successfully!")
         print(f"Child summary length: {len(child_summary)} characters")
@@ -440,171 +351,225 @@ def create_summary(paper_path):
     except Exception as e:
         print(f"ERROR: Failed to generate child summary: {e}")
         raise
+    return child_summary
 
-    # --- Translation to Norwegian ---
-    print(f"=== Translating summaries to Norwegian ===")
-    
-    # Translate Advanced Summary
-    print(f"=== Translating Advanced Summary ===")
-    advanced_translation_prompt = f"""
-    Translate the following academic summary to Norwegian. Maintain the academic tone and technical accuracy.
-    Use Norwegian academic terminology where appropriate.
-    
-    Text to translate: {advanced_summary}
+def parse_reflection(reflection_result):
     """
-    print(f"Advanced translation prompt prepared ({len(advanced_translation_prompt)} characters)")
-    
-    try:
-        print("Sending request to Gemini for advanced summary translation...")
-        advanced_norwegian_response = model.generate_content([advanced_translation_prompt])
-        advanced_summary_no = advanced_norwegian_response.text
-        print(f"Advanced summary translated successfully!")
-        print(f"Norwegian advanced summary length: {len(advanced_summary_no)} characters")
-        print(f"Norwegian advanced summary preview: {advanced_summary_no[:200]}...")
-    except Exception as e:
-        print(f"ERROR: Failed to translate advanced summary: {e}")
-        raise
+    Strictly parse the JSON verdict returned by the quality reflection.
 
-    # Translate High School Summary
-    print(f"=== Translating High School Summary ===")
-    high_school_translation_prompt = f"""
-    Translate the following high school level summary to Norwegian. Maintain the appropriate language level for Norwegian teenagers.
-    Use Norwegian terminology that high school students would understand.
-    
-    Text to translate: {high_school_summary}
+    Args:
+        reflection_result (str): Model response, a JSON object mapping each audience level
+            to an object with 'pass' (bool) and 'issues' (list of strings)
+
+    Returns:
+        dict: Mapping of audience level to {'pass': bool, 'issues': list}
+
+    Raises:
+        ValueError: If the response is not a JSON object with a verdict for every level
     """
-    print(f"High school translation prompt prepared ({len(high_school_translation_prompt)} characters)")
-    
-    try:
-        print("Sending request to Gemini for high school summary translation...")
-        high_school_norwegian_response = model.generate_content([high_school_translation_prompt])
-        high_school_summary_no = high_school_norwegian_response.text
-        print(f"High school summary translated successfully!")
-        print(f"Norwegian high school summary length: {len(high_school_summary_no)} characters")
-        print(f"Norwegian high school summary preview: {high_school_summary_no[:200]}...")
-    except Exception as e:
-        print(f"ERROR: Failed to translate high school summary: {e}")
-        raise
+    data = json.loads(reflection_result)
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
 
-    # Translate Child Summary
-    print(f"=== Translating Child Summary ===")
-    child_translation_prompt = f"""
-    Translate the following child-friendly summary to Norwegian. Use simple Norwegian that Norwegian children would understand.
-    Keep the fun and engaging tone. Use Norwegian words and expressions that are familiar to Norwegian children.
-    
-    Text to translate: {child_summary}
+    verdict = {}
+    for audience_level in AUDIENCE_LEVELS:
+        level = data.get(audience_level)
+        if not isinstance(level, dict) or not isinstance(level.get('pass'), bool):
+            raise ValueError(f"missing verdict for {audience_level} level: {level!r}")
+        issues = level.get('issues') or []
+        if not isinstance(issues, list):
+            issues = [issues]
+        verdict[audience_level] = {'pass': level['pass'], 'issues': [str(issue) for issue in issues if issue]}
+    return verdict
+
+def reflect_on_summaries(client, pdf_file, summaries, language_name="Norwegian", deadline=None):
     """
-    print(f"Child translation prompt prepared ({len(child_translation_prompt)} characters)")
-    
-    try:
-        print("Sending request to Gemini for child summary translation...")
-        child_norwegian_response = model.generate_content([child_translation_prompt])
-        child_summary_no = child_norwegian_response.text
-        print(f"Child summary translated successfully!")
-        print(f"Norwegian child summary length: {len(child_summary_no)} characters")
-        print(f"Norwegian child summary preview: {child_summary_no[:200]}...")
-    except Exception as e:
-        print(f"ERROR: Failed to translate child summary: {e}")
-        raise
+    Ask the model to review the summaries of the main post against the paper.
+
+    Args:
+        client: GeminiClient instance
+        pdf_file: Uploaded PDF file, or notes on the parts of a long paper
+        summaries (dict): Mapping of audience level to the summary in the main language
+        language_name (str): Language of the summaries
+        deadline (float): time.monotonic() by which the call must have finished, or None
+
+    Returns:
+        dict: Verdict per audience level from parse_reflection
 
-    # --- Reflection and Quality Check ---
+    Raises:
+        Exception: If the call fails or the response is not a valid verdict
+    """
     print(f"=== Performing Quality Reflection ===")
     
     reflection_prompt = f"""
-    You are a quality reviewer for Norwegian academic summaries. Review the following three Norwegian summaries of the same research paper and assess:
+    You are a quality reviewer for {language_name} academic summaries. Review the following three {language_name} summaries of the same research paper and assess:
 
     1. Do they accurately reflect the content and findings of the original paper?
     2. Are they appropriate for their target audiences (university, high school, children)?
-    3. Is the Norwegian language natural and correct?
+    3. Is the {language_name} language natural and correct?
     4. Are there any important details missing or misrepresented?
     5. Do they maintain consistency in key facts across all three levels?
 
-    Original Paper Context: [You have access to the full paper]
+    Original Paper Context: {paper_context(pdf_file)}
     
-    Advanced Summary (Norwegian): {advanced_summary_no}
+    Advanced Summary ({language_name}): {summaries['university']}
     
-    High School Summary (Norwegian): {high_school_summary_no}
+    High School Summary ({language_name}): {summaries['high_school']}
     
-    Child Summary (Norwegian): {child_summary_no}
+    Child Summary ({language_name}): {summaries['child']}
     
-    Provide a brief assessment and any recommended improvements. If the summaries are satisfactory, simply state "Summaries are accurate and appropriate for their target audiences."
+    Respond with only a JSON object with the keys "university", "high_school" and "child",
+    each set to an object with "pass" and "issues". Set "pass" to false only for factual errors,
+    misrepresented or missing key findings, a clearly wrong language level or incorrect {language_name};
+    list each problem to fix as a short, concrete instruction in "issues" (an empty list when it passes).
     """
     print(f"Quality reflection prompt prepared ({len(reflection_prompt)} characters)")
     
     try:
         print("Sending request to Gemini for quality reflection...")
-        reflection_response = model.generate_content([reflection_prompt, pdf_file])
-        reflection_result = reflection_response.text
-        print(f"Quality reflection completed successfully!")
-        print(f"Reflection result length: {len(reflection_result)} characters")
-        print(f"Quality reflection result: {reflection_result}")
+        reflection_response = client.generate_content(
+            [reflection_prompt, pdf_file], generation_config={"response_mime_type": "application/json"},
+            stage="reflection", parse=parse_reflection, deadline=deadline
+        )
+        verdict = parse_reflection(reflection_response.text)
     except Exception as e:
         print(f"ERROR: Failed to perform quality reflection: {e}")
-        print("Continuing with summaries despite reflection failure...")
-        reflection_result = "Quality reflection failed but summaries generated successfully."
-
-    # Use Norwegian summaries for the final output
-    print(f"=== Using Norwegian summaries for final output ===")
-    advanced_summary = advanced_summary_no
-    high_school_summary = high_school_summary_no
-    child_summary = child_summary_no
-    print("Successfully switched to Norwegian summaries for final output.")
-
-    # --- Select Figures for Each Summary Level ---
-    print(f"=== Selecting figures for each summary level ===")
-    
-    # Select figure for university level
-    selected_university_fig = select_figure_for_summary(
-        model, uploaded_figures, advanced_summary, "university"
-    )
-    
-    # Select figure for high school level
-    selected_high_school_fig = select_figure_for_summary(
-        model, uploaded_figures, high_school_summary, "high_school"
+        raise
+    for audience_level, level in verdict.items():
+        status = "pass" if level['pass'] else "FAIL"
+        print(f"Quality reflection {audience_level}: {status}" + "".join(f"\n  - {issue}" for issue in level['issues']))
+    return verdict
+
+def revise_summaries(client, pdf_file, summaries, verdict, language_name="Norwegian", deadline=None):
+    """
+    Rewrite only the summaries that failed the quality reflection, in one structured call.
+
+    Args:
+        client: GeminiClient instance
+        pdf_file: Uploaded PDF file, or notes on the parts of a long paper
+        summaries (dict): Mapping of audience level to the summary in the main language
+        verdict (dict): Result of reflect_on_summaries
+        language_name (str): Language of the summaries
+        deadline (float): time.monotonic() by which the call must have finished, or None
+
+    Returns:
+        dict: Mapping of each failed audience level to its revised summary; empty if all passed
+
+    Raises:
+        ValueError: If the response lacks a revised text for a failed level
+    """
+    failed = [level for level in AUDIENCE_LEVELS if not verdict[level]['pass']]
+    if not failed:
+        return {}
+
+    print(f"=== Revising {', '.join(failed)} summaries ===")
+    readers = {'university': "university students", 'high_school': "high school students", 'child': "children"}
+    sections = "\n\n".join(
+        f"    {level} summary (for {readers[level]}):\n    {summaries[level]}\n"
+        f"    Issues to fix:\n" + "\n".join(f"    - {issue}" for issue in verdict[level]['issues'] or ["(none given)"])
+        for level in failed
     )
-    
-    # Select figure for child level
-    selected_child_fig = select_figure_for_summary(
-        model, uploaded_figures, child_summary, "child"
+    revision_prompt = f"""
+    A reviewer checked these {language_name} summaries of the research paper against the paper
+    and found the issues listed under each. Rewrite each summary in {language_name} so that every
+    issue is fixed, keeping everything else: the structure, headings, length, tone and language
+    level for its readers.
+
+{sections}
+
+    Return a JSON object with the keys {', '.join(failed)}, each holding the full revised summary.
+    """
+
+    def parse_revision(revision_result):
+        data = json.loads(revision_result)
+        revised = {}
+        for level in failed:
+            text = data.get(level) if isinstance(data, dict) else None
+            if not isinstance(text, str) or not text.strip():
+                raise ValueError(f"missing revised {level} summary")
+            revised[level] = text.strip()
+        return revised
+
+    response = client.generate_content(
+        [revision_prompt, pdf_file],
+        generation_config={
+            "response_mime_type": "application/json",
+            "response_schema": {
+                'type': "OBJECT",
+                'properties': {level: {'type': "STRING"} for level in failed},
+                'required': failed,
+            },
+        },
+        stage="revision", stream=True, parse=parse_revision, deadline=deadline
     )
-    
-    # Save selected figures to assets directory
+    revised = parse_revision(response.text)
+    for level in revised:
+        print(f"Revised {level} summary length: {len(revised[level])} characters")
+    return revised
+
+def save_selected_figures(paper_name, selected_university_fig, selected_high_school_fig, selected_child_fig):
+    """
+    Save the figures selected for each audience level to the asset store of the paper.
+
+    A figure selected for several levels is stored once and referenced from
+    every section.
+
+    Args:
+        paper_name (str): Paper file name without extension
+        selected_university_fig (dict): Uploaded figure selected for university level, or None
+        selected_high_school_fig (dict): Uploaded figure selected for high school level, or None
+        selected_child_fig (dict): Uploaded figure selected for child level, or None
+
+    Returns:
+        dict: Mapping of audience level to its stored figure from store_figure
+    """
     selected_figures = {}
-    paper_assets_dir = f"assets/papers/{paper_name}"
-    
-    if selected_university_fig or selected_high_school_fig or selected_child_fig:
-        print(f"Creating assets directory: {paper_assets_dir}")
+    levels = (
+        ('university', selected_university_fig),
+        ('high_school', selected_high_school_fig),
+        ('child', selected_child_fig),
+    )
+
+    if any(figure for _, figure in levels):
+        print(f"Storing figures in: {ASSETS_DIR}/{paper_name}")
         try:
-            os.makedirs(paper_assets_dir, exist_ok=True)
-            
-            # Save university figure
-            if selected_university_fig:
-                university_fig_path = f"{paper_assets_dir}/university_fig.png"
-                selected_university_fig['metadata']['pil_image'].save(university_fig_path)
-                selected_figures['university'] = f"/assets/papers/{paper_name}/university_fig.png"
-                print(f"Saved university figure to: {university_fig_path}")
-            
-            # Save high school figure
-            if selected_high_school_fig:
-                high_school_fig_path = f"{paper_assets_dir}/high_school_fig.png"
-                selected_high_school_fig['metadata']['pil_image'].save(high_school_fig_path)
-                selected_figures['high_school'] = f"/assets/papers/{paper_name}/high_school_fig.png"
-                print(f"Saved high school figure to: {high_school_fig_path}")
-            
-            # Save child figure
-            if selected_child_fig:
-                child_fig_path = f"{paper_assets_dir}/child_fig.png"
-                selected_child_fig['metadata']['pil_image'].save(child_fig_path)
-                selected_figures['child'] = f"/assets/papers/{paper_name}/child_fig.png"
-                print(f"Saved child figure to: {child_fig_path}")
-                
+            stored = {}
+            for level, figure in levels:
+                if not figure:
+                    continue
+                figure_id = figure['metadata']['id']
+                if figure_id not in stored:
+                    stored[figure_id] = store_figure(paper_name, figure['metadata']['path'])
+                selected_figures[level] = stored[figure_id]
+                print(f"Saved {level.replace('_', ' ')} figure as: {stored[figure_id]['src']}")
         except Exception as e:
             print(f"ERROR: Failed to save figures: {e}")
             selected_figures = {}
-    
-    print(f"Selected figures: {selected_figures}")
 
-    # --- Create Markdown Blog Post ---
+    print(f"Selected figures: { {level: asset['src'] for level, asset in selected_figures.items()} }")
+    return selected_figures
+
+def write_blog_post(post_path, paper_name, paper_title, paper_authors, paper_date,
+                    child_summary, high_school_summary, advanced_summary, selected_figures,
+                    language=DEFAULT_LANGUAGE):
+    """
+    Write the tabbed Markdown blog post for a paper.
+
+    Posts in other languages than DEFAULT_LANGUAGE also get 'lang' and the
+    'tab_headings' the layout splits the sections on in their front matter.
+
+    Args:
+        post_path (str): Output path of the post
+        paper_name (str): Paper file name without extension
+        paper_title (str): Paper title
+        paper_authors (str): Comma separated authors
+        paper_date (str): Paper date in YYYY-MM-DD format
+        child_summary (str): Translated child summary
+        high_school_summary (str): Translated high school summary
+        advanced_summary (str): Translated advanced summary
+        selected_figures (dict): Mapping of audience level to its stored figure from store_figure
+        language (str): Code of the language of the post in LANGUAGES
+    """
     print(f"=== Creating Markdown Blog Post ===")
     # Use extracted paper date with a default time
     paper_datetime = datetime.datetime.strptime(paper_date, "%Y-%m-%d")
@@ -613,51 +578,58 @@ def create_summary(paper_path):
     full_timestamp = paper_datetime.strftime('%Y-%m-%d %H:%M:%S %z')
     print(f"Paper date timestamp: {full_timestamp}")
 
+    headings = LANGUAGES[language]['headings']
+    figure_alt = LANGUAGES[language]['figure_alt']
+
     # Build figure sections
-    child_figure_section = ""
-    if 'child' in selected_figures:
-        child_figure_section = f'\n\n![Figure for barn]({selected_figures["child"]})\n'
-    
-    high_school_figure_section = ""
-    if 'high_school' in selected_figures:
-        high_school_figure_section = f'\n\n![Figure for videregående]({selected_figures["high_school"]})\n'
-    
-    university_figure_section = ""
-    if 'university' in selected_figures:
-        university_figure_section = f'\n\n![Figure for universitets- og høyskolenivå]({selected_figures["university"]})\n'
+    figure_sections = {}
+    for level in AUDIENCE_LEVELS:
+        figure_sections[level] = ""
+        if level in selected_figures:
+            figure_sections[level] = f'\n\n{picture_html(selected_figures[level], figure_alt[level])}\n'
 
-    file_content = f"""---
+    language_front_matter = ""
+    if language != DEFAULT_LANGUAGE:
+        tab_headings = ", ".join(f'"{headings[level]}"' for level in ('child', 'high_school', 'university'))
+        language_front_matter = f'lang: "{language}"\ntab_headings: [{tab_headings}]\n'
+
+    front_matter = f"""---
 layout: tabbed_post
 title:  "{paper_title}"
 paper_id: "{paper_name}"
 authors: "{paper_authors}"
 date:   {full_timestamp}
 categories: ai forskning
----
-
-## For Barn
-
-{child_summary}{child_figure_section}
-
-## For Videregåendeelever
-
-{high_school_summary}{high_school_figure_section}
-
-## For Universitets- og Høyskolenivå
-
-{advanced_summary}{university_figure_section}
+{language_front_matter}---
 """
+    sections = [
+        (headings['child'], child_summary, figure_sections['child']),
+        (headings['high_school'], high_school_summary, figure_sections['high_school']),
+        (headings['university'], advanced_summary, figure_sections['university']),
+    ]
 
-    print(f"Blog post content prepared ({len(file_content)} characters)")
     print(f"Creating directory: {os.path.dirname(post_path)}")
     
     try:
         os.makedirs(os.path.dirname(post_path), exist_ok=True)
         print("Directory created successfully.")
         
+        # The post is assembled section by section in a hidden temporary file next to it and
+        # renamed into place once complete, so Jekyll and git never see a partially written post
         print(f"Writing blog post to: {post_path}")
-        with open(post_path, "w", encoding="utf-8") as f:
-            f.write(file_content)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(post_path)}.", dir=os.path.dirname(post_path))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(front_matter)
+                for heading, summary, figure_section in sections:
+                    f.write(f"\n## {heading}\n\n{summary}{figure_section}\n")
+                    print(f"Wrote section '{heading}' ({len(summary)} characters)")
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, post_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
         print(f"Blog post created successfully at: {post_path}")
         
         # Verify file was created
@@ -670,59 +642,858 @@ categories: ai forskning
     except Exception as e:
         print(f"ERROR: Failed to create blog post: {e}")
         raise
-    
-    # --- Clean up uploaded files ---
+
+def cleanup_uploaded_files(client, pdf_file, uploaded_figures, max_workers=DEFAULT_UPLOAD_CONCURRENCY):
+    """
+    Delete the uploaded PDF and figures from Gemini, deleting figures concurrently.
+
+    Args:
+        client: GeminiClient instance
+        pdf_file: PendingUpload of the PDF from upload_pdf, or None if it was not prepared
+        uploaded_figures (list): Figures returned by upload_figures
+        max_workers (int): Maximum number of deletions running at the same time
+    """
     print(f"=== Cleaning up uploaded files ===")
-    try:
-        print(f"Deleting PDF file: {pdf_file.name}")
-        genai.delete_file(pdf_file.name)
-        print("PDF file deleted successfully.")
-    except Exception as e:
-        print(f"ERROR: Failed to delete uploaded PDF file: {e}")
-        # Don't raise here as the main task is complete
+    # Deferred uploads that every call found in the cache were never uploaded
+    if pdf_file is not None and pdf_file.file is not None:
+        try:
+            print(f"Deleting PDF file: {pdf_file.file.name}")
+            client.delete_file(pdf_file.file.name)
+            print("PDF file deleted successfully.")
+        except Exception as e:
+            print(f"ERROR: Failed to delete uploaded PDF file: {e}")
+            # Don't raise here as the main task is complete
     
     # Clean up uploaded figures
-    for fig_info in uploaded_figures:
+    def delete(fig_info):
         try:
-            print(f"Deleting figure: {fig_info['gemini_file'].name}")
-            genai.delete_file(fig_info['gemini_file'].name)
-            
-            # Remove temporary file
-            if os.path.exists(fig_info['temp_path']):
-                os.remove(fig_info['temp_path'])
-                print(f"Removed temporary file: {fig_info['temp_path']}")
-                
+            print(f"Deleting figure: {fig_info['gemini_file'].file.name}")
+            client.delete_file(fig_info['gemini_file'].file.name)
         except Exception as e:
-            print(f"ERROR: Failed to delete figure {fig_info['gemini_file'].name}: {e}")
+            print(f"ERROR: Failed to delete figure {fig_info['gemini_file'].file.name}: {e}")
             # Don't raise here as the main task is complete
+
+    uploaded_figures = [fig_info for fig_info in uploaded_figures if fig_info['gemini_file'].file is not None]
+    if uploaded_figures:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(uploaded_figures)))) as executor:
+            list(executor.map(delete, uploaded_figures))
+
+def upload_pdf(client, paper_path):
+    """
+    Upload the paper PDF to Gemini, deferred until a call misses the cache if the client has one.
+
+    Args:
+        client: GeminiClient instance
+        paper_path (str): The path to the PDF file
+
+    Returns:
+        PendingUpload: The PDF, usable in prompts like an uploaded file
+    """
+    print(f"=== Uploading PDF file ===")
+    print(f"Reading paper: {paper_path}")
+    try:
+        pdf_file = client.defer_upload(path=paper_path, stage="upload_pdf")
+        if pdf_file.file is None:
+            print(f"Upload deferred until a prompt using the PDF is not cached")
+        else:
+            print(f"Successfully uploaded file: {pdf_file.file.name}")
+            print(f"File size: {pdf_file.file.size_bytes} bytes")
+            print(f"File MIME type: {pdf_file.file.mime_type}")
+    except Exception as e:
+        print(f"ERROR: Failed to upload file: {e}")
+        raise
+    return pdf_file
+
+def configure_gemini(cache=None, rate_limiter=None, max_retries=DEFAULT_MAX_RETRIES,
+                     request_timeout=DEFAULT_REQUEST_TIMEOUT, streaming=True, backend=None, routes=None):
+    """
+    Configure the Gemini API from the GEMINI_API_KEY environment variable.
+
+    Args:
+        cache (ResponseCache): Optional response cache shared by all calls
+        rate_limiter (RateLimiter): Limiter shared by all calls; defaults to the free tier quota
+        max_retries (int): Retries of calls failing with transient errors
+        request_timeout (float): Seconds before a model request is abandoned and retried
+        streaming (bool): Stream summaries and translations with progress output
+        backend: Backend to send requests to, e.g. FakeBackend for offline runs;
+            defaults to the Gemini API, which requires GEMINI_API_KEY
+        routes (dict): Model and generation settings per stage from build_routes;
+            defaults to the balanced profile
+
+    Returns:
+        GeminiClient: Configured client
+    """
+    print(f"=== Configuring Gemini API ===")
+    if backend is None:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            print("ERROR: GEMINI_API_KEY environment variable not set.")
+            raise ValueError("GEMINI_API_KEY environment variable not set.")
+
+        print(f"API key found: {api_key[:10]}...")
+        backend = GeminiBackend(api_key)
+    else:
+        print(f"Using {type(backend).__name__} instead of the Gemini API")
+    if routes is None:
+        routes = build_routes()
+    client = GeminiClient(routes['default']['model'], cache=cache, rate_limiter=rate_limiter, max_retries=max_retries,
+                          request_timeout=request_timeout, streaming=streaming, backend=backend, routes=routes)
+    print("Gemini model configured successfully.")
+    print(f"Model routing: {format_routes(routes)}")
+    print(f"Rate limit: {client.rate_limiter.requests_per_minute} requests/min, "
+          f"{client.rate_limiter.tokens_per_minute} tokens/min, up to {max_retries} retries")
+    if cache is not None:
+        print(f"Using response cache: {cache.path}")
+    return client
+
+def create_summary(paper_path, max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None, client=None,
+                   perceptual_dedup=True, max_figures=DEFAULT_MAX_FIGURES, resume=False,
+                   checkpoint_dir=DEFAULT_CHECKPOINT_DIR, long_document=None, corpus_index=None,
+                   languages=(DEFAULT_LANGUAGE,), search_index=DEFAULT_SEARCH_INDEX, reflect=True,
+                   latency_budget=None):
+    """
+    Generates a blog post with summaries of a research paper for different audiences.
+
+    The pipeline is expressed as a graph of stages that run concurrently as soon
+    as their inputs are ready, so the wall time follows the critical path
+    (advanced -> high school -> child -> translation) rather than the sum of all calls.
+    Each language is translated in one call covering all audience levels, and
+    the languages are translated in parallel, so every extra language adds one
+    concurrent call and one post.
+    Long papers are split into parts that are summarized in parallel and reduced
+    into the advanced summary, so their latency does not grow with the length.
+    The output of every model stage is checkpointed as soon as it finishes, and
+    with resume=True stages found in the checkpoint are not run again; the PDF
+    and figures are only uploaded if a remaining stage still needs them.
+    With a corpus index, page text, outline, figure manifest and local metadata
+    are read from the index instead of parsing the PDF again.
+    The Norwegian post is added to the client-side search index, re-tokenizing
+    only this post.
+    The quality reflection runs in the background from when the main summaries
+    exist, so figure selection, figure assets and posts do not wait for it. Levels
+    it fails are revised in one call and the main post is rewritten with them.
+
+    Args:
+        paper_path (str): The path to the PDF file of the research paper.
+        max_concurrency (int): Maximum number of stages running at the same time.
+        cache (ResponseCache): Optional response cache; repeated runs on the same PDF
+            are then served from disk instead of calling Gemini again.
+        client (GeminiClient): Already configured client to reuse, e.g. in batch mode.
+        perceptual_dedup (bool): Collapse visually identical figures before uploading them.
+        max_figures (int): Number of locally top-ranked figures uploaded for figure selection.
+        resume (bool): Reuse stage outputs from the checkpoint of a previous run of the same PDF.
+        checkpoint_dir (str): Directory of the per-paper checkpoint files.
+        long_document (bool): Summarize the paper map-reduce style from parts split locally;
+            None decides automatically from the page count and text length.
+        corpus_index (CorpusIndex): Optional index the paper is looked up in, and added to if missing or changed.
+        languages (tuple): Codes of the languages a post is written in; the first one is also used
+            for reflection and figure selection, and its post is the main 'post_path'.
+        search_index (str): Path of the client-side search index to update; None leaves it untouched.
+        reflect (bool): Review the main summaries and revise the levels failing the review.
+        latency_budget (float): Seconds the paper may take before the reflection is given up: it is
+            not started once the budget is used up, its calls time out when the budget runs out,
+            and the posts are then left unrevised. None waits for it.
+
+    Returns:
+        dict: Paper metadata for GitHub Actions ('title', 'authors', 'id', 'post_path', 'posts'
+            mapping each language to its post path)
+    """
+    paper_name = pathlib.Path(paper_path).stem
+    with trace_span("paper", paper=paper_name, path=str(paper_path)):
+        print(f"=== Starting summarization process ===")
+        print(f"Paper path: {paper_path}")
+    
+        print(f"Paper name: {paper_name}")
+        set_current_paper(paper_name)
+
+        # --- API Configuration ---
+        if client is None:
+            client = configure_gemini(cache=cache)
+
+        started_at = time.monotonic()
+        # Extracted figures are spilled to a temporary directory instead of being kept in memory
+        figure_dir = tempfile.TemporaryDirectory(prefix=f"figures_{paper_name}_")
+
+        # Long papers are split locally and summarized map-reduce style; the notes on the parts
+        # then stand in for the full PDF in the later summaries and the reflection
+        # A current index entry saves reading the page texts again; a new or changed paper is
+        # indexed by the 'corpus_index' stage, in parallel with the uploads
+        entry = corpus_index.get_entry(paper_path) if corpus_index is not None else None
+        page_texts = corpus_index.page_texts(entry['sha256']) if entry else None
+        if long_document is None:
+            long_document = is_long_document(paper_path, page_texts=page_texts)
+        chunks = split_document(paper_path, page_texts=page_texts, toc=entry and entry['toc']) if long_document else []
+        chunk_stages = tuple(f"chunk_summary_{number}" for number in range(1, len(chunks) + 1))
+        translation_stages = {language: f"translation_{language}" for language in languages}
+        primary = translation_stages[languages[0]]
+        source_stage = 'paper_notes' if chunks else 'pdf_file'
+
+        def source(r):
+            if chunks:
+                return f"Notes on each part of the paper:\n{r['paper_notes']}"
+            return r['pdf_file']
+
+        checkpoint = PaperCheckpoint(
+            paper_path, PIPELINE_VERSION,
+            options={'model': client.model_name, 'routes': client.routes, 'max_figures': max_figures, 'perceptual_dedup': perceptual_dedup,
+                     'long_document': bool(chunks)},
+            checkpoint_dir=checkpoint_dir, resume=resume,
+        )
+
+        # The PDF is uploaded at most once, by the first stage needing it
+        pdf_upload = {}
+        pdf_upload_lock = threading.Lock()
+
+        def uploaded_pdf():
+            with pdf_upload_lock:
+                if 'file' not in pdf_upload:
+                    pdf_upload['file'] = upload_pdf(client, paper_path)
+                return pdf_upload['file']
+
+        # --- Stage Graph ---
+        # Each stage lists the stages it depends on; independent stages run in parallel
+        stages = {
+            'pdf_file': ((), lambda r: uploaded_pdf()),
+            'figures': ((), lambda r: spill_figures(paper_path, select_top_figures(
+                iter_figures(paper_path, perceptual_dedup=perceptual_dedup), max_figures), figure_dir.name)),
+            'uploaded_figures': (('figures',), lambda r: upload_figures(client, r['figures'])),
+            'local_metadata': ((), lambda r: extract_local_metadata(paper_path)),
+            # Metadata only waits for the upload if the local extraction left fields missing
+            'metadata_pdf_file': (('local_metadata',), lambda r: uploaded_pdf()
+                                  if missing_metadata_fields(r['local_metadata']) else None),
+            'metadata': (('local_metadata', 'metadata_pdf_file'), lambda r: resolve_paper_metadata(
+                client, r['metadata_pdf_file'], paper_name, r['local_metadata'])),
+            'advanced_summary': (('pdf_file',), lambda r: generate_advanced_summary(client, r['pdf_file'])),
+            'high_school_summary': ((source_stage, 'advanced_summary'), lambda r: generate_high_school_summary(
+                client, source(r), r['advanced_summary'])),
+            'child_summary': ((source_stage, 'high_school_summary'), lambda r: generate_child_summary(
+                client, source(r), r['high_school_summary'])),
+            # Figures are selected against the summaries of the main post;
+            # the selection is kept as figure ids so it can be checkpointed
+            'figure_selection': (('uploaded_figures', primary),
+                                 lambda r: {
+                                     level: fig['metadata']['id'] if fig else None
+                                     for level, fig in select_figures_for_summaries(
+                                         client, r['uploaded_figures'], r[primary]).items()
+                                 }),
+        }
+        # One batched call per language, all running in parallel once the English summaries exist
+        for language, name in translation_stages.items():
+            stages[name] = (('advanced_summary', 'high_school_summary', 'child_summary'),
+                            lambda r, language=language: translate_summaries(client, {
+                                'university': r['advanced_summary'],
+                                'high_school': r['high_school_summary'],
+                                'child': r['child_summary'],
+                            }, language))
+        # The index holds the local metadata and a figure manifest ranked with perceptual dedup,
+        # so indexing the paper replaces extracting them again
+        if corpus_index is not None:
+            stages['corpus_index'] = ((), lambda r: corpus_index.update_paper(paper_path)[0])
+            stages['local_metadata'] = (('corpus_index',), lambda r: r['corpus_index']['metadata'])
+            if perceptual_dedup:
+                stages['figures'] = (('corpus_index',), lambda r: spill_figures(
+                    paper_path, select_top_figures(r['corpus_index']['figures'], max_figures), figure_dir.name))
+        if chunks:
+            for number, chunk in enumerate(chunks, 1):
+                stages[f"chunk_summary_{number}"] = ((), lambda r, chunk=chunk, number=number: summarize_chunk(
+                    client, chunk, number, len(chunks)))
+            stages['paper_notes'] = (chunk_stages, lambda r: "\n\n".join(r[name] for name in chunk_stages))
+            stages['advanced_summary'] = (('paper_notes',), lambda r: generate_advanced_summary_from_notes(
+                client, r['paper_notes']))
+
+        # The reflection is started by a stage but runs in the background, so the graph does not wait for it.
+        # Its calls time out at the end of the latency budget, so waiting for it never runs past the budget.
+        reflection_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"reflection_{paper_name}")
+        reflection_jobs = {}
+        deadline = None if latency_budget is None else started_at + latency_budget
+
+        def run_reflection(r):
+            language_name = LANGUAGES[languages[0]]['name']
+            verdict = reflect_on_summaries(client, source(r), r[primary], language_name, deadline=deadline)
+            revised = revise_summaries(client, source(r), r[primary], verdict, language_name, deadline=deadline)
+            return checkpoint.save('reflection', {'verdict': verdict, 'revised': revised})
+
+        def start_reflection(r):
+            if deadline is not None and time.monotonic() >= deadline:
+                print(f"Skipping quality reflection, the latency budget of {latency_budget:g}s is used up")
+                return None
+            reflection_jobs['future'] = reflection_executor.submit(contextvars.copy_context().run, run_reflection, r)
+            return None
+
+        def collect_reflection():
+            with trace_span("stage", stage="reflection_wait"):
+                try:
+                    return reflection_jobs.pop('future').result()
+                except Exception as e:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        print(f"WARNING: Quality reflection did not finish within the latency budget of "
+                              f"{latency_budget:g}s, keeping the posts as written")
+                    else:
+                        print(f"ERROR: Quality reflection failed, keeping the posts as written: {e}")
+            return None
+
+        # Revisions of a previous run are applied before the posts are first written
+        reflection = checkpoint.stages.get('reflection') if reflect else None
+        targets = CHECKPOINT_STAGES + tuple(translation_stages.values()) + ('figures',)
+        if reflect and reflection is None:
+            stages['start_reflection'] = ((source_stage, primary), start_reflection)
+            targets += ('start_reflection',)
+
+        # Checkpoint finished model stages and replace stages restored from the checkpoint by their outputs
+        for name in CHECKPOINT_STAGES + tuple(translation_stages.values()) + chunk_stages:
+            if name in checkpoint.stages:
+                stages[name] = ((), lambda r, value=checkpoint.stages[name]: value)
+            else:
+                stages[name] = (stages[name][0], checkpoint.wrap(name, stages[name][1]))
+        if checkpoint.stages:
+            print(f"Resuming {len(checkpoint.stages)} stages from checkpoint: {', '.join(sorted(checkpoint.stages))}")
+        # Uploads and other stages only needed by restored stages are dropped
+        stages = required_stages(stages, targets)
+        if chunks:
+            print(f"Long document mode: {len(chunks)} parts summarized in parallel, then reduced")
+
+        print(f"=== Running {len(stages)} stages with max concurrency {max_concurrency} ===")
+        results = run_stage_graph(stages, max_concurrency=max_concurrency)
+
+        pdf_file = pdf_upload.get('file')
+        uploaded_figures = results.get('uploaded_figures', [])
+        figures_by_id = {figure['id']: {'metadata': figure} for figure in results['figures']}
+        figure_selection = {}
+        for level, figure_id in results['figure_selection'].items():
+            if figure_id and figure_id not in figures_by_id:
+                print(f"WARNING: Selected figure {figure_id} for {level} level was not extracted, skipping it")
+            figure_selection[level] = figures_by_id.get(figure_id)
+        paper_title = results['metadata']['title']
+        paper_authors = results['metadata']['authors']
+        paper_date = results['metadata']['date']
+        # A reflection that already finished is applied before the posts are first written
+        if 'future' in reflection_jobs and reflection_jobs['future'].done():
+            reflection = collect_reflection()
+        if reflection:
+            results[primary] = {**results[primary], **reflection['revised']}
+
+        # --- Set up post paths using extracted date ---
+        # The main post keeps the plain name; posts in further languages get the language code appended
+        posts = {
+            language: f"_posts/{paper_date}-{paper_name}{'' if index == 0 else '-' + language}.markdown"
+            for index, language in enumerate(languages)
+        }
+        post_path = posts[languages[0]]
+        print(f"Output post paths: {posts}")
+
+        # --- Save Selected Figures ---
+        with trace_span("stage", stage="save_figures"):
+            selected_figures = save_selected_figures(
+                paper_name, figure_selection['university'], figure_selection['high_school'], figure_selection['child']
+            )
+            figure_dir.cleanup()
+
+        # --- Create Markdown Blog Posts ---
+        # One post per language, all sharing the stored figures
+        with trace_span("stage", stage="write_post"):
+            for language, name in translation_stages.items():
+                write_blog_post(
+                    posts[language], paper_name, paper_title, paper_authors, paper_date,
+                    results[name]['child'], results[name]['high_school'], results[name]['university'],
+                    selected_figures, language=language
+                )
+            # Every post of the paper now uses these figures, so files of earlier runs can go
+            prune_paper_assets(paper_name, list(selected_figures.values()))
+
+        # --- Update Search Index ---
+        if search_index and DEFAULT_LANGUAGE in posts:
+            with trace_span("stage", stage="search_index"):
+                add_posts_to_search_index([posts[DEFAULT_LANGUAGE]], search_index)
+
+        # --- Apply Quality Reflection ---
+        if 'future' in reflection_jobs:
+            outcome = collect_reflection()
+            if outcome and outcome['revised']:
+                print(f"=== Rewriting {post_path} with the revised {', '.join(outcome['revised'])} summaries ===")
+                results[primary] = {**results[primary], **outcome['revised']}
+                with trace_span("stage", stage="write_post"):
+                    write_blog_post(
+                        post_path, paper_name, paper_title, paper_authors, paper_date,
+                        results[primary]['child'], results[primary]['high_school'], results[primary]['university'],
+                        selected_figures, language=languages[0]
+                    )
+                if search_index and languages[0] == DEFAULT_LANGUAGE:
+                    add_posts_to_search_index([post_path], search_index)
+        # The reflection has finished, so the PDF it uses can be deleted
+        reflection_executor.shutdown()
+    
+        # --- Clean up uploaded files ---
+        with trace_span("stage", stage="cleanup"):
+            cleanup_uploaded_files(client, pdf_file, uploaded_figures)
         
-    print(f"=== Summarization process completed successfully! ===")
-    print(f"Final output: {post_path}")
+        print(f"=== Summarization process completed successfully! ===")
+        print(f"Final output: {post_path}")
     
-    # --- Output metadata for GitHub Actions ---
+        # --- Output metadata for GitHub Actions ---
+        print(f"=== Outputting metadata for GitHub Actions ===")
+        print(f"PAPER_TITLE={paper_title}")
+        print(f"PAPER_AUTHORS={paper_authors}")
+        print(f"PAPER_ID={paper_name}")
+        print(f"POST_PATH={post_path}")
+
+        return {
+            'title': paper_title,
+            'authors': paper_authors,
+            'id': paper_name,
+            'post_path': post_path,
+            'posts': posts,
+        }
+
+def print_local_metadata(paper_paths):
+    """
+    Print the metadata extracted locally from each PDF as JSON, without calling Gemini.
+
+    Args:
+        paper_paths (list): Paths to the PDF files
+    """
+    results = []
+    for paper_path in paper_paths:
+        metadata = extract_local_metadata(paper_path)
+        results.append({'path': paper_path, **metadata})
+    print(f"=== Local metadata ===")
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+def list_figures(paper_paths, perceptual_dedup=True, max_figures=DEFAULT_MAX_FIGURES):
+    """
+    Print the figures extracted and ranked locally from each PDF, without calling Gemini.
+
+    Args:
+        paper_paths (list): Paths to the PDF files
+        perceptual_dedup (bool): Collapse visually identical figures
+        max_figures (int): Number of top-ranked figures marked as uploaded in a real run
+    """
+    for paper_path in paper_paths:
+        figures = list(iter_figures(paper_path, perceptual_dedup=perceptual_dedup))
+        selected = {figure['id'] for figure in select_top_figures(figures, max_figures)}
+        print(f"=== Figures in {paper_path} ({len(figures)} after deduplication, top {len(selected)} marked *) ===")
+        for figure in sorted(figures, key=lambda f: f['score'], reverse=True):
+            mark = "*" if figure['id'] in selected else " "
+            print(f"{mark} {figure['id']:<12} page {figure['page']:>3} {figure['width']:>5}x{figure['height']:<5} "
+                  f"score {figure['score']:.3f}  {figure['caption'][:70] or '(no caption)'}")
+
+def summarize_batch(paper_paths, max_papers=DEFAULT_MAX_PAPERS, max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None,
+                    perceptual_dedup=True, max_figures=DEFAULT_MAX_FIGURES, client=None, resume=False,
+                    checkpoint_dir=DEFAULT_CHECKPOINT_DIR, long_document=None, corpus_index=None,
+                    languages=(DEFAULT_LANGUAGE,), search_index=DEFAULT_SEARCH_INDEX, reflect=True,
+                    latency_budget=None):
+    """
+    Summarize several papers in one process with a shared client and a bounded pool.
+
+    Args:
+        paper_paths (list): Paths to the PDF files
+        max_papers (int): Maximum number of papers processed at the same time
+        max_concurrency (int): Maximum number of stages running at the same time per paper
+        cache (ResponseCache): Optional response cache shared by all papers
+        perceptual_dedup (bool): Collapse visually identical figures before uploading them
+        max_figures (int): Number of locally top-ranked figures uploaded per paper
+        client (GeminiClient): Already configured client to share between papers
+        resume (bool): Reuse stage outputs from the checkpoints of previous runs
+        checkpoint_dir (str): Directory of the per-paper checkpoint files
+        long_document (bool): Force map-reduce summarization on or off; None decides per paper
+        corpus_index (CorpusIndex): Optional index of extracted paper content shared by all papers
+        languages (tuple): Codes of the languages each paper is published in, main language first
+        search_index (str): Path of the client-side search index updated after each paper, or None
+        reflect (bool): Review the main summaries of each paper and revise the levels failing the review
+        latency_budget (float): Seconds per paper after which its reflection is given up, or None
+
+    Returns:
+        tuple: (list of metadata dicts for summarized papers, list of (path, error) for failures)
+    """
+    print(f"=== Summarizing {len(paper_paths)} papers with up to {max_papers} in parallel ===")
+    if client is None:
+        client = configure_gemini(cache=cache)
+
+    processed = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, max_papers)) as executor:
+        futures = {
+            executor.submit(create_summary, path, max_concurrency=max_concurrency, client=client,
+                            perceptual_dedup=perceptual_dedup, max_figures=max_figures, resume=resume,
+                            checkpoint_dir=checkpoint_dir, long_document=long_document,
+                            corpus_index=corpus_index, languages=languages, search_index=search_index,
+                            reflect=reflect, latency_budget=latency_budget): path
+            for path in paper_paths
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                processed[path] = future.result()
+            except Exception as e:
+                print(f"ERROR: Failed to summarize {path}: {e}")
+                failed.append((path, str(e)))
+
+    # Keep the output in the order the papers were given
+    papers = [processed[path] for path in paper_paths if path in processed]
+    print(f"=== Batch completed: {len(papers)} succeeded, {len(failed)} failed ===")
+    return papers, failed
+
+def serve_papers(papers_dir, queue, stop_event, max_papers=DEFAULT_MAX_PAPERS, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 perceptual_dedup=True, max_figures=DEFAULT_MAX_FIGURES, client=None, resume=False,
+                 checkpoint_dir=DEFAULT_CHECKPOINT_DIR, long_document=None, corpus_index=None,
+                 languages=(DEFAULT_LANGUAGE,), search_index=DEFAULT_SEARCH_INDEX,
+                 poll_interval=DEFAULT_POLL_INTERVAL, max_attempts=DEFAULT_MAX_ATTEMPTS, reflect=True,
+                 latency_budget=None, after_paper=None):
+    """
+    Summarize papers added to a directory until stop_event is set.
+
+    PDFs already in the directory are queued as backlog, and new or changed ones
+    are queued with a higher priority as the watcher reports them. A fixed pool
+    of worker threads drains the queue with one shared client, so the SDK,
+    model, cache and rate limiter stay warm and throughput is bound by the API
+    quota rather than process startup. A paper whose attempt fails is retried
+    with resume from its checkpoint until max_attempts. When stop_event is set,
+    no new papers are started and the papers in progress are finished; papers
+    interrupted by a crash are requeued by the queue when it is opened again.
+
+    Args:
+        papers_dir (str): Directory of the PDFs, e.g. _papers
+        queue (PaperQueue): Persistent queue of papers to summarize
+        stop_event (threading.Event): Set to shut down after the papers in progress
+        max_papers (int): Number of worker threads, i.e. papers processed at the same time
+        max_concurrency (int): Maximum number of stages running at the same time per paper
+        perceptual_dedup (bool): Collapse visually identical figures before uploading them
+        max_figures (int): Number of locally top-ranked figures uploaded per paper
+        client (GeminiClient): Already configured client shared by all workers
+        resume (bool): Reuse stage outputs from the checkpoints of previous runs, also on first attempts
+        checkpoint_dir (str): Directory of the per-paper checkpoint files
+        long_document (bool): Force map-reduce summarization on or off; None decides per paper
+        corpus_index (CorpusIndex): Optional index of extracted paper content shared by all papers
+        languages (tuple): Codes of the languages each paper is published in, main language first
+        search_index (str): Path of the client-side search index updated after each paper, or None
+        poll_interval (float): Seconds between directory scans without inotify and between shutdown checks
+        max_attempts (int): Attempts per paper before it is left failed until the file changes
+        reflect (bool): Review the main summaries of each paper and revise the levels failing the review
+        latency_budget (float): Seconds per paper after which its reflection is given up, or None
+        after_paper (callable): Called with the paper name after every attempt, e.g. to write its reports
+
+    Returns:
+        dict: Number of jobs in each queue state when the workers stopped
+    """
+    print(f"=== Serving {papers_dir} with {max_papers} workers ===")
+    if client is None:
+        client = configure_gemini()
+
+    def worker():
+        while not stop_event.is_set():
+            job = queue.claim(timeout=poll_interval)
+            if job is None:
+                continue
+            if stop_event.is_set():
+                queue.release(job)
+                break
+            print(f"=== Worker {threading.current_thread().name} took {job['path']} (attempt {job['attempts']}) ===")
+            try:
+                create_summary(job['path'], max_concurrency=max_concurrency, client=client,
+                               perceptual_dedup=perceptual_dedup, max_figures=max_figures,
+                               resume=resume or job['attempts'] > 1, checkpoint_dir=checkpoint_dir,
+                               long_document=long_document, corpus_index=corpus_index, languages=languages,
+                               search_index=search_index, reflect=reflect, latency_budget=latency_budget)
+            except Exception as e:
+                state = queue.fail(job, str(e), max_attempts=max_attempts)
+                print(f"ERROR: Failed to summarize {job['path']} (attempt {job['attempts']}, now {state}): {e}")
+            else:
+                queue.complete(job)
+            if after_paper is not None:
+                after_paper(pathlib.Path(job['path']).stem)
+            print(f"Queue: {queue.counts()}")
+
+    # Watch before the initial scan, so papers added in between are not missed
+    watcher = PaperWatcher(papers_dir, lambda path: queue.enqueue(path, PRIORITY_NEW), poll_interval=poll_interval)
+    watcher.start()
+    for path in sorted(glob.glob(os.path.join(papers_dir, "*.pdf"))):
+        queue.enqueue(path, PRIORITY_BACKLOG)
+    print(f"Queue: {queue.counts()}")
+
+    workers = [threading.Thread(target=worker, name=f"worker-{i + 1}") for i in range(max(1, max_papers))]
+    for thread in workers:
+        thread.start()
+    # Wait with a timeout so signal handlers run promptly in the main thread
+    while not stop_event.wait(poll_interval):
+        pass
+
+    print(f"=== Shutting down: finishing the papers in progress ===")
+    watcher.stop()
+    queue.wake_all()
+    for thread in workers:
+        thread.join()
+    counts = queue.counts()
+    print(f"=== Stopped serving, queue: {counts} ===")
+    return counts
+
+# Serializes the report writes of the --serve workers
+_REPORT_LOCK = threading.Lock()
+
+def write_reports(client, usage_report, trace=None, chrome_trace=None, paper=None, append=False):
+    """
+    Print the API usage table and write the usage report and traces.
+
+    With append=True, as used by --serve after every paper, the calls of the paper
+    and all finished spans are appended to the files and dropped from memory, so
+    a long-running process does not accumulate them until shutdown. The usage
+    report then holds one JSON line per paper and the Chrome trace uses the
+    appendable JSON array format.
+
+    Args:
+        client: GeminiClient whose usage is reported
+        usage_report (str): Path of the JSON usage report
+        trace (str): Path of the JSON lines trace, or None
+        chrome_trace (str): Path of the Chrome trace, or None
+        paper (str): With append, only report the calls of this paper; None reports all
+        append (bool): Append to the files and drop the written calls and spans from memory
+    """
+    with _REPORT_LOCK:
+        records = client.usage.drain(paper) if append else None
+        spans = TRACER.drain() if append else None
+        if append and not records and not spans:
+            return
+        print(f"=== API usage{f' of {paper}' if paper else ''} ===")
+        print(client.usage.format_table(records))
+        client.usage.write_report(usage_report, records, append=append)
+        if trace:
+            TRACER.write_jsonl(trace, spans, append=append)
+        if chrome_trace:
+            TRACER.write_chrome_trace(chrome_trace, spans, append=append)
+
+def write_metadata_files(papers, failed=()):
+    """
+    Write the metadata of all summarized papers for GitHub Actions.
+
+    _paper_metadata.txt holds single-line KEY=value pairs for $GITHUB_OUTPUT, with
+    the values of several papers joined, and _paper_metadata.json holds the full list.
+
+    Args:
+        papers (list): Metadata dicts returned by create_summary
+        failed (list): (path, error) tuples for papers that failed
+    """
     print(f"=== Outputting metadata for GitHub Actions ===")
-    print(f"PAPER_TITLE={paper_title}")
-    print(f"PAPER_AUTHORS={paper_authors}")
-    print(f"PAPER_ID={paper_name}")
-    print(f"POST_PATH={post_path}")
-    
-    # Write metadata to a file that GitHub Actions can read
     metadata_file = "_paper_metadata.txt"
     try:
         with open(metadata_file, "w", encoding="utf-8") as f:
-            f.write(f"PAPER_TITLE={paper_title}\n")
-            f.write(f"PAPER_AUTHORS={paper_authors}\n")
-            f.write(f"PAPER_ID={paper_name}\n")
-            f.write(f"POST_PATH={post_path}\n")
+            f.write(f"PAPER_TITLE={'; '.join(p['title'] for p in papers)}\n")
+            f.write(f"PAPER_AUTHORS={'; '.join(p['authors'] for p in papers if p['authors'])}\n")
+            f.write(f"PAPER_ID={', '.join(p['id'] for p in papers)}\n")
+            f.write(f"POST_PATH={', '.join(p['post_path'] for p in papers)}\n")
+            f.write(f"PAPERS_PROCESSED={len(papers)}\n")
+            f.write(f"PAPERS_FAILED={len(failed)}\n")
         print(f"Metadata written to: {metadata_file}")
     except Exception as e:
         print(f"ERROR: Failed to write metadata file: {e}")
-        # Don't raise here as the main task is complete
+
+    metadata_json_file = "_paper_metadata.json"
+    try:
+        with open(metadata_json_file, "w", encoding="utf-8") as f:
+            json.dump({
+                'papers': papers,
+                'failed': [{'path': path, 'error': error} for path, error in failed],
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Metadata written to: {metadata_json_file}")
+    except Exception as e:
+        print(f"ERROR: Failed to write metadata file: {e}")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python summarize.py <path_to_paper.pdf>")
+    parser = argparse.ArgumentParser(description="Summarize a research paper into a tabbed Norwegian blog post.")
+    parser.add_argument("paper_path", nargs="?", help="Path to the paper PDF")
+    parser.add_argument("--batch", nargs="+", metavar="PDF",
+                        help="Summarize several papers in one process, e.g. --batch _papers/*.pdf")
+    parser.add_argument("--serve", action="store_true",
+                        help="Keep running, summarizing the PDFs in --papers-dir and every new or changed one "
+                             "from a persistent queue until interrupted")
+    parser.add_argument("--papers-dir", default="_papers",
+                        help="Directory watched by --serve (default: _papers)")
+    parser.add_argument("--queue-dir", default=DEFAULT_QUEUE_DIR,
+                        help=f"Directory of the persistent --serve queue (default: {DEFAULT_QUEUE_DIR})")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="Seconds between directory scans when inotify is unavailable "
+                             f"(default: {DEFAULT_POLL_INTERVAL:g})")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help=f"Attempts per paper in --serve before it is left failed (default: {DEFAULT_MAX_ATTEMPTS})")
+    parser.add_argument("--max-papers", type=int,
+                        default=int(os.getenv("SUMMARIZE_MAX_PAPERS", DEFAULT_MAX_PAPERS)),
+                        help="Maximum number of papers processed at the same time in batch and serve mode "
+                             f"(default: $SUMMARIZE_MAX_PAPERS or {DEFAULT_MAX_PAPERS})")
+    parser.add_argument("--max-concurrency", type=int,
+                        default=int(os.getenv("SUMMARIZE_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+                        help="Maximum number of Gemini calls running at the same time "
+                             f"(default: $SUMMARIZE_MAX_CONCURRENCY or {DEFAULT_MAX_CONCURRENCY})")
+    parser.add_argument("--requests-per-minute", type=int,
+                        default=int(os.getenv("SUMMARIZE_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE)),
+                        help="Gemini requests per minute shared by all papers and stages "
+                             f"(default: $SUMMARIZE_REQUESTS_PER_MINUTE or {DEFAULT_REQUESTS_PER_MINUTE})")
+    parser.add_argument("--tokens-per-minute", type=int,
+                        default=int(os.getenv("SUMMARIZE_TOKENS_PER_MINUTE", DEFAULT_TOKENS_PER_MINUTE)),
+                        help="Gemini prompt tokens per minute shared by all papers and stages "
+                             f"(default: $SUMMARIZE_TOKENS_PER_MINUTE or {DEFAULT_TOKENS_PER_MINUTE})")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help=f"Retries of Gemini calls failing with 429/503 or timeouts (default: {DEFAULT_MAX_RETRIES})")
+    parser.add_argument("--request-timeout", type=float, default=DEFAULT_REQUEST_TIMEOUT,
+                        help=f"Seconds before a Gemini request is abandoned and retried (default: {DEFAULT_REQUEST_TIMEOUT})")
+    parser.add_argument("--no-stream", action="store_true",
+                        help="Wait for complete responses instead of streaming summaries and translations")
+    parser.add_argument("--fake-backend", action="store_true",
+                        help="Use a local fake of the Gemini API with synthetic responses, e.g. for offline test runs")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"Directory of the response cache (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the response cache and always call Gemini")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="Invalidate all cached responses before running")
+    parser.add_argument("--long-document", choices=("auto", "always", "never"), default="auto",
+                        help="Summarize papers in parallel parts and reduce the part summaries: automatically "
+                             "for papers over the page or token threshold, always or never (default: auto)")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR,
+                        help=f"Directory of the corpus index of extracted page text, figures and metadata "
+                             f"(default: {DEFAULT_INDEX_DIR})")
+    parser.add_argument("--no-index", action="store_true",
+                        help="Parse every PDF directly instead of reading and updating the corpus index")
+    parser.add_argument("--search-index", default=DEFAULT_SEARCH_INDEX,
+                        help=f"Client-side search index the Norwegian posts are added to (default: {DEFAULT_SEARCH_INDEX})")
+    parser.add_argument("--no-search-index", action="store_true",
+                        help="Do not update the client-side search index")
+    parser.add_argument("--languages", default=os.getenv("SUMMARIZE_LANGUAGES", DEFAULT_LANGUAGE),
+                        help=f"Comma separated languages to publish each paper in, main post first, from "
+                             f"{', '.join(LANGUAGES)} (default: $SUMMARIZE_LANGUAGES or {DEFAULT_LANGUAGE})")
+    parser.add_argument("--routing", choices=tuple(ROUTING_PROFILES),
+                        default=os.getenv("SUMMARIZE_ROUTING", DEFAULT_ROUTING_PROFILE),
+                        help="Models per stage: balanced (fast model for metadata and figure selection), fast "
+                             "(fast model everywhere), quality (stronger model for summaries and translations) or "
+                             f"single (one model everywhere) (default: $SUMMARIZE_ROUTING or {DEFAULT_ROUTING_PROFILE})")
+    parser.add_argument("--stage-model", action="append", default=[], metavar="STAGE=MODEL",
+                        help="Send one stage to another model, e.g. --stage-model advanced_summary=gemini-2.5-pro; "
+                             "can be repeated")
+    parser.add_argument("--skip-reflection", action="store_true",
+                        help="Skip the quality review of the summaries and the revision of levels failing it")
+    parser.add_argument("--latency-budget", type=float, metavar="SECONDS",
+                        help="Give up the quality review of a paper that has taken this long, publishing its "
+                             "posts unrevised (default: always wait for the review)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip stages finished by a previous run of the same PDF and pipeline version")
+    parser.add_argument("--checkpoint-dir", default=DEFAULT_CHECKPOINT_DIR,
+                        help=f"Directory of the per-paper stage checkpoints (default: {DEFAULT_CHECKPOINT_DIR})")
+    parser.add_argument("--usage-report", default="_usage_report.json",
+                        help="Path of the JSON report of per-call tokens, latency and cost (default: _usage_report.json)")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="Write timing spans of papers, stages and API calls as JSON lines")
+    parser.add_argument("--chrome-trace", metavar="PATH",
+                        help="Write timing spans in Chrome trace format (chrome://tracing, ui.perfetto.dev)")
+    parser.add_argument("--extract-metadata-only", action="store_true",
+                        help="Print the locally extracted title, authors and date as JSON and exit without calling Gemini")
+    parser.add_argument("--list-figures", action="store_true",
+                        help="Print the locally extracted and ranked figures and exit without calling Gemini")
+    parser.add_argument("--no-perceptual-dedup", action="store_true",
+                        help="Only deduplicate figures by xref, not by perceptual hash")
+    parser.add_argument("--max-figures", type=int, default=DEFAULT_MAX_FIGURES,
+                        help="Number of locally top-ranked figures uploaded for figure selection "
+                             f"(default: {DEFAULT_MAX_FIGURES})")
+    args = parser.parse_args()
+    if bool(args.paper_path) + bool(args.batch) + args.serve != 1:
+        parser.error("give either one paper path, --batch with one or more paths, or --serve")
+
+    # Local-only modes never create a Gemini client, so the SDK is not even imported
+    if args.extract_metadata_only or args.list_figures:
+        paper_paths = args.batch or ([args.paper_path] if args.paper_path else
+                                     sorted(glob.glob(os.path.join(args.papers_dir, "*.pdf"))))
+        if args.extract_metadata_only:
+            print_local_metadata(paper_paths)
+        if args.list_figures:
+            list_figures(paper_paths, perceptual_dedup=not args.no_perceptual_dedup, max_figures=args.max_figures)
+        sys.exit(0)
+
+    long_document = {'auto': None, 'always': True, 'never': False}[args.long_document]
+    try:
+        languages = parse_languages(args.languages)
+    except ValueError as e:
+        parser.error(f"--languages: {e}")
+    try:
+        routes = build_routes(args.routing, args.stage_model)
+    except ValueError as e:
+        parser.error(f"--stage-model: {e}")
+
+    queue = None
+    if args.serve:
+        try:
+            queue = PaperQueue(args.queue_dir)
+        except RuntimeError as e:
+            print(f"ERROR: {e}")
+            sys.exit(1)
+
+    cache = None if args.no_cache else ResponseCache(args.cache_dir)
+    corpus_index = None if args.no_index else CorpusIndex(args.index_dir)
+    search_index = None if args.no_search_index else args.search_index
+    if cache is not None and args.clear_cache:
+        cache.clear()
+
+    client = configure_gemini(
+        cache=cache, rate_limiter=RateLimiter(args.requests_per_minute, args.tokens_per_minute),
+        max_retries=args.max_retries, request_timeout=args.request_timeout, streaming=not args.no_stream,
+        backend=FakeBackend() if args.fake_backend else None, routes=routes
+    )
+    try:
+        if args.serve:
+            stop_event = threading.Event()
+
+            def request_stop(signum, frame):
+                if stop_event.is_set():
+                    # Papers in progress stay 'running' in the queue and are requeued on the next start
+                    print(f"=== Aborting ===")
+                    sys.stdout.flush()
+                    os._exit(128 + signum)
+                print(f"=== Received signal {signum}, stopping after the papers in progress (repeat to abort) ===")
+                stop_event.set()
+
+            signal.signal(signal.SIGINT, request_stop)
+            signal.signal(signal.SIGTERM, request_stop)
+            # Reports are appended after every paper, starting from empty files
+            for path in (args.usage_report, args.trace, args.chrome_trace):
+                if path and os.path.exists(path):
+                    os.remove(path)
+            try:
+                serve_papers(
+                    args.papers_dir, queue, stop_event, max_papers=args.max_papers,
+                    max_concurrency=args.max_concurrency, perceptual_dedup=not args.no_perceptual_dedup,
+                    max_figures=args.max_figures, client=client, resume=args.resume,
+                    checkpoint_dir=args.checkpoint_dir, long_document=long_document, corpus_index=corpus_index,
+                    languages=languages, search_index=search_index, poll_interval=args.poll_interval,
+                    max_attempts=args.max_attempts, reflect=not args.skip_reflection,
+                    latency_budget=args.latency_budget,
+                    after_paper=lambda paper: write_reports(client, args.usage_report, args.trace,
+                                                            args.chrome_trace, paper=paper, append=True)
+                )
+            finally:
+                queue.close()
+            # Failed papers are recorded in the queue instead
+            failed = []
+        elif args.batch:
+            papers, failed = summarize_batch(
+                args.batch, max_papers=args.max_papers, max_concurrency=args.max_concurrency, cache=cache,
+                perceptual_dedup=not args.no_perceptual_dedup, max_figures=args.max_figures, client=client,
+                resume=args.resume, checkpoint_dir=args.checkpoint_dir, long_document=long_document,
+                corpus_index=corpus_index, languages=languages, search_index=search_index,
+                reflect=not args.skip_reflection, latency_budget=args.latency_budget
+            )
+            write_metadata_files(papers, failed)
+        else:
+            papers = [create_summary(args.paper_path, max_concurrency=args.max_concurrency, client=client,
+                                     perceptual_dedup=not args.no_perceptual_dedup, max_figures=args.max_figures,
+                                     resume=args.resume, checkpoint_dir=args.checkpoint_dir,
+                                     long_document=long_document, corpus_index=corpus_index,
+                                     languages=languages, search_index=search_index,
+                                     reflect=not args.skip_reflection, latency_budget=args.latency_budget)]
+            failed = []
+            write_metadata_files(papers)
+    finally:
+        # Report usage even for failed runs, since those calls were paid for too;
+        # --serve has reported every finished paper already and appends the rest
+        write_reports(client, args.usage_report, args.trace, args.chrome_trace, append=args.serve)
+        if corpus_index is not None:
+            corpus_index.close()
+
+    if cache is not None:
+        print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+    if failed:
         sys.exit(1)
-    paper_path_arg = sys.argv[1]
-    create_summary(paper_path_arg)
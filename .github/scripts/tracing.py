@@ -0,0 +1,168 @@
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+
+# Span the current thread of work runs in; stage threads inherit it through copied contexts
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+
+class Tracer:
+    """
+    Collects nested timing spans (paper -> stage -> API call) from any thread.
+
+    Spans are plain dicts with start/end times, attributes and errors. The
+    parent of a span is the span active in the current context, so spans
+    created in thread pools nest correctly as long as the work runs in a copy
+    of the submitting context.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.started_at = time.time()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """
+        Time a block of work as a span nested under the current span.
+
+        Args:
+            name (str): Span name, e.g. 'paper', 'stage' or 'generate_content'
+            **attributes: Extra attributes stored with the span
+
+        Yields:
+            dict: The span record; attributes can be added while it is open
+        """
+        parent = _current_span.get()
+        record = {
+            'id': next(self._ids),
+            'parent_id': parent['id'] if parent else None,
+            'name': name,
+            'start': time.time(),
+            'end': None,
+            'duration': None,
+            'thread': threading.get_ident(),
+            'thread_name': threading.current_thread().name,
+            'attributes': dict(attributes),
+            'error': None,
+        }
+        token = _current_span.set(record)
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            record['end'] = time.time()
+            record['duration'] = round(record['end'] - record['start'], 6)
+            with self._lock:
+                self.spans.append(record)
+
+    def finished_spans(self):
+        """
+        Return a snapshot of the finished spans ordered by start time.
+
+        Returns:
+            list: Span records
+        """
+        with self._lock:
+            return sorted(self.spans, key=lambda s: s['start'])
+
+    def drain(self):
+        """
+        Remove the finished spans and return them, e.g. after each paper in a long-running process.
+
+        Returns:
+            list: Span records ordered by start time
+        """
+        with self._lock:
+            spans, self.spans = self.spans, []
+        return sorted(spans, key=lambda s: s['start'])
+
+    def write_jsonl(self, path, spans=None, append=False):
+        """
+        Export the finished spans as JSON lines, one span per line.
+
+        Args:
+            path (str): Output path
+            spans (list): Spans to write, e.g. from drain; defaults to all finished spans
+            append (bool): Append to the file instead of replacing it
+        """
+        if spans is None:
+            spans = self.finished_spans()
+        with open(path, "a" if append else "w", encoding="utf-8") as f:
+            for record in spans:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        print(f"Trace written to: {path}")
+
+    def write_chrome_trace(self, path, spans=None, append=False):
+        """
+        Export the finished spans in Chrome trace event format.
+
+        The file can be opened in chrome://tracing or https://ui.perfetto.dev,
+        with one timeline row per thread. Appending uses the JSON array variant
+        of the format, whose closing bracket is optional, so events can be added
+        to the file as they finish.
+
+        Args:
+            path (str): Output path
+            spans (list): Spans to write, e.g. from drain; defaults to all finished spans
+            append (bool): Append the events to the file instead of replacing it
+        """
+        if spans is None:
+            spans = self.finished_spans()
+        pid = os.getpid()
+        events = []
+        for thread, thread_name in sorted({(s['thread'], s['thread_name']) for s in spans}):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread,
+                           'args': {'name': thread_name}})
+        for record in spans:
+            args = dict(record['attributes'])
+            if record['error']:
+                args['error'] = record['error']
+            label = record['attributes'].get('stage') or record['attributes'].get('paper')
+            events.append({
+                'name': f"{record['name']}:{label}" if label else record['name'],
+                'cat': record['name'],
+                'ph': 'X',
+                'ts': round((record['start'] - self.started_at) * 1_000_000),
+                'dur': round(record['duration'] * 1_000_000),
+                'pid': pid,
+                'tid': record['thread'],
+                'args': args,
+            })
+        if append:
+            started = os.path.exists(path) and os.path.getsize(path) > 0
+            with open(path, "a", encoding="utf-8") as f:
+                if not started:
+                    f.write("[\n")
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False, default=str) + ",\n")
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False, default=str)
+        print(f"Chrome trace written to: {path}")
+
+
+# Process-wide tracer shared by all papers and stages
+TRACER = Tracer()
+
+
+def trace_span(name, **attributes):
+    """
+    Open a span on the process-wide tracer.
+
+    Args:
+        name (str): Span name
+        **attributes: Extra attributes stored with the span
+
+    Returns:
+        Context manager yielding the span record
+    """
+    return TRACER.span(name, **attributes)
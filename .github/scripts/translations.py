@@ -0,0 +1,184 @@
+import json
+
+# Languages posts can be published in. 'readers' describes the audience of each level in
+# the translation prompt; 'headings' and 'figure_alt' are the section headings and image
+# descriptions of each level in the post. Summaries are written in English first, so
+# English posts need no translation call.
+LANGUAGES = {
+    'no': {
+        'name': "Norwegian",
+        'readers': {
+            'university': "Norwegian university students; use Norwegian academic terminology where appropriate",
+            'high_school': "Norwegian teenagers in high school; use terminology they would understand",
+            'child': "Norwegian children; use simple words and expressions familiar to them and keep the fun, engaging tone",
+        },
+        'headings': {
+            'university': "For Universitets- og Høyskolenivå",
+            'high_school': "For Videregåendeelever",
+            'child': "For Barn",
+        },
+        'figure_alt': {
+            'university': "Figure for universitets- og høyskolenivå",
+            'high_school': "Figure for videregående",
+            'child': "Figure for barn",
+        },
+    },
+    'nn': {
+        'name': "Norwegian Nynorsk",
+        'readers': {
+            'university': "Norwegian university students; use Nynorsk academic terminology where appropriate",
+            'high_school': "Norwegian teenagers in high school; use terminology they would understand",
+            'child': "Norwegian children; use simple words and expressions familiar to them and keep the fun, engaging tone",
+        },
+        'headings': {
+            'university': "For universitets- og høgskulenivå",
+            'high_school': "For elevar i vidaregåande",
+            'child': "For born",
+        },
+        'figure_alt': {
+            'university': "Figur for universitets- og høgskulenivå",
+            'high_school': "Figur for vidaregåande",
+            'child': "Figur for born",
+        },
+    },
+    'sv': {
+        'name': "Swedish",
+        'readers': {
+            'university': "Swedish university students; use Swedish academic terminology where appropriate",
+            'high_school': "Swedish teenagers in upper secondary school (gymnasiet); use terminology they would understand",
+            'child': "Swedish children; use simple words and expressions familiar to them and keep the fun, engaging tone",
+        },
+        'headings': {
+            'university': "För universitets- och högskolenivå",
+            'high_school': "För gymnasieelever",
+            'child': "För barn",
+        },
+        'figure_alt': {
+            'university': "Figur för universitets- och högskolenivå",
+            'high_school': "Figur för gymnasiet",
+            'child': "Figur för barn",
+        },
+    },
+    'en': {
+        'name': "English",
+        'readers': None,
+        'headings': {
+            'university': "For University Level",
+            'high_school': "For High School Students",
+            'child': "For Children",
+        },
+        'figure_alt': {
+            'university': "Figure for university level",
+            'high_school': "Figure for high school",
+            'child': "Figure for children",
+        },
+    },
+}
+
+# Language of the main post, whose summaries are also used for reflection and figure selection
+DEFAULT_LANGUAGE = 'no'
+
+# JSON key of each audience level in the batched translation response
+SUMMARY_KEYS = {'university': "university_summary", 'high_school': "high_school_summary", 'child': "child_summary"}
+
+
+def parse_languages(value):
+    """
+    Parse a comma separated list of language codes.
+
+    Args:
+        value (str): Codes such as "no,nn,sv,en"
+
+    Returns:
+        tuple: Unique codes in the order given
+
+    Raises:
+        ValueError: If a code is not in LANGUAGES or no code is given
+    """
+    codes = []
+    for code in (part.strip().lower() for part in value.split(",")):
+        if not code or code in codes:
+            continue
+        if code not in LANGUAGES:
+            raise ValueError(f"unknown language '{code}', expected one of {', '.join(LANGUAGES)}")
+        codes.append(code)
+    if not codes:
+        raise ValueError("no language given")
+    return tuple(codes)
+
+
+def parse_translation(translation_result):
+    """
+    Strictly parse the JSON translation returned by the model.
+
+    Args:
+        translation_result (str): Model response, a JSON object with a text per key in SUMMARY_KEYS
+
+    Returns:
+        dict: Translated summary per audience level
+
+    Raises:
+        ValueError: If the response is not a JSON object with a non-empty text for every level
+    """
+    data = json.loads(translation_result)
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    translated = {}
+    for level, key in SUMMARY_KEYS.items():
+        text = data.get(key)
+        if not isinstance(text, str) or not text.strip():
+            raise ValueError(f"missing translation '{key}'")
+        translated[level] = text.strip()
+    return translated
+
+
+def translate_summaries(client, summaries, language):
+    """
+    Translate the summaries of all audience levels to one language in a single structured call.
+
+    Args:
+        client: GeminiClient instance
+        summaries (dict): English summary per audience level ('university', 'high_school', 'child')
+        language (str): Code of the target language in LANGUAGES
+
+    Returns:
+        dict: Translated summary per audience level
+
+    Raises:
+        ValueError: If the response is not a JSON object with a non-empty text for every level
+    """
+    config = LANGUAGES[language]
+    if config['readers'] is None:
+        print(f"=== Using the English summaries for the {config['name']} post ===")
+        return dict(summaries)
+
+    print(f"=== Translating summaries to {config['name']} ===")
+    sections = "\n\n".join(
+        f"    {SUMMARY_KEYS[level]} (for {config['readers'][level]}):\n    {summaries[level]}"
+        for level in SUMMARY_KEYS
+    )
+    translation_prompt = f"""
+    Translate each of the following summaries of the same research paper to {config['name']}.
+    Keep the content, tone and technical accuracy of each summary, and adapt the language
+    level to the readers given for it.
+
+    Return a JSON object with the keys {', '.join(SUMMARY_KEYS.values())},
+    each holding the translated text of that summary. Return only the JSON object.
+
+{sections}
+    """
+    print(f"{config['name']} translation prompt prepared ({len(translation_prompt)} characters)")
+
+    try:
+        print(f"Sending request to Gemini for {config['name']} translation...")
+        response = client.generate_content(
+            [translation_prompt], generation_config={"response_mime_type": "application/json"},
+            stage=f"translate_{language}", stream=True, parse=parse_translation
+        )
+        translated = parse_translation(response.text)
+        for level in SUMMARY_KEYS:
+            print(f"{config['name']} {level} summary length: {len(translated[level])} characters")
+    except Exception as e:
+        print(f"ERROR: Failed to translate summaries to {config['name']}: {e}")
+        raise
+    return translated
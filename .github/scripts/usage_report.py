@@ -0,0 +1,226 @@
+import contextvars
+import json
+import threading
+import time
+
+# Paper the current thread of work belongs to, used to attribute calls in batch mode
+_current_paper = contextvars.ContextVar("usage_paper", default=None)
+
+# List prices in USD per million tokens (prompt, output, cached prompt); only used for estimates
+MODEL_PRICES = {
+    'gemini-1.5-flash': (0.075, 0.30, 0.01875),
+    'gemini-1.5-flash-8b': (0.0375, 0.15, 0.01),
+    'gemini-1.5-pro': (1.25, 5.00, 0.3125),
+    'gemini-2.0-flash': (0.10, 0.40, 0.025),
+    'gemini-2.5-flash': (0.30, 2.50, 0.075),
+    'gemini-2.5-pro': (1.25, 10.00, 0.31),
+}
+
+
+def set_current_paper(paper_id):
+    """
+    Attribute the following calls made from this context to a paper.
+
+    Args:
+        paper_id (str): Paper file name without extension
+    """
+    _current_paper.set(paper_id)
+
+
+def estimate_cost(model_name, prompt_tokens, output_tokens, cached_tokens):
+    """
+    Estimate the cost of a call from list prices.
+
+    Args:
+        model_name (str): Model name
+        prompt_tokens (int): Prompt tokens, including cached tokens
+        output_tokens (int): Generated tokens
+        cached_tokens (int): Prompt tokens served from the context cache
+
+    Returns:
+        float: Estimated cost in USD, 0 for unknown models
+    """
+    prices = MODEL_PRICES.get(model_name.removeprefix("models/"))
+    if prices is None:
+        return 0.0
+    prompt_price, output_price, cached_price = prices
+    return (
+        (prompt_tokens - cached_tokens) * prompt_price + output_tokens * output_price + cached_tokens * cached_price
+    ) / 1_000_000
+
+
+class UsageRecorder:
+    """
+    Thread-safe record of every Gemini call with wall time, tokens and cost.
+
+    Records are attributed to the paper set with set_current_paper and can be
+    aggregated per paper, per stage and for the whole run.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, kind, stage, model_name, wall_time, usage=None, retries=0, cached=False, error=None):
+        """
+        Record one API call.
+
+        Args:
+            kind (str): 'generate' or 'upload'
+            stage (str): Pipeline stage that made the call
+            model_name (str): Model name, or None for file uploads
+            wall_time (float): Wall time in seconds, including retries
+            usage: usage_metadata of the response, if any
+            retries (int): Number of retries before the call finished
+            cached (bool): Whether the response came from the response cache
+            error (str): Error message if the call failed
+        """
+        prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+        output_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+        cached_tokens = getattr(usage, 'cached_content_token_count', 0) or 0
+        entry = {
+            'paper': _current_paper.get(),
+            'stage': stage,
+            'kind': kind,
+            'model': model_name,
+            'wall_time': round(wall_time, 3),
+            'prompt_tokens': prompt_tokens,
+            'output_tokens': output_tokens,
+            'cached_tokens': cached_tokens,
+            'cost_usd': estimate_cost(model_name, prompt_tokens, output_tokens, cached_tokens) if model_name else 0.0,
+            'retries': retries,
+            'response_cached': cached,
+            'error': error,
+        }
+        with self._lock:
+            self.records.append(entry)
+
+    @staticmethod
+    def _aggregate(records):
+        # Latency of the calls that reached the API; cache hits would hide slow models
+        latencies = sorted(r['wall_time'] for r in records if not r['response_cached'] and not r['error'])
+        return {
+            'calls': len(records),
+            'errors': sum(1 for r in records if r['error']),
+            'cache_hits': sum(1 for r in records if r['response_cached']),
+            'retries': sum(r['retries'] for r in records),
+            'wall_time': round(sum(r['wall_time'] for r in records), 3),
+            'prompt_tokens': sum(r['prompt_tokens'] for r in records),
+            'output_tokens': sum(r['output_tokens'] for r in records),
+            'cached_tokens': sum(r['cached_tokens'] for r in records),
+            'cost_usd': round(sum(r['cost_usd'] for r in records), 6),
+            'models': sorted({r['model'] for r in records if r['model']}),
+            'mean_latency': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50_latency': latencies[len(latencies) // 2] if latencies else None,
+            'max_latency': latencies[-1] if latencies else None,
+        }
+
+    def _group(self, records, key):
+        groups = {}
+        for r in records:
+            groups.setdefault(key(r), []).append(r)
+        return {name: self._aggregate(items) for name, items in sorted(groups.items())}
+
+    def drain(self, paper=None):
+        """
+        Remove recorded calls and return them, e.g. after each paper in a long-running process.
+
+        Args:
+            paper (str): Only remove the calls attributed to this paper; None removes all
+
+        Returns:
+            list: The removed call records
+        """
+        with self._lock:
+            drained = [r for r in self.records if paper is None or r['paper'] == paper]
+            self.records = [r for r in self.records if paper is not None and r['paper'] != paper]
+        return drained
+
+    def summary(self, records=None):
+        """
+        Aggregate the recorded calls.
+
+        Args:
+            records (list): Calls to aggregate, e.g. from drain; defaults to all recorded calls
+
+        Returns:
+            dict: Totals for the run, per paper, per stage and per stage within each paper
+        """
+        if records is None:
+            with self._lock:
+                records = list(self.records)
+
+        def paper_of(r):
+            return r['paper'] or 'unknown'
+
+        per_paper_stage = {}
+        for paper in sorted({paper_of(r) for r in records}):
+            paper_records = [r for r in records if paper_of(r) == paper]
+            per_paper_stage[paper] = self._group(paper_records, lambda r: r['stage'])
+
+        return {
+            'run_wall_time': round(time.time() - self.started_at, 3),
+            'totals': self._aggregate(records),
+            'per_paper': self._group(records, paper_of),
+            'per_stage': self._group(records, lambda r: r['stage']),
+            'per_paper_stage': per_paper_stage,
+        }
+
+    def write_report(self, path, records=None, append=False):
+        """
+        Write the aggregated summary and every call record as JSON.
+
+        Args:
+            path (str): Output path
+            records (list): Calls to report, e.g. from drain; defaults to all recorded calls
+            append (bool): Append the report as one JSON line instead of replacing the file
+        """
+        if records is None:
+            with self._lock:
+                records = list(self.records)
+        report = {'summary': self.summary(records), 'calls': records}
+        if append:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(report, ensure_ascii=False) + "\n")
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Usage report written to: {path}")
+
+    def format_table(self, records=None):
+        """
+        Format the per-stage and per-paper totals, and the latency and model of each stage, as plain text tables.
+
+        Args:
+            records (list): Calls to include, e.g. from drain; defaults to all recorded calls
+
+        Returns:
+            str: The tables
+        """
+        summary = self.summary(records)
+        header = f"{'':<28} {'calls':>5} {'hits':>5} {'retry':>5} {'wall s':>8} {'prompt':>9} {'output':>8} {'cost $':>9}"
+        lines = [header, "-" * len(header)]
+
+        def row(name, stats):
+            return (f"{name[:28]:<28} {stats['calls']:>5} {stats['cache_hits']:>5} {stats['retries']:>5} "
+                    f"{stats['wall_time']:>8.1f} {stats['prompt_tokens']:>9} {stats['output_tokens']:>8} "
+                    f"{stats['cost_usd']:>9.4f}")
+
+        for stage, stats in summary['per_stage'].items():
+            lines.append(row(stage, stats))
+        lines.append("-" * len(header))
+        for paper, stats in summary['per_paper'].items():
+            lines.append(row(f"paper {paper}", stats))
+        lines.append(row("total", summary['totals']))
+        lines.append(f"Run wall time: {summary['run_wall_time']:.1f}s")
+
+        latency_header = f"{'':<28} {'model':<24} {'calls':>5} {'mean s':>7} {'p50 s':>7} {'max s':>7}"
+        lines += ["", latency_header, "-" * len(latency_header)]
+        for stage, stats in summary['per_stage'].items():
+            if stats['mean_latency'] is None or not stats['models']:
+                continue
+            lines.append(f"{stage[:28]:<28} {', '.join(stats['models'])[:24]:<24} "
+                         f"{stats['calls'] - stats['cache_hits'] - stats['errors']:>5} {stats['mean_latency']:>7.2f} "
+                         f"{stats['p50_latency']:>7.2f} {stats['max_latency']:>7.2f}")
+        return "\n".join(lines)